@@ -0,0 +1,37 @@
+#! /usr/bin/env python
+"""
+This script times the eigendecomposition of Q for a reversible mechanism
+(birth-death chain) by the symmetric (eigh) and the general (eig) solver.
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+
+from scalcs import qmatlib as qml
+
+def birth_death_Q(k):
+    """Q matrix of a reversible birth-death chain with k states."""
+    Q = np.zeros((k, k))
+    for i in range(k - 1):
+        Q[i, i+1] = 1000.0 + 10.0 * i
+        Q[i+1, i] = 1500.0 - 5.0 * i
+    return Q - np.diag(np.sum(Q, axis=1))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-k', type=int, nargs='+', default=[10, 50, 100, 200],
+        help='numbers of states')
+    parser.add_argument('-n', type=int, default=20,
+        help='number of repeats')
+    args = parser.parse_args()
+
+    print('k\teigh (s)\teig (s)')
+    for k in args.k:
+        Q = birth_death_Q(k)
+        teigh = min(timeit.repeat(lambda: qml.eigs(Q, reversible=True),
+            number=1, repeat=args.n))
+        teig = min(timeit.repeat(lambda: qml.eigs(Q, reversible=False),
+            number=1, repeat=args.n))
+        print('{0:d}\t{1:.6f}\t{2:.6f}'.format(k, teigh, teig))
@@ -0,0 +1,197 @@
+"""Compact storage of bursts (groups) of open and shut intervals used as
+likelihood input.
+"""
+
+import numpy as np
+
+class Bursts(object):
+    """
+    Bursts of intervals held in two arrays, as in CSR sparse matrices: all
+    intervals, burst after burst, in one contiguous float64 array and the
+    boundaries of bursts in an int64 array of offsets. Each burst starts
+    with an opening and alternates open and shut times. Optional per-burst
+    concentration, resolution and CHS flag override the values in the
+    likelihood opts (see HJClik).
+
+    A Bursts instance behaves like the dictionary {0: burst0, 1: burst1, ...}
+    used so far: len(bursts), iteration over indices and bursts[i] (a view,
+    not a copy) all work. Intervals should not be changed in place, since
+    results of unique and groups are kept.
+
+    Parameters
+    ----------
+    intervals : array_like, shape (n,)
+        All intervals (seconds).
+    offsets : array_like of ints, shape (nbursts + 1,)
+        Burst i is intervals[offsets[i] : offsets[i + 1]].
+    conc, tres : array_like, shape (nbursts,), optional
+        Concentration and time resolution of each burst.
+    chs : array_like of bools, shape (nbursts,), optional
+        Whether CHS vectors (Eq. 5.7, CHS96) are used for each burst.
+    """
+
+    def __init__(self, intervals, offsets, conc=None, tres=None, chs=None):
+        self.intervals = np.ascontiguousarray(intervals, dtype=np.float64)
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+        if (self.offsets.ndim != 1 or self.offsets.shape[0] < 1 or
+            self.offsets[0] != 0 or
+            self.offsets[-1] != self.intervals.shape[0] or
+            np.any(np.diff(self.offsets) < 0)):
+            raise ValueError('Bursts: offsets do not match intervals')
+        nb = self.offsets.shape[0] - 1
+        self.conc = self._meta(conc, nb, np.float64)
+        self.tres = self._meta(tres, nb, np.float64)
+        self.chs = self._meta(chs, nb, bool)
+        self._unique = {}
+        self._groups = None
+
+    @staticmethod
+    def _meta(value, nb, dtype):
+        if value is None:
+            return None
+        value = np.asarray(value, dtype=dtype)
+        if value.ndim == 0:
+            value = np.repeat(value, nb)
+        if value.shape != (nb,):
+            raise ValueError('Bursts: metadata needs one value per burst')
+        return value
+
+    @classmethod
+    def from_dict(cls, bursts, conc=None, tres=None, chs=None):
+        """
+        Make Bursts from a dictionary {0: list, 1: list, ...} or a list of
+        lists of intervals. Dictionary keys need not be contiguous; bursts
+        are taken in sorted key order.
+        """
+        if isinstance(bursts, cls):
+            return bursts
+        if isinstance(bursts, dict):
+            bursts = [bursts[key] for key in sorted(bursts)]
+        nb = len(bursts)
+        lengths = np.array([len(bursts[ind]) for ind in range(nb)],
+            dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        intervals = np.empty(offsets[-1])
+        for ind in range(nb):
+            intervals[offsets[ind] : offsets[ind + 1]] = bursts[ind]
+        return cls(intervals, offsets, conc, tres, chs)
+
+    def to_dict(self):
+        """
+        Bursts as a dictionary {0: list, 1: list, ...} of intervals.
+        """
+        return dict((ind, self[ind].tolist()) for ind in range(len(self)))
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __getitem__(self, ind):
+        return self.intervals[self.offsets[ind] : self.offsets[ind + 1]]
+
+    @property
+    def lengths(self):
+        """Number of intervals in each burst."""
+        return np.diff(self.offsets)
+
+    @property
+    def isopen(self):
+        """True for open times, False for shut times (by position)."""
+        lengths = self.lengths
+        pos = (np.arange(self.intervals.shape[0]) -
+            np.repeat(self.offsets[:-1], lengths))
+        return pos % 2 == 0
+
+    def unique(self, quantum=None, tmin=None):
+        """
+        Distinct open and distinct shut times, optionally after rounding to
+        a multiple of quantum (e.g. the sampling interval; it should be much
+        shorter than the resolution). Intervals not shorter than tmin (e.g.
+        the resolution) are not rounded below it. The result is calculated
+        once per value of quantum and tmin and kept.
+
+        Returns
+        -------
+        topen, tshut : ndarrays
+            Sorted distinct open and shut times.
+        index : ndarray of ints, shape (n,)
+            Position of each interval in topen (open times) or tshut (shut
+            times).
+        """
+        key = quantum, tmin
+        if key not in self._unique:
+            t = self.intervals
+            if quantum:
+                rounded = np.round(t / quantum) * quantum
+                if tmin is not None:
+                    rounded = np.maximum(rounded, np.minimum(t, tmin))
+                t = rounded
+            isopen = self.isopen
+            topen, iopen = np.unique(t[isopen], return_inverse=True)
+            tshut, ishut = np.unique(t[~isopen], return_inverse=True)
+            index = np.empty(t.shape[0], dtype=np.int64)
+            index[isopen], index[~isopen] = iopen, ishut
+            self._unique[key] = topen, tshut, index
+        return self._unique[key]
+
+    def compression_ratio(self, quantum=None, tmin=None):
+        """
+        Number of intervals per distinct open or shut time (see unique;
+        HJClik uses the resolution as tmin).
+        """
+        topen, tshut, index = self.unique(quantum, tmin)
+        nunique = topen.shape[0] + tshut.shape[0]
+        return index.shape[0] / float(max(nunique, 1))
+
+    @property
+    def has_metadata(self):
+        """True if any per-burst concentration, tres or CHS flag is set."""
+        return not (self.conc is None and self.tres is None and
+            self.chs is None)
+
+    def subset(self, index):
+        """
+        Bursts selected by an integer or boolean index, with metadata.
+        """
+        index = np.arange(len(self))[index]
+        lengths = self.lengths[index]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        take = (np.repeat(self.offsets[index] - offsets[:-1], lengths) +
+            np.arange(offsets[-1]))
+        meta = [None if m is None else m[index]
+            for m in (self.conc, self.tres, self.chs)]
+        return Bursts(self.intervals[take], offsets, *meta)
+
+    def groups(self):
+        """
+        Split bursts by metadata.
+
+        Returns
+        -------
+        groups : list of (dict, Bursts)
+            For each distinct combination of per-burst values, a dictionary
+            of them under HJClik opts keys ('conc', 'tres', 'isCHS'; only
+            those set) and the bursts having them (without metadata).
+            Calculated once and kept.
+        """
+        if self._groups is not None:
+            return self._groups
+        fields = [(key, m) for key, m in
+            (('conc', self.conc), ('tres', self.tres), ('isCHS', self.chs))
+            if m is not None]
+        if not fields:
+            self._groups = [({}, self)]
+            return self._groups
+        keys = np.rec.fromarrays([m for key, m in fields])
+        unique, inverse = np.unique(keys, return_inverse=True)
+        groups = []
+        for i in range(unique.shape[0]):
+            sub = self.subset(inverse == i)
+            sub.conc = sub.tres = sub.chs = None
+            values = dict((key, unique[i][j].item())
+                for j, (key, m) in enumerate(fields))
+            groups.append((values, sub))
+        self._groups = groups
+        return groups
@@ -9,6 +9,7 @@ from math import*
 import numpy as np
 from scipy.special import erf
 import scipy.integrate as scpi
+import scipy.sparse as scsp
 
 from scalcs import qmatlib as qml
 
@@ -246,7 +247,7 @@ def solve_jump(mec, reclen, step, cfunc, cargs, abserr=1.0e-8, relerr=1.0e-6):
     c =  cfunc(t, cargs)
     return t, c, Popen, P
 
-def calc_jump (mec, reclen, step, cfunc, cargs):
+def calc_jump (mec, reclen, step, cfunc, cargs, sparse=False):
     """
     Calculate response to a concentration pulse directly from Q matrix.
 
@@ -262,6 +263,13 @@ def calc_jump (mec, reclen, step, cfunc, cargs):
         Concentration profile.
     cargs : tuple
         Arguments for cfunc(t, cargs).
+    sparse : bool
+        If True, occupancies are propagated through each step by Krylov
+        methods on sparse Q (see qmatlib.propagate) instead of
+        eigendecomposition of Q at every step. Q is split once into sparse
+        concentration independent and dependent parts (see
+        sparse_conc_Q), so each step costs in proportion to the number of
+        nonzero rates.
 
     Returns
     -------
@@ -277,21 +285,68 @@ def calc_jump (mec, reclen, step, cfunc, cargs):
 
     t = np.arange(0, reclen, step)
     c =  cfunc(t, cargs)
-    mec.set_eff('c', cargs[1])
-    pi = qml.pinf(mec.Q)
+    if sparse:
+        Q0T, Q1T = sparse_conc_Q(mec, transposed=True)
+        pi = qml.pinf((Q0T + cargs[1] * Q1T).T.tocsr())
+    else:
+        mec.set_eff('c', cargs[1])
+        pi = qml.pinf(mec.Q)
     Pt = np.array([pi.copy()])
 
     for i in range(1, t.shape[0]):
-        mec.set_eff('c', c[i])
-        eigenvals, A = qml.eigs_sorted(mec.Q)
-        w = coefficient_calc(mec.k, A, pi)
-        pi = P_t(step, eigenvals, w)
+        if sparse:
+            pi = qml.propagate(pi, Q0T + c[i] * Q1T, step, transposed=True)
+        else:
+            mec.set_eff('c', c[i])
+            spec = qml.eigs_factored(mec.Q).sorted()
+            w = coefficient_calc(mec.k, spec, pi)
+            pi = P_t(step, spec.eigvals, w)
         Pt = np.append(Pt, [pi.copy()], axis=0)
+    if sparse:
+        mec.set_eff('c', c[-1])
 
     P = Pt.transpose()
     Popen = np.sum(P[: mec.kA], axis=0)
     return t, c, Popen, P
 
+def sparse_conc_Q(mec, eff='c', transposed=False):
+    """
+    Split Q matrix into concentration independent and dependent parts,
+        Q(c) = Q0 + c * Q1,
+    held as sparse (CSR) matrices. Rates of a mechanism are linear in
+    concentration, so the split is exact; it is checked at one more
+    concentration. A sparse mec.Q is used as it is. The effector
+    concentration of mec is left at zero.
+
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism to be analysed.
+    eff : str
+        Effector.
+    transposed : bool
+        If True, transposes Q0.T and Q1.T are returned (see
+        qmatlib.propagate).
+
+    Returns
+    -------
+    Q0, Q1 : scipy.sparse.csr_matrix, shape (k, k)
+    """
+
+    mec.set_eff(eff, 0)
+    Q0 = scsp.csr_matrix(mec.Q)
+    mec.set_eff(eff, 1)
+    Q1 = scsp.csr_matrix(mec.Q) - Q0
+    mec.set_eff(eff, 1e-3)
+    test = scsp.csr_matrix(mec.Q)
+    mec.set_eff(eff, 0)
+    if abs(Q0 + 1e-3 * Q1 - test).max() > 1e-10 * abs(test).max():
+        raise ValueError('sparse_conc_Q: Q is not linear in concentration')
+    Q1.eliminate_zeros()
+    if transposed:
+        Q0, Q1 = Q0.T.tocsr(), Q1.T.tocsr()
+    return Q0, Q1
+
 def coefficient_calc(k, A, p_occup):
     """
     Calculate weighted components for relaxation for each state p * An.
@@ -300,8 +355,8 @@ def coefficient_calc(k, A, p_occup):
     ----------
     k : int
         Number of states in mechanism.
-    A : array-like, shape (k, k, k)
-        Spectral matrices of Q matrix.
+    A : array-like, shape (k, k, k) or qmatlib.Spectral
+        Spectral matrices of Q matrix or their factored representation.
     p_occup : array-like, shape (k, 1)
         Occupancies of mechanism states.
 
@@ -310,6 +365,8 @@ def coefficient_calc(k, A, p_occup):
     w : ndarray, shape (k, k)
     """
 
+    if isinstance(A, qml.Spectral):
+        return A.rowdot(p_occup)
     w = np.zeros((k, k))
     for n in range (k):
         w[n, :] = np.dot(p_occup, A[n, :, :])
@@ -336,10 +393,12 @@ def weighted_taus(mec, cmax, width, eff='c'):
     """
     
     mec.set_eff(eff, 0)
-    eigs0, A0 = qml.eigs_sorted(mec.Q)
+    A0 = qml.eigs_factored(mec.Q).sorted()
+    eigs0 = A0.eigvals
     P0 = qml.pinf(mec.Q)
     mec.set_eff(eff, cmax)
-    eigsInf, Ainf = qml.eigs_sorted(mec.Q)
+    Ainf = qml.eigs_factored(mec.Q).sorted()
+    eigsInf = Ainf.eigvals
     w_on = coefficient_calc(mec.k, Ainf, P0)
     Pt = P_t(width, eigsInf, w_on)
     w_off = coefficient_calc(mec.k, A0, Pt)
@@ -373,14 +432,16 @@ def printout(mec, cmax, width, eff='c'):
 
     mec.set_eff(eff, 0)
     P0 = qml.pinf(mec.Q)
-    eigs0, A0 = qml.eigs_sorted(mec.Q)
+    A0 = qml.eigs_factored(mec.Q).sorted()
+    eigs0 = A0.eigvals
     str += ('\nEquilibrium occupancies before t=0, at concentration = 0.0:\n')
     for i in range(mec.k):
         str += ('p00({0:d}) = {1:.5g}\n'.format(i+1, P0[i]))
 
     mec.set_eff(eff, cmax)
     Pinf = qml.pinf(mec.Q)
-    eigsInf, Ainf = qml.eigs_sorted(mec.Q)
+    Ainf = qml.eigs_factored(mec.Q).sorted()
+    eigsInf = Ainf.eigvals
     w_on = coefficient_calc(mec.k, Ainf, P0)
     str += ('\nEquilibrium occupancies at maximum concentration = {0:.5g} mM:\n'
         .format(cmax * 1000))
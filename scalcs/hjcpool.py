@@ -0,0 +1,177 @@
+"""Persistent pool of worker processes for parallel evaluation of the HJC
+likelihood (see scalcslib.HJClik) over shards of bursts.
+"""
+
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import weakref
+
+import numpy as np
+
+from scalcs import scalcslib as scl
+from scalcs.bursts import Bursts
+
+# Entries of HJClik opts passed to workers once, at start.
+WORKER_OPTS = ('conc', 'tres', 'tcrit', 'isCHS', 'root_method', 'switch_tol',
+    'dedup', 'quantum')
+
+class HJCPool(object):
+    """
+    Evaluate HJClik with bursts split between persistent worker processes.
+    Intervals and burst offsets are copied once into shared memory; each
+    worker attaches to it at start, keeps its own mechanism and root
+    trackers, and on every call receives only theta and returns the
+    log-likelihood of its shard. Use as a replacement of HJClik in a fit:
+        with HJCPool(opts) as pool:
+            loglik, newrates = pool(theta)
+    and close it (or leave the with block) when done; workers and shared
+    memory of a pool that is not closed are released when it is garbage
+    collected.
+
+    Parameters
+    ----------
+    opts : dictionary
+        As for HJClik; opts['data'] holds the bursts (dictionary or Bursts).
+        Per-burst metadata of Bursts is sent to workers with their shards.
+    processes : int, optional
+        Number of workers (default: number of CPUs, at most one per burst).
+    """
+
+    def __init__(self, opts, processes=None):
+        self.mec = opts['mec']
+        bursts = Bursts.from_dict(opts['data'])
+        t, offsets = bursts.intervals, bursts.offsets
+        nb = len(bursts)
+        if processes is None:
+            processes = mp.cpu_count()
+        processes = max(1, min(processes, nb))
+
+        self._shm, self._conns, self._procs = [], [], []
+        self._finalizer = weakref.finalize(self, _shutdown, self._conns,
+            self._procs, self._shm)
+        names = []
+        for a in (t, offsets):
+            shm = shared_memory.SharedMemory(create=True,
+                size=max(a.nbytes, 1))
+            np.ndarray(a.shape, a.dtype, buffer=shm.buf)[:] = a
+            self._shm.append(shm)
+            names.append((shm.name, a.shape, a.dtype.str))
+
+        # Shards of consecutive bursts with similar numbers of intervals;
+        # long bursts may leave some shards empty, which get no worker.
+        bounds = np.searchsorted(offsets,
+            np.linspace(0, offsets[-1], processes + 1))
+        bounds[0], bounds[-1] = 0, nb
+        bounds = np.unique(bounds)
+        processes = bounds.shape[0] - 1
+        wopts = dict((key, opts[key]) for key in WORKER_OPTS if key in opts)
+        self._data, self._wopts = opts['data'], wopts
+        for i in range(processes):
+            parent, child = mp.Pipe()
+            meta = [None if m is None else m[bounds[i] : bounds[i + 1]]
+                for m in (bursts.conc, bursts.tres, bursts.chs)]
+            proc = mp.Process(target=_worker, args=(child, names,
+                bounds[i], bounds[i + 1], self.mec, wopts, meta))
+            proc.daemon = True
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+        self.processes = processes
+        self.bounds = bounds
+
+    def __call__(self, theta, opts=None):
+        """
+        Same as HJClik(theta, opts) for the bursts of this pool. As in
+        HJClik, if the likelihood of any shard cannot be calculated the
+        total is set to 0. Options are fixed when the pool is started;
+        opts, if given, must have the same mechanism, data and worker
+        options (WORKER_OPTS), otherwise ValueError is raised.
+
+        Returns
+        -------
+        loglik : float
+            Minus log-likelihood.
+        newrates : array_like
+            Updated rates/guesses.
+        """
+        if opts is not None:
+            wopts = dict((key, opts[key]) for key in WORKER_OPTS
+                if key in opts)
+            if (opts.get('mec') is not self.mec or
+                opts.get('data') is not self._data or
+                sorted(wopts) != sorted(self._wopts) or
+                any(np.any(wopts[key] != self._wopts[key]) for key in wopts)):
+                raise ValueError('HJCPool: opts differ from those the ' +
+                    'pool was started with; start a new pool')
+        theta = np.asarray(theta, dtype=float)
+        for conn in self._conns:
+            conn.send(theta)
+        results = [conn.recv() for conn in self._conns]
+        for r in results:
+            if isinstance(r, BaseException):
+                raise r
+        self.mec.theta_unsqueeze(np.exp(theta))
+        newrates = np.log(self.mec.theta())
+        if any(failed for lik, failed in results):
+            print ('HJCPool: Warning: likelihood has been set to 0')
+            return 0, newrates
+        return sum(lik for lik, failed in results), newrates
+
+    def close(self):
+        """
+        Stop workers and release shared memory.
+        """
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _shutdown(conns, procs, shms):
+    # Stop workers and release shared memory (once, from close or when
+    # the pool is garbage collected).
+    for conn in conns:
+        try:
+            conn.send(None)
+        except (OSError, EOFError):
+            pass
+        conn.close()
+    for proc in procs:
+        proc.join()
+    for shm in shms:
+        shm.close()
+        shm.unlink()
+    del conns[:], procs[:], shms[:]
+
+def _worker(conn, names, first, last, mec, wopts, meta):
+    # Attach to shared intervals and serve theta -> (-loglik, failed) of
+    # bursts first, ..., last - 1 until None is received. HJClik returns
+    # exactly 0 when the likelihood cannot be calculated; a shard is never
+    # empty, so a genuine 0 does not occur.
+    shms = [shared_memory.SharedMemory(name=name) for name, s, d in names]
+    t, offsets = [np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+        for shm, (name, shape, dtype) in zip(shms, names)]
+    opts = dict(wopts)
+    opts['mec'] = mec
+    opts['data'] = Bursts(t[offsets[first] : offsets[last]],
+        offsets[first : last + 1] - offsets[first], *meta)
+    opts['batch'] = True
+    opts['Atracker'], opts['Ftracker'] = scl.RootTracker(), scl.RootTracker()
+    try:
+        while True:
+            theta = conn.recv()
+            if theta is None:
+                break
+            try:
+                lik = scl.HJClik(theta, opts)[0]
+                conn.send((lik, lik == 0))
+            except Exception as err:
+                conn.send(err)
+    finally:
+        del t, offsets, opts
+        for shm in shms:
+            shm.close()
+        conn.close()
@@ -38,6 +38,40 @@ def Popen(mec, tres, conc=0, eff='c'):
         popen = popen / (1 + conc / mec.fastKB)
     return popen
 
+def Popen_curve(mec, tres, conc, eff='c'):
+    """
+    Calculate equilibrium open probability at a series of concentrations.
+    Ideal (tres = 0) equilibrium occupancies at all concentrations are
+    calculated in one call from a stack of Q matrices.
+
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism to be analysed.
+    tres : float
+        Time resolution (dead time).
+    conc : array_like, shape (n,)
+        Concentrations.
+
+    Returns
+    -------
+    Popen : ndarray, shape (n,)
+        Open probability values at given concentrations.
+    """
+    conc = np.asarray(conc, dtype=float)
+    if tres == 0:
+        QGG = []
+        for c in conc:
+            mec.set_eff(eff, c)
+            QGG.append(mec.QGG.copy())
+        p = qml.pinf(np.array(QGG))
+        popen = np.sum(p[:, :mec.kA], axis=1) / np.sum(p, axis=1)
+        if mec.fastblock:
+            popen = popen / (1 + conc / mec.fastKB)
+    else:
+        popen = np.array([Popen(mec, tres, c, eff) for c in conc])
+    return popen
+
 def Popen0(mec, tres, eff='c'):
     """
     Find Popen at concentration = 0.
@@ -206,11 +240,8 @@ def nH(mec, tres, eff='c'):
     # Calculate Popen curve
     n = 64
     dc = (math.log10(ec50 * 1.1) - math.log10(ec50 * 0.9)) / (n - 1)
-    c = np.zeros(n)
-    y = np.zeros(n)
-    for i in range(n):
-        c[i] = (ec50 * 0.9) * pow(10, i * dc)
-        y[i] = Popen(mec, tres, c[i])
+    c = (ec50 * 0.9) * np.power(10, np.arange(n) * dc)
+    y = Popen_curve(mec, tres, c)
 
     # Find two points around EC50.
     i50 = 0
@@ -33,19 +33,416 @@ and maximum likelihood fitting of mechanisms.
 Phil Trans R Soc Lond A 354, 2555-2590.
 """
 
+import collections
+import copy
+import functools
+import inspect
+import threading
+
 import numpy as np
 from numpy import linalg as nplin
+import scipy.linalg as scplin
+import scipy.sparse as scsp
+import scipy.sparse.linalg as scspl
 import math
 
 #import dcpypsrc
 
-def eigs(Q):
+CacheInfo = collections.namedtuple('CacheInfo',
+    ['hits', 'misses', 'maxsize', 'currsize'])
+
+class LRUCache(object):
+    """
+    Bounded least-recently-used store for results of matrix calculations.
+    Entries are keyed on the function name, the matrix shape, dtype and raw
+    bytes and on any extra scalar arguments (e.g. time), so equal matrices
+    share an entry regardless of where they came from.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                len(self._data))
+
+# Module wide cache; None when memoization is switched off.
+_cache = None
+# Calls served from the cache, per memoized function.
+_memo_hits = collections.Counter()
+
+def cache_enable(maxsize=128):
+    """
+    Switch on memoization of eigendecompositions (eigs, eigs_sorted), matrix
+    exponentials (expQt) and LU factorizations (factorize). Results are
+    keyed on matrix content, so existing call sites benefit without
+    changes. Calling again with a new maxsize discards the old cache.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of stored results; least recently used results are
+        evicted first.
+    """
+
+    global _cache
+    _cache = LRUCache(maxsize)
+
+def cache_disable():
+    """
+    Switch off memoization and drop all stored results.
+    """
+
+    global _cache
+    _cache = None
+
+def cache_clear():
+    """
+    Drop all stored results and reset hit/miss counters.
+    """
+
+    if _cache is not None:
+        _cache.clear()
+
+def cache_info():
+    """
+    Report cache statistics.
+
+    Returns
+    -------
+    info : CacheInfo or None
+        Named tuple (hits, misses, maxsize, currsize); None if memoization
+        is switched off.
+    """
+
+    return None if _cache is None else _cache.info()
+
+def _copy_result(value):
+    if isinstance(value, tuple):
+        return tuple(_copy_result(v) for v in value)
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    return value
+
+def _memoized(func):
+    """
+    Decorator memoizing func(M, *args) in the module cache when it is
+    enabled. Copies are returned so that callers may modify the results.
+    Arguments are keyed with defaults filled in, so func(M) and
+    func(M, default) share an entry.
+    """
+
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(M, *args, **kwargs):
+        cache = _cache
+        if cache is None:
+            return func(M, *args, **kwargs)
+        M = np.asarray(M)
+        if M.dtype == object:
+            # Not a plain matrix (e.g. Spectral).
+            return func(M.item(), *args, **kwargs)
+        bound = signature.bind(M, *args, **kwargs)
+        bound.apply_defaults()
+        try:
+            key = ((func.__name__, M.shape, M.dtype.str, M.tobytes()) +
+                tuple(bound.arguments.items())[1:])
+            hash(key)
+        except TypeError:
+            # Unhashable extra arguments (e.g. arrays of times).
+            return func(M, *args, **kwargs)
+        value = cache.get(key)
+        if value is None:
+            value = func(M, *args, **kwargs)
+            cache.put(key, value)
+        else:
+            _memo_hits[func.__name__] += 1
+        return _copy_result(value)
+    return wrapper
+
+def spectral_matrices(M, N):
+    """
+    Build spectral matrices from the eigenvector matrix M and its inverse N.
+    A[i] = M[:, i] * N[i, :] (outer product). Works on stacks of matrices
+    as well: the leading dimensions of M and N are preserved.
+
+    Parameters
+    ----------
+    M : array_like, shape (..., k, k)
+        Eigenvectors (columns).
+    N : array_like, shape (..., k, k)
+        Inverse of M.
+
+    Returns
+    -------
+    A : ndarray, shape (..., k, k, k)
+        Spectral matrices.
+    """
+
+    A = np.einsum('...ik,...kj->...kij', M, N)
+    if np.iscomplexobj(A):
+        # Keep real spectral matrices as before (imaginary parts dropped).
+        A = A.real
+    return A
+
+class Spectral(object):
+    """
+    Factored spectral representation of a matrix: sum of rank-one terms
+    A[i] = M[:, i] * N[i, :] with weights eigvals[i]. Sums such as
+    sum_i A[i] * f(eigvals[i]) are calculated as M * diag(f) * N, so the
+    dense (k, k, k) tensor of spectral matrices is never formed.
+    M may have fewer rows and N fewer columns than terms (see block), and
+    the same representation is used for residue matrices of asymptotic
+    pdfs (see AR).
+
+    Parameters
+    ----------
+    eigvals : array_like, shape (k,)
+    M : array_like, shape (p, k)
+        Eigenvectors (columns).
+    N : array_like, shape (k, q)
+        Inverse of M (rows) or any row factors.
+    """
+
+    def __init__(self, eigvals, M, N):
+        self.eigvals = np.asarray(eigvals)
+        self.M = np.asarray(M)
+        self.N = np.asarray(N)
+
+    def __len__(self):
+        return self.eigvals.shape[0]
+
+    @property
+    def A(self):
+        """
+        Dense spectral matrices, shape (k, p, q).
+        """
+        return spectral_matrices(self.M, self.N)
+
+    def apply(self, f):
+        """
+        Calculate sum_i A[i] * f[i].
+
+        Parameters
+        ----------
+        f : array_like, shape (k,) or (n, k)
+            Weights of spectral matrices (e.g. exp(eigvals * t)); a stack of
+            weight vectors gives a stack of results.
+
+        Returns
+        -------
+        S : ndarray, shape (p, q) or (n, p, q)
+            Real part only, as for spectral_matrices.
+        """
+        f = np.asarray(f)
+        if f.ndim == 1:
+            S = np.dot(self.M * f, self.N)
+        else:
+            S = np.einsum('ai,ni,ib->nab', self.M, f, self.N)
+        if np.iscomplexobj(S):
+            S = S.real
+        return S
+
+    def rowdot(self, p):
+        """
+        Calculate p * A[i] for each spectral matrix, shape (k, q).
+        """
+        w = np.dot(p, self.M)[:, np.newaxis] * self.N
+        if np.iscomplexobj(w):
+            w = w.real
+        return w
+
+    def block(self, rows, cols):
+        """
+        Spectral representation of a block of the matrix, e.g.
+        block(slice(0, kA), slice(kA, k)) gives the AF block.
+        """
+        return Spectral(self.eigvals, self.M[rows], self.N[:, cols])
+
+    def sorted(self):
+        """
+        Copy with terms sorted by ascending (real part of) eigenvalue.
+        """
+        order = self.eigvals.real.argsort()
+        return Spectral(self.eigvals[order], self.M[:, order], self.N[order])
+
+class Factorization(object):
+    """
+    LU factorization of a square matrix M for repeated solves. Replaces
+    explicit inverses: solve(B) = inv(M) * B, rsolve(B) = B * inv(M).
+    """
+
+    def __init__(self, M):
+        self.lu_piv = scplin.lu_factor(np.asarray(M))
+        self._inv = None
+
+    def solve(self, B):
+        """
+        Return inv(M) * B.
+        """
+        return scplin.lu_solve(self.lu_piv, B)
+
+    def rsolve(self, B):
+        """
+        Return B * inv(M).
+        """
+        return scplin.lu_solve(self.lu_piv, np.asarray(B).T, trans=1).T
+
+    def inv(self):
+        """
+        Return the explicit inverse of M (calculated once).
+        """
+        if self._inv is None:
+            self._inv = self.solve(np.eye(self.lu_piv[0].shape[0]))
+        return self._inv.copy()
+
+@_memoized
+def factorize(M):
+    """
+    Get the LU factorization of a square matrix. When the cache is enabled
+    (see cache_enable) factorizations are keyed on matrix content, so all
+    functions working on the same mechanism state factorize each submatrix
+    only once.
+
+    Parameters
+    ----------
+    M : array_like, shape (k, k)
+
+    Returns
+    -------
+    F : Factorization
+    """
+
+    return Factorization(M)
+
+def symmetrizer(Q, rtol=1e-9):
+    """
+    Find the diagonal similarity transform that makes Q symmetric.
+    Q satisfies microscopic reversibility (detailed balance) if there is
+    a positive vector w with w[i] * Q[i, j] = w[j] * Q[j, i] for all i, j
+    (for a full Q matrix w is proportional to pinf). Then
+    diag(d) * Q * diag(1/d), with d = sqrt(w), is symmetric. The same holds
+    for any diagonal block (QAA, QFF, ...) of a reversible Q.
+
+    Parameters
+    ----------
+    Q : array_like, shape (k, k)
+    rtol : float
+        Relative tolerance of the detailed balance check.
+
+    Returns
+    -------
+    d : ndarray, shape (k,) or None
+        Diagonal of the transform; None if Q is not symmetrizable.
+    """
+
+    Q = np.asarray(Q)
+    if Q.ndim != 2 or np.iscomplexobj(Q):
+        return None
+    k = Q.shape[0]
+    off = Q.copy()
+    off[np.diag_indices(k)] = 0
+    if np.any((off == 0) != (off.T == 0)) or np.any(off * off.T < 0):
+        return None
+
+    # Spread w along a spanning forest of the transition graph.
+    w = np.zeros(k)
+    for root in range(k):
+        if w[root] > 0:
+            continue
+        w[root] = 1.0
+        todo = [root]
+        while todo:
+            i = todo.pop()
+            for j in np.nonzero(off[i])[0]:
+                if w[j] == 0:
+                    w[j] = w[i] * off[i, j] / off[j, i]
+                    todo.append(j)
+    if not np.all(np.isfinite(w)) or np.any(w <= 0):
+        return None
+
+    # Detailed balance must hold for every pair, not only along the forest.
+    F = w[:, np.newaxis] * off
+    if not np.all(np.abs(F - F.T) <=
+        rtol * np.maximum(np.abs(F), np.abs(F.T))):
+        return None
+    return np.sqrt(w)
+
+# Below this size the reversibility check costs more than the symmetric
+# solver saves, so auto-detection (reversible=None) is skipped.
+EIGH_MIN_STATES = 32
+
+@_memoized
+def _eig_factors(Q, reversible=None):
+    """
+    Eigenvalues, eigenvectors (columns of M) and N = inv(M) of Q. Uses the
+    symmetric solver for reversible matrices (see symmetrizer): Q is
+    similar to the symmetric S = D * Q * inv(D), S = V * diag(eig) * V',
+    hence M = inv(D) * V and N = V' * D with no explicit inverse.
+    """
+
+    d = None
+    if reversible or (reversible is None and
+        np.shape(Q)[0] >= EIGH_MIN_STATES):
+        d = symmetrizer(Q)
+        if d is None and reversible:
+            raise ValueError('Matrix does not satisfy microscopic ' +
+                'reversibility.')
+    if d is None:
+        eigvals, M = nplin.eig(Q)
+        N = nplin.inv(M)
+    else:
+        S = d[:, np.newaxis] * Q / d
+        eigvals, V = nplin.eigh(0.5 * (S + S.T))
+        # Descending order: fastest components of -Q come first in printouts.
+        eigvals, V = eigvals[::-1], V[:, ::-1]
+        M = V / d[:, np.newaxis]
+        N = V.T * d
+    return eigvals, M, N
+
+@_memoized
+def eigs(Q, reversible=None):
     """
     Calculate eigenvalues and spectral matrices of a matrix Q.
 
     Parameters
     ----------
     Q : array_like, shape (k, k)
+    reversible : bool or None
+        True if Q obeys microscopic reversibility (then the faster and more
+        stable symmetric eigensolver is used), False to force the general
+        solver, None (default) to detect it for matrices with at least
+        EIGH_MIN_STATES states.
 
     Returns
     -------
@@ -55,11 +452,7 @@ def eigs(Q):
         Spectral matrices of Q.
     """
 
-    eigvals, M = nplin.eig(Q)
-    N = nplin.inv(M)
-    k = N.shape[0]
-    A = np.zeros((k, k, k))
-    # TODO: make this a one-liner avoiding loops
+    eigvals, M, N = _eig_factors(Q, reversible)
     # DO NOT DELETE commented explicit loops for future reference
     #
     # rev. 1
@@ -69,21 +462,23 @@ def eigs(Q):
     #     X[:, 0] = M[:, i]
     #     Y[0] = N[i]
     #     A[i] = np.dot(X, Y)
-    # END DO NOT DELETE
     #
-    # rev. 2 - cumulative time fastest on my system
-    for i in range(k):
-        A[i] = np.dot(M[:, i].reshape(k, 1), N[i].reshape(1, k))
-
+    # rev. 2
+    # for i in range(k):
+    #     A[i] = np.dot(M[:, i].reshape(k, 1), N[i].reshape(1, k))
+    #
     # rev. 3 - cumulative time not faster
     # A = np.array([
     #         np.dot(M[:, i].reshape(k, 1), N[i].reshape(1, k)) \
     #             for i in range(k)
     #         ])
-
+    # END DO NOT DELETE
+    #
+    # rev. 4 - einsum, no loops; same code serves stacks (see eigs_batch)
+    A = spectral_matrices(M, N)
     return eigvals, A
 
-def eigs_sorted(Q):
+def eigs_sorted(Q, reversible=None):
     """
     Calculate eigenvalues and spectral matrices of a matrix Q. 
     Return eigenvalues in ascending order 
@@ -91,6 +486,8 @@ def eigs_sorted(Q):
     Parameters
     ----------
     Q : array_like, shape (k, k)
+    reversible : bool or None
+        See eigs.
 
     Returns
     -------
@@ -100,25 +497,173 @@ def eigs_sorted(Q):
         Spectral matrices of Q.
     """
 
-    eigvals, M = nplin.eig(Q)
-    N = nplin.inv(M)
-    k = N.shape[0]
-    A = np.zeros((k, k, k))
-    for i in range(k):
-        A[i] = np.dot(M[:, i].reshape(k, 1), N[i].reshape(1, k))
+    eigvals, A = eigs(Q, reversible=reversible)
     sorted_indices = eigvals.real.argsort()
     eigvals = eigvals[sorted_indices]
     A = A[sorted_indices, : , : ]
     return eigvals, A
 
+def spectral_sum(A, f):
+    """
+    Calculate sum_i A[i] * f[i] for dense spectral matrices or Spectral.
+
+    Parameters
+    ----------
+    A : array_like, shape (k, p, q) or Spectral
+    f : array_like, shape (k,)
+
+    Returns
+    -------
+    S : ndarray, shape (p, q)
+    """
+
+    if isinstance(A, Spectral):
+        return A.apply(f)
+    return np.sum(A * np.asarray(f).reshape(A.shape[0], 1, 1), axis=0)
+
+def eigs_factored(Q, reversible=None):
+    """
+    Calculate eigenvalues and factored spectral representation of a matrix
+    Q. Needs O(k^2) memory in contrast to the (k, k, k) spectral matrices
+    returned by eigs.
+
+    Parameters
+    ----------
+    Q : array_like, shape (k, k)
+    reversible : bool or None
+        See eigs.
+
+    Returns
+    -------
+    spec : Spectral
+    """
+
+    eigvals, M, N = _eig_factors(Q, reversible)
+    return Spectral(eigvals, M, N)
+
+def eigs_batch(Q):
+    """
+    Calculate eigenvalues and spectral matrices for a stack of matrices in
+    one vectorized call.
+
+    Parameters
+    ----------
+    Q : array_like, shape (n, k, k)
+        Stack of n matrices (e.g. one Q matrix per concentration).
+
+    Returns
+    -------
+    eigvals : ndarray, shape (n, k)
+        Eigenvalues of each matrix.
+    A : ndarray, shape (n, k, k, k)
+        Spectral matrices of each matrix.
+    """
+
+    eigvals, M = nplin.eig(np.asarray(Q))
+    N = nplin.inv(M)
+    return eigvals, spectral_matrices(M, N)
+
+def eigs_sorted_batch(Q):
+    """
+    Calculate eigenvalues and spectral matrices for a stack of matrices.
+    Eigenvalues of each matrix are returned in ascending order.
+
+    Parameters
+    ----------
+    Q : array_like, shape (n, k, k)
+
+    Returns
+    -------
+    eigvals : ndarray, shape (n, k)
+    A : ndarray, shape (n, k, k, k)
+    """
+
+    eigvals, A = eigs_batch(Q)
+    sorted_indices = eigvals.real.argsort(axis=1)
+    eigvals = np.take_along_axis(eigvals, sorted_indices, axis=1)
+    A = np.take_along_axis(A, sorted_indices[:, :, None, None], axis=1)
+    return eigvals, A
+
+# Matrix exponentials are taken from the eigendecomposition only if the
+# eigenvector matrix is better conditioned than this; otherwise Pade
+# approximation with scaling and squaring (scipy.linalg.expm) is used.
+EXPM_COND_MAX = 1e8
+
+ExpmInfo = collections.namedtuple('ExpmInfo', ['spectral', 'pade', 'cached'])
+_expm_counts = {'spectral': 0, 'pade': 0}
+
+def expm_info():
+    """
+    Report how many matrix exponentials (or, for phi_expQt, propagated row
+    vectors) were calculated from the eigendecomposition ('spectral') and
+    how many fell back to Pade approximation ('pade') because the
+    eigenvectors were ill-conditioned. Decompositions used for anything
+    else (e.g. by HEvaluator) are not counted.
+    Calls of expQt served from the cache (see cache_enable) calculate
+    nothing and are counted separately ('cached').
+
+    Returns
+    -------
+    info : ExpmInfo
+        Named tuple (spectral, pade, cached).
+    """
+
+    return ExpmInfo(_expm_counts['spectral'], _expm_counts['pade'],
+        _memo_hits['expQt'])
+
+def expm_info_clear():
+    """
+    Reset the counters reported by expm_info.
+    """
+
+    _expm_counts['spectral'] = 0
+    _expm_counts['pade'] = 0
+    _memo_hits['expQt'] = 0
+
+def _spectral_factors(M):
+    """
+    Eigendecomposition of M if it is safe to build exponentials from it,
+    otherwise None. The 1-norm condition number of the eigenvector matrix
+    is cheap here because its inverse is already known. The decomposition
+    itself is memoized when the cache is enabled. Nothing is counted in
+    expm_info, since no exponential is formed here.
+    """
+
+    eigvals, X, Y = _eig_factors(M)
+    cond = nplin.norm(X, 1) * nplin.norm(Y, 1)
+    if not cond < EXPM_COND_MAX:
+        return None
+    return eigvals, X, Y
+
+def _expm_factors(M, n=1):
+    """
+    _spectral_factors of M for forming n exponentials of M; the n
+    exponentials are counted in expm_info under the path taken.
+    """
+
+    factors = _spectral_factors(M)
+    _expm_counts['pade' if factors is None else 'spectral'] += n
+    return factors
+
+def _real_if_real(expM, M):
+    # Exponential of a real matrix is real; drop rounding in imaginary part.
+    if np.iscomplexobj(expM) and not np.iscomplexobj(M):
+        expM = expM.real
+    return expM
+
+@_memoized
 def expQt(M, t):
     """
     Calculate exponential of a matrix M.
         expM = exp(M * t)
+    The eigendecomposition of M is used when its eigenvectors are well
+    conditioned (see EXPM_COND_MAX), Pade approximation otherwise. Counts
+    of both paths are reported by expm_info.
 
     Parameters
     ----------
-    M : array_like, shape (k, k)
+    M : array_like, shape (k, k) or Spectral
+        Matrix or its spectral representation (see eigs_factored).
     t : float
         Time.
 
@@ -127,7 +672,13 @@ def expQt(M, t):
     expM : ndarray, shape (k, k)
     """
 
-    eigvals, A = eigs(M)
+    if isinstance(M, Spectral):
+        _expm_counts['spectral'] += 1
+        return M.apply(np.exp(M.eigvals * t))
+    factors = _expm_factors(M)
+    if factors is None:
+        return scplin.expm(np.asarray(M) * t)
+    eigvals, X, Y = factors
 
     # DO NOT DELETE commented explicit loops for future reference
     # k = M.shape[0]
@@ -142,38 +693,271 @@ def expQt(M, t):
     # rev.2:
     # for m in range(k):
     #     expM += A[m] * math.exp(eigvals[m] * t)
+    #
+    # rev.3:
+    # expM = np.sum(A * np.exp(eigvals * t).reshape(A.shape[0],1,1), axis=0)
     # END DO NOT DELETE
 
-    expM = np.sum(A * np.exp(eigvals * t).reshape(A.shape[0],1,1), axis=0)
+    expM = np.dot(X * np.exp(eigvals * t), Y)
+    return _real_if_real(expM, M)
+
+def expQt_times(M, t):
+    """
+    Calculate exponentials exp(M * t) for a whole vector of times from a
+    single eigendecomposition of M (Pade approximation for each time if the
+    eigenvectors are ill-conditioned, see expQt).
+
+    Parameters
+    ----------
+    M : array_like, shape (k, k)
+    t : array_like, shape (n,)
+        Times.
+
+    Returns
+    -------
+    expM : ndarray, shape (n, k, k)
+    """
+
+    t = np.asarray(t, dtype=float).ravel()
+    factors = _expm_factors(M, t.shape[0])
+    if factors is None:
+        M = np.asarray(M)
+        return np.array([scplin.expm(M * ti) for ti in t])
+    eigvals, X, Y = factors
+    w = np.exp(np.outer(t, eigvals))
+    expM = np.einsum('im,nm,mj->nij', X, w, Y)
+    return _real_if_real(expM, M)
+
+def phi_expQt(phi, M, t):
+    """
+    Calculate row vectors phi * exp(M * t) for a whole vector of times from
+    a single eigendecomposition of M. The (k, k) propagators are never
+    formed: phi * exp(M * t) = sum_m (phi * X[:, m]) * exp(eig_m * t) * Y[m],
+    where X holds the eigenvectors of M and Y = inv(X).
+
+    Parameters
+    ----------
+    phi : array_like, shape (k,) or (1, k)
+        Row vector (e.g. initial vector).
+    M : array_like, shape (k, k)
+    t : array_like, shape (n,)
+        Times.
+
+    Returns
+    -------
+    p : ndarray, shape (n, k)
+    """
+
+    t = np.asarray(t, dtype=float).ravel()
+    factors = _expm_factors(M, t.shape[0])
+    if factors is None:
+        M = np.asarray(M)
+        return np.array([np.dot(np.ravel(phi), scplin.expm(M * ti))
+            for ti in t])
+    eigvals, X, Y = factors
+    c = np.dot(np.ravel(phi), X)
+    w = np.exp(np.outer(t, eigvals))
+    p = np.dot(w * c, Y)
+    return _real_if_real(p, M)
+
+def issparse(M):
+    """
+    True if M is a scipy.sparse matrix.
+    """
+    return scsp.issparse(M)
+
+def propagate(phi, M, t, transposed=False):
+    """
+    Calculate row vector phi * exp(M * t) without forming exp(M * t).
+    For sparse M the action of the exponential is evaluated by
+    scipy.sparse.linalg.expm_multiply, so the cost scales with the number of
+    nonzero rates rather than k^3. Several times are calculated in ascending
+    order, each propagated from the previous one.
+
+    Parameters
+    ----------
+    phi : array_like, shape (k,) or (1, k)
+        Row vector (e.g. occupancies or initial vector).
+    M : array_like or sparse matrix, shape (k, k)
+    t : float or array_like, shape (n,)
+        Time(s).
+    transposed : bool
+        If True, sparse M is given transposed (M.T in CSR format) so that
+        repeated calls with the same matrix do not convert it each time.
+
+    Returns
+    -------
+    p : ndarray, shape (k,) or (n, k)
+    """
+
+    phi = np.ravel(phi)
+    if not issparse(M):
+        if transposed:
+            M = np.transpose(M)
+        if np.isscalar(t):
+            return np.dot(phi, expQt(M, t))
+        return phi_expQt(phi, M, t)
+
+    MT = M if transposed else scsp.csr_matrix(M).T.tocsr()
+    if np.isscalar(t):
+        return scspl.expm_multiply(MT * t, phi)
+    t = np.asarray(t, dtype=float).ravel()
+    order = np.argsort(t)
+    p = np.empty((t.shape[0], phi.shape[0]))
+    tprev = 0.0
+    for i in order:
+        if t[i] > tprev:
+            phi = scspl.expm_multiply(MT * (t[i] - tprev), phi)
+            tprev = t[i]
+        p[i] = phi
+    return p
+
+def vecmat(phi, M):
+    """
+    Calculate row vector phi * M for dense or sparse M.
+    """
+    if issparse(M):
+        return M.T.dot(np.ravel(phi))
+    return np.dot(phi, M)
+
+def expQt_batch(M, t):
+    """
+    Calculate exponentials exp(M[i] * t[i]) for a stack of matrices.
+
+    Parameters
+    ----------
+    M : array_like, shape (n, k, k)
+    t : float or array_like, shape (n,)
+        Time, common to all matrices or one per matrix.
+
+    Returns
+    -------
+    expM : ndarray, shape (n, k, k)
+    """
+
+    eigvals, A = eigs_batch(M)
+    w = np.exp(eigvals * np.reshape(t, (-1, 1)))
+    expM = np.einsum('nm,nmij->nij', w, A)
     return expM
 
+def chain_product(M):
+    """
+    Calculate products M[i, 0] * M[i, 1] * ... * M[i, m-1] for a stack of
+    chains of square matrices by pairwise (tree) reduction: neighbours are
+    multiplied for all chains at once, halving the chain length each step,
+    so only about log2(m) batched products are needed. Every partial
+    product is divided by its largest absolute element and the logarithms
+    of divisors are summed, so long chains neither overflow nor underflow.
+
+    Parameters
+    ----------
+    M : array_like, shape (n, m, k, k)
+        Real or complex matrices; the dtype is kept.
+
+    Returns
+    -------
+    P : ndarray, shape (n, k, k)
+        Scaled products; the true product is P[i] * exp(logscale[i]).
+    logscale : ndarray, shape (n,)
+    """
+
+    M = np.asarray(M)
+    if not np.issubdtype(M.dtype, np.inexact):
+        M = M.astype(float)
+    n, m, k = M.shape[0], M.shape[1], M.shape[-1]
+    if m == 0:
+        return np.tile(np.eye(k), (n, 1, 1)), np.zeros(n)
+    logscale = np.zeros((n, m))
+    while m > 1:
+        even = m - m % 2
+        P = np.matmul(M[:, 0:even:2], M[:, 1:even:2])
+        scale = np.abs(P).max(axis=(2, 3))
+        scale[scale == 0] = 1
+        P /= scale[:, :, np.newaxis, np.newaxis]
+        logs = (logscale[:, 0:even:2] + logscale[:, 1:even:2] +
+            np.log(scale))
+        if m % 2:
+            P = np.concatenate((P, M[:, -1:]), axis=1)
+            logs = np.concatenate((logs, logscale[:, -1:]), axis=1)
+        M, logscale, m = P, logs, P.shape[1]
+    return M[:, 0], logscale[:, 0]
+
 def Qpow(M, n):
     """
-    Rise matrix M to power n.
+    Rise matrix M to power n. All powers in a vector n are calculated from
+    a single eigendecomposition of M.
 
     Parameters
     ----------
-    M : array_like, shape (k, k)
+    M : array_like, shape (k, k) or Spectral
+        Matrix or its spectral representation (see eigs_factored).
+    n : int or array_like of ints, shape (m,)
+        Power(s).
+
+    Returns
+    -------
+    Mn : ndarray, shape (k, k) or (m, k, k)
+    """
+
+    if not isinstance(M, Spectral):
+        M = eigs_factored(M)
+    if np.isscalar(n):
+        return M.apply(pow(M.eigvals, n))
+    return M.apply(np.power(M.eigvals, np.asarray(n)[:, np.newaxis]))
+
+def Qpow_products(M, n, row, col):
+    """
+    Calculate scalar products row * M^n * col for a vector of powers from a
+    single eigendecomposition of M without forming M^n:
+    row * M^n * col = sum_i (row * M[:, i]) * eig[i]^n * (N[i] * col).
+
+    Parameters
+    ----------
+    M : array_like, shape (k, k) or Spectral
+        Matrix or its spectral representation (see eigs_factored).
+    n : int or array_like of ints, shape (m,)
+        Power(s).
+    row : array_like, shape (k,) or (1, k)
+    col : array_like, shape (k,) or (k, 1)
+
+    Returns
+    -------
+    prod : float or ndarray, shape (m,)
+    """
+
+    if not isinstance(M, Spectral):
+        M = eigs_factored(M)
+    c = np.dot(np.ravel(row), M.M) * np.dot(M.N, np.ravel(col))
+    prod = np.dot(np.power(M.eigvals, np.asarray(n)[..., np.newaxis]), c)
+    if np.iscomplexobj(prod):
+        prod = prod.real
+    return prod
+
+def Qpow_batch(M, n):
+    """
+    Rise each matrix in a stack to power n.
+
+    Parameters
+    ----------
+    M : array_like, shape (m, k, k)
     n : int
         Power.
 
     Returns
     -------
-    Mn : ndarray, shape (k, k)
+    Mn : ndarray, shape (m, k, k)
     """
 
-    k = M.shape[0]
-    eig, A = eigs(M)
-    Mn = np.zeros((k, k))
-    for i in range(k):
-        Mn += A[i, :, :] * pow(eig[i], n)
+    eig, A = eigs_batch(M)
+    Mn = np.einsum('mi,mijk->mjk', np.power(eig, n), A)
     return Mn
 
 def pinf1(Q):
     """
     Calculate equilibrium occupancies by adding a column of ones
     to Q matrix.
-    Pinf = uT * invert((S * transpos(S))).
+    Pinf = uT * invert((S * transpos(S))), calculated as the solution of
+    (S * transpos(S)) * pinf = u (S * transpos(S) is symmetric).
 
     Parameters
     ----------
@@ -186,28 +970,60 @@ def pinf1(Q):
 
     u = np.ones((Q.shape[0],1))
     S = np.concatenate((Q, u), 1)
-    pinf = np.dot(u.transpose(), nplin.inv((np.dot(S,S.transpose()))))[0]
+    pinf = nplin.solve(np.dot(S,S.transpose()), u)[:, 0]
     return pinf
 
 def pinf(Q):
     """
-    Calculate equilibrium occupancies with the reduced Q-matrix method.
+    Calculate equilibrium occupancies with the reduced Q-matrix method:
+    pinf * R = -r, where R = Q[:-1, :-1] - Q[-1, :-1] and r = Q[-1, :-1],
+    solved as a linear system. For sparse Q the equivalent system
+    pinf * Q = 0, pinf * u = 1 (last equation of pinf * Q = 0 replaced by
+    normalisation) is solved by a sparse direct solver, which keeps
+    sparsity of Q.
 
     Parameters
     ----------
-    Q : array_like, shape (k, k)
+    Q : array_like or sparse matrix, shape (k, k), or array_like,
+        shape (n, k, k)
+        Q matrix or a stack of Q matrices (e.g. at series of
+        concentrations).
 
     Returns
     -------
-    pinf : ndarray, shape (k1)
+    pinf : ndarray, shape (k,) or (n, k)
     """
 
-    R = (Q - Q[-1: , :])[:-1, :-1]
-    r = Q[-1: , :-1]
-    pinf = -np.dot(r, nplin.inv(R))
-    pinf = np.append(pinf, 1 - np.sum(pinf))
+    if issparse(Q):
+        k = Q.shape[0]
+        A = scsp.vstack((scsp.csr_matrix(Q).T[:-1],
+            scsp.csr_matrix(np.ones((1, k))))).tocsc()
+        b = np.zeros(k)
+        b[-1] = 1
+        return scspl.spsolve(A, b)
+
+    Q = np.asarray(Q)
+    R = (Q - Q[..., -1:, :])[..., :-1, :-1]
+    r = Q[..., -1, :-1]
+    p = -nplin.solve(np.swapaxes(R, -1, -2), r[..., np.newaxis])[..., 0]
+    pinf = np.concatenate((p, 1 - np.sum(p, axis=-1, keepdims=True)), axis=-1)
     return pinf
 
+def pinf_batch(Q):
+    """
+    Calculate equilibrium occupancies for a stack of Q matrices (see pinf).
+
+    Parameters
+    ----------
+    Q : array_like, shape (n, k, k)
+
+    Returns
+    -------
+    pinf : ndarray, shape (n, k)
+    """
+
+    return pinf(Q)
+
 def iGs(Q, kA, kB):
     r"""
     Calculate GBA and GAB matrices (Eq. 1.25, CH82).
@@ -237,17 +1053,22 @@ def iGs(Q, kA, kB):
     QBA = Q[kA:kE, 0:kA]
     QAA = Q[0:kA, 0:kA]
     QAB = Q[0:kA, kA:kE]
-    GAB = np.dot(nplin.inv(-1 * QAA), QAB)
-    GBA = np.dot(nplin.inv(-1 * QBB), QBA)
+    GAB = -factorize(QAA).solve(QAB)
+    GBA = -factorize(QBB).solve(QBA)
     return GAB, GBA
 
 def iGt(t, QAA, QAB):
     """
     GAB(t) = PAA(t) * QAB      Eq. 1.20 in CH82
     PAA(t) = exp(QAA * t)      Eq. 1.16 in CH82
+    If t is an array, a stack of GAB(t) matrices, shape (n, kA, kB), is
+    returned using a single eigendecomposition of QAA.
     """
 
-    GAB = np.dot(expQt(QAA, t), QAB)
+    if np.isscalar(t):
+        GAB = np.dot(expQt(QAA, t), QAB)
+    else:
+        GAB = np.dot(expQt_times(QAA, t), QAB)
     return GAB
 
 def eGs(GAF, GFA, kA, kF, expQFF):
@@ -273,7 +1094,7 @@ def eGs(GAF, GFA, kA, kF, expQFF):
     """
 
     temp = np.eye(kA) - np.dot(np.dot(GAF, np.eye(kF) - expQFF), GFA)
-    eGAF = np.dot(np.dot(nplin.inv(temp), GAF), expQFF)
+    eGAF = np.dot(nplin.solve(temp, GAF), expQFF)
     return eGAF
 
 def phiA(mec):
@@ -506,6 +1327,163 @@ def dW(s, tres, QAF, QFF, QFA, kA, kF):
     dW = IA + np.dot(np.dot(QAF, w1), eGFAs)
     return dW
 
+class HEvaluator(object):
+    """
+    Evaluate H(s), W(s), det W(s) and W'(s) (Eqs. 52-56, HJC92) for many
+    values of s from one eigendecomposition of QFF. With QFF = X * diag(l) * Y
+    both (s*I - QFF)^(-1) and exp(-(s*I - QFF) * tau) are diagonal in the
+    eigenbasis of QFF for every s, hence
+    HAA(s) = QAA + QAF * X * diag(g(s)) * Y * QFA,
+    g(s) = (1 - exp(-(s - l) * tau)) / (s - l),
+    and each evaluation costs O(kA^2 * kF) instead of an inversion and an
+    eigendecomposition. All methods accept a float or an array of s values.
+    Falls back to the direct formulae if the eigenvectors of QFF are
+    ill-conditioned (see expQt). The number of values of s at which H(s) or
+    W'(s), which cost the same, were evaluated is counted in attribute
+    nevals; W_dW gives both from one pass and counts once.
+    To evaluate HFF(s) exhange A by F and F by A in constructor call.
+
+    Parameters
+    ----------
+    tres : float
+        Time resolution (dead time).
+    QAA : array_like, shape (kA, kA)
+    QFF : array_like, shape (kF, kF)
+    QAF : array_like, shape (kA, kF)
+    QFA : array_like, shape (kF, kA)
+        QAA, QFF, QAF, QFA - submatrices of Q.
+    spec : Spectral, None or 'auto'
+        Spectral representation of QFF already at hand (e.g. shared with
+        HJCContext), None for the direct formulae, or 'auto' (default) to
+        decompose QFF here.
+    """
+
+    # Below this |(s - l) * tau| g(s) and g'(s) are evaluated from series.
+    SERIES_MAX = 1e-3
+
+    def __init__(self, tres, QAA, QFF, QAF, QFA, spec='auto'):
+        self.tres = tres
+        self.QAA, self.QFF = np.asarray(QAA), np.asarray(QFF)
+        self.QAF, self.QFA = np.asarray(QAF), np.asarray(QFA)
+        self.kA, self.kF = self.QAA.shape[0], self.QFF.shape[0]
+        self.IA = np.eye(self.kA)
+        self.nevals = 0
+        if isinstance(spec, Spectral):
+            factors = spec.eigvals, spec.M, spec.N
+        elif spec is None:
+            factors = None
+        else:
+            factors = _spectral_factors(self.QFF)
+        if factors is None:
+            self.eigvals = None
+        else:
+            self.eigvals, X, Y = factors
+            self.L = np.dot(self.QAF, X)
+            self.R = np.dot(Y, self.QFA)
+
+    def with_tres(self, tres):
+        """
+        Evaluator for another time resolution sharing the decomposition of
+        QFF with this one.
+        """
+        hev = copy.copy(self)
+        hev.tres = tres
+        hev.nevals = 0
+        return hev
+
+    def _g(self, s, deriv=False):
+        # g(s) or -g'(s) for each s (rows) and eigenvalue of QFF (columns).
+        g, dg = self._gboth(s, not deriv, deriv)
+        return dg if deriv else g
+
+    def _gboth(self, s, value=True, deriv=True):
+        # g(s) and -g'(s) sharing the exponentials; None if not wanted.
+        x = np.asarray(s)[..., np.newaxis] - self.eigvals
+        tau = self.tres
+        y = x * tau
+        small = np.abs(y) < self.SERIES_MAX
+        ysafe = np.where(small, 1.0, y)
+        em1 = -np.expm1(-ysafe) / ysafe
+        g = dg = None
+        if value:
+            g = np.where(small, tau * (1 - y / 2 + y * y / 6 -
+                y * y * y / 24), tau * em1)
+        if deriv:
+            dg = np.where(small, tau * tau * (0.5 - y / 3 + y * y / 8 -
+                y * y * y / 30), tau * tau * (em1 - np.exp(-ysafe)) / ysafe)
+        return g, dg
+
+    def _sandwich(self, g):
+        # QAF * X * diag(g) * Y * QFA for one or a stack of g vectors.
+        if g.ndim == 1:
+            S = np.dot(self.L * g, self.R)
+        else:
+            S = np.einsum('ai,ni,ib->nab', self.L, g, self.R)
+        if np.iscomplexobj(S):
+            S = S.real
+        return S
+
+    def H(self, s):
+        """
+        HAA(s), shape (kA, kA) or (n, kA, kA).
+        """
+        self.nevals += np.size(s)
+        if self.eigvals is None:
+            return self._direct(H, s, self.tres, self.QAA, self.QFF,
+                self.QAF, self.QFA, self.kF)
+        return self.QAA + self._sandwich(self._g(s))
+
+    def W(self, s):
+        """
+        WAA(s) = s * IA - HAA(s), shape (kA, kA) or (n, kA, kA).
+        """
+        return (np.asarray(s)[..., np.newaxis, np.newaxis] * self.IA -
+            self.H(s))
+
+    def detW(self, s):
+        """
+        Determinant of WAA(s), float or shape (n,).
+        """
+        return nplin.det(self.W(s))
+
+    def dW(self, s):
+        """
+        Derivative of WAA(s) with respect to s, shape (kA, kA) or
+        (n, kA, kA).
+        """
+        self.nevals += np.size(s)
+        if self.eigvals is None:
+            return self._direct(dW, s, self.tres, self.QAF, self.QFF,
+                self.QFA, self.kA, self.kF)
+        return self.IA + self._sandwich(self._g(s, deriv=True))
+
+    def W_dW(self, s):
+        """
+        WAA(s) and its derivative with respect to s from one evaluation of
+        the exponentials, each shape (kA, kA) or (n, kA, kA).
+        """
+        if self.eigvals is None:
+            return self.W(s), self.dW(s)
+        self.nevals += np.size(s)
+        g, dg = self._gboth(s)
+        W = (np.asarray(s)[..., np.newaxis, np.newaxis] * self.IA -
+            self.QAA - self._sandwich(g))
+        return W, self.IA + self._sandwich(dg)
+
+    def count(self, s):
+        """
+        Number of eigenvalues of HAA(s) that are equal to or less than s
+        (see scalcslib.bisect_gFB), int or shape (n,).
+        """
+        eigval = nplin.eigvals(self.H(s))
+        return (eigval <= np.asarray(s)[..., np.newaxis]).sum(axis=-1)
+
+    @staticmethod
+    def _direct(func, s, *args):
+        if np.isscalar(s):
+            return func(s, *args)
+        return np.array([func(si, *args) for si in s])
+
 def dARSdS(tres, QAA, QFF, GAF, GFA, expQFF, kA, kF):
     r"""
     Evaluate the derivative with respect to s of the Laplace transform of the
@@ -551,8 +1529,8 @@ def dARSdS(tres, QAA, QFF, GAF, GFA, expQFF, kA, kF):
     DARS : array_like, shape (kA, kA)
     """
 
-    invQAA = nplin.inv(QAA)
-    invQFF = nplin.inv(QFF)
+    fQAA = factorize(QAA)
+    fQFF = factorize(QFF)
 
     #SFF = I - EXPQF
     I = np.eye(kF)
@@ -561,25 +1539,31 @@ def dARSdS(tres, QAA, QFF, GAF, GFA, expQFF, kA, kF):
     #Q1 = tres * GAF * exp(QFF*tres) * GFA
     Q1 = tres * np.dot(GAF, np.dot(expQFF, GFA))
     #Q2 = GAF * SFF * inv(QFF) * GFA
-    Q2 = np.dot(GAF, np.dot(SFF, np.dot(invQFF, GFA)))
+    Q2 = np.dot(GAF, np.dot(SFF, fQFF.solve(GFA)))
     #Q3 = -inv(QAA) * GAF * SFF * GFA
-    Q3 = np.dot(np.dot(np.dot(-invQAA, GAF), SFF), GFA)
+    Q3 = -fQAA.solve(np.dot(np.dot(GAF, SFF), GFA))
     Q1 = Q1 - Q2 + Q3
 
     # VA = I - GAF * SFF * GFA
     I = np.eye(kA)
     VA = I - np.dot(np.dot(GAF, SFF), GFA)
+    fVA = Factorization(VA)
 
     # DARS = inv(VA) * (QAA**-2) - inv(VA) * Q1 * inv(VA) * inv(QAA) =
     #      = inv(VA) * [inv(QAA) - Q1 * inv(VA)] * inv(QAA)
-    Q3 = invQAA + - np.dot(Q1, nplin.inv(VA))
-    DARS = np.dot(np.dot(nplin.inv(VA), Q3), invQAA)
+    Q3 = fQAA.inv() - fVA.rsolve(Q1)
+    DARS = fVA.solve(fQAA.rsolve(Q3))
 
     return DARS
 
-def AR(roots, tres, QAA, QFF, QAF, QFA, kA, kF):
+def AR(roots, tres, QAA, QFF, QAF, QFA, kA, kF, hev=None, factored=False):
     """
-    
+    Calculate residue matrices of the asymptotic pdf (Eq. 55, HJC92)
+    R[i] = c[i] * r[i] / (r[i] * W'(s[i]) * c[i]), where r[i] and c[i] are
+    the left and right null vectors of W(s[i]) at root s[i]. The null
+    vectors at all roots come from one batched singular value decomposition
+    of the stack W(roots); R does not depend on their normalisation.
+
     Parameters
     ----------
     roots : array_like, shape (1, kA)
@@ -590,35 +1574,27 @@ def AR(roots, tres, QAA, QFF, QAF, QFA, kA, kF):
         Submatrices of Q.
     kA, kF : ints
         Number of open and shut states.
+    hev : HEvaluator, optional
+        Evaluator of W(s) for the same submatrices and tres.
+    factored : bool
+        If True, return R as Spectral (accepted by eGAF, HAF and CHSvec)
+        instead of the dense (kA, kA, kA) array.
 
     Returns
     -------
-    R : ndarray, shape(kA, kA, kA)
+    R : ndarray, shape(kA, kA, kA) or Spectral
     """
 
-    R = np.zeros((kA, kA, kA))
-    row = np.zeros((kA, kA))
-    col1 = np.zeros((kA, kA))
-    for i in range(kA):
-        WA = W(roots[i], tres, QAA, QFF, QAF, QFA, kA, kF)
-        try:
-            row[i] = pinf(WA)
-        except:
-            row[i] = pinf1(WA)
-        AW = np.transpose(WA)
-        try:
-            col1[i] = pinf(AW)
-        except:
-            col1[i] = pinf1(AW)
-    col = col1.transpose()
-
-    for i in range(kA):
-        nom = np.dot(col[:,i].reshape((kA, 1)), row[i,:].reshape((1, kA)))
-        W1A = dW(roots[i], tres, QAF, QFF, QFA, kA, kF)
-        denom = np.dot(np.dot(row[i,:].reshape((1, kA)), W1A),
-            col[:,i].reshape((kA, 1)))
-        R[i] = nom / denom
-
+    if hev is None:
+        hev = HEvaluator(tres, QAA, QFF, QAF, QFA)
+    roots = np.asarray(roots, dtype=float).ravel()
+    U, S, Vt = nplin.svd(hev.W(roots))
+    row = U[:, :, -1]
+    col = Vt[:, -1, :]
+    denom = np.einsum('ia,iab,ib->i', row, hev.dW(roots), col)
+    if factored:
+        return Spectral(roots, col.T, row / denom[:, np.newaxis])
+    R = np.einsum('ia,ib->iab', col, row) / denom[:, np.newaxis, np.newaxis]
     return R
 
 def HAF(roots, tres, tcrit, QAF, expQFF, R):
@@ -633,7 +1609,7 @@ def HAF(roots, tres, tcrit, QAF, expQFF, R):
         Critical time.
     QAF : array_like, shape(kA, kF)
     expQFF : array_like, shape(kF, kF)
-    R : array_like, shape(kA, kA, kA)
+    R : array_like, shape(kA, kA, kA) or Spectral
 
     Returns
     -------
@@ -641,7 +1617,7 @@ def HAF(roots, tres, tcrit, QAF, expQFF, R):
     """
 
     coeff = -np.exp(roots * (tcrit - tres)) / roots
-    temp = np.sum(R * coeff.reshape(R.shape[0],1,1), axis=0)
+    temp = spectral_sum(R, coeff)
     HAF = np.dot(np.dot(temp, QAF), expQFF)
 
     return HAF
@@ -680,7 +1656,8 @@ def CHSvec(roots, tres, tcrit, QFA, kA, expQAA, phiF, R):
 
     return start, end
 
-def eGAF(t, tres, eigvals, Z00, Z10, Z11, roots, R, QAF, expQFF):
+def eGAF(t, tres, eigvals, Z00, Z10, Z11, roots, R, QAF, expQFF,
+    tswitch=None):
     #TODO: update documentation
     """
     Calculate transition density eGAF(t) for exact (Eq. 3.2, HJC90) and
@@ -698,27 +1675,134 @@ def eGAF(t, tres, eigvals, Z00, Z10, Z11, roots, R, QAF, expQFF):
         Z constants for the exact open time pdf.
     roots : array_like, shape (1, kA)
         Roots of the asymptotic pdf.
-    R : array_like, shape(kA, kA, kA)
+    R : array_like, shape(kA, kA, kA) or Spectral
     QAF : array_like, shape(kA, kF)
     expQFF : array_like, shape(kF, kF)
+    tswitch : float, optional
+        Times t >= tswitch use the asymptotic form (see eGAF_times).
 
     Returns
     -------
     eGAFt : array_like, shape(kA, kF)
     """
 
-    if t < (tres * 2): # exact
+    if tswitch is not None and t >= tswitch:
+        eGAFt = np.dot(np.dot(spectral_sum(R, np.exp(roots * (t - tres))),
+            QAF), expQFF)
+    elif t < (tres * 2): # exact
         eGAFt = f0((t - tres), eigvals, Z00)
     elif t < (tres * 3):
         eGAFt = (f0((t - tres), eigvals, Z00) -
             f1((t - 2 * tres), eigvals, Z10, Z11))
     else: # asymptotic
-        temp = np.sum(R * np.exp(roots *
-            (t - tres)).reshape(R.shape[0],1,1), axis=0)
+        temp = spectral_sum(R, np.exp(roots * (t - tres)))
         eGAFt = np.dot(np.dot(temp, QAF), expQFF)
 
     return eGAFt
 
+def eGAF_times(t, tres, eigvals, Z00, Z10, Z11, roots, R, QAF, expQFF,
+    tswitch=None):
+    """
+    Calculate transition densities eGAF(t) (see eGAF) for an array of times.
+    Times are split by regime with masks and each regime is evaluated for
+    all its times at once.
+
+    Parameters
+    ----------
+    t : array_like, shape (n,)
+        Time intervals.
+    tres : float
+        Time resolution (dead time).
+    eigvals : array_like, shape (k,)
+        Eigenvalues of -Q matrix.
+    Z00, Z10, Z11 : array_like, shape (k, kA, kF)
+        Z constants for the exact open time pdf.
+    roots : array_like, shape (kA,)
+        Roots of the asymptotic pdf.
+    R : array_like, shape(kA, kA, kA) or Spectral
+    QAF : array_like, shape(kA, kF)
+    expQFF : array_like, shape(kF, kF)
+    tswitch : float, optional
+        Times t >= tswitch use the asymptotic form. Default (and maximum,
+        since the exact solution is available for the first two dead times
+        only) is 3 * tres.
+
+    Returns
+    -------
+    eGAFt : ndarray, shape(n, kA, kF)
+    """
+
+    t = np.asarray(t, dtype=float).ravel()
+    tsw = 3 * tres if tswitch is None else min(tswitch, 3 * tres)
+    exact1 = t < min(2 * tres, tsw)
+    exact2 = (t >= 2 * tres) & (t < tsw)
+    asympt = t >= tsw
+
+    eGAFt = np.empty((t.shape[0],) + Z00.shape[1:],
+        dtype=np.result_type(Z00, eigvals, float))
+    if exact1.any():
+        w = np.exp(-np.outer(t[exact1] - tres, eigvals))
+        eGAFt[exact1] = np.einsum('ni,iab->nab', w, Z00)
+    if exact2.any():
+        w = np.exp(-np.outer(t[exact2] - tres, eigvals))
+        u = t[exact2] - 2 * tres
+        w1 = np.exp(-np.outer(u, eigvals))
+        eGAFt[exact2] = (np.einsum('ni,iab->nab', w, Z00) -
+            np.einsum('ni,iab->nab', w1, Z10) -
+            u[:, np.newaxis, np.newaxis] * np.einsum('ni,iab->nab', w1, Z11))
+    if asympt.any():
+        w = np.exp(np.outer(t[asympt] - tres, roots))
+        if isinstance(R, Spectral):
+            temp = R.apply(w)
+        else:
+            temp = np.einsum('ni,iab->nab', w, R)
+        eGAFt[asympt] = np.dot(temp, np.dot(QAF, expQFF))
+    return eGAFt
+
+def eGAF_tswitch(tres, eigvals, Z00, Z10, Z11, roots, R, QAF, expQFF, tol,
+    points=64):
+    """
+    Find the earliest time from which the asymptotic eGAF(t) (Eq. 3.24,
+    HJC90) agrees with the exact one (Eq. 3.2, HJC90) within a relative
+    tolerance. The discrepancy max|exact - asymptotic| / max|exact| is
+    measured at a grid of times between tres and 3 * tres; the result is
+    the first grid time after which it stays below tol, or 3 * tres if it
+    never does.
+
+    Parameters
+    ----------
+    tres : float
+        Time resolution (dead time).
+    eigvals, Z00, Z10, Z11, roots, R, QAF, expQFF
+        As for eGAF.
+    tol : float
+        Relative tolerance.
+    points : int
+        Number of grid times.
+
+    Returns
+    -------
+    tswitch : float
+        Switchover time for eGAF_times, between tres and 3 * tres.
+    err : ndarray, shape (points,)
+        Discrepancy at grid times tres * (1 + 2 * i / points).
+    """
+
+    t = tres * (1 + 2 * np.arange(points) / float(points))
+    exact = eGAF_times(t, tres, eigvals, Z00, Z10, Z11, roots, R, QAF,
+        expQFF)
+    asympt = eGAF_times(t, tres, eigvals, Z00, Z10, Z11, roots, R, QAF,
+        expQFF, tswitch=0)
+    n = t.shape[0]
+    err = (np.abs(exact - asympt).reshape(n, -1).max(axis=1) /
+        np.abs(exact).reshape(n, -1).max(axis=1))
+    bad = np.nonzero(~(err < tol))[0]
+    if bad.shape[0] == 0:
+        return t[0], err
+    if bad[-1] == n - 1:
+        return 3 * tres, err
+    return t[bad[-1] + 1], err
+
 def f0(u, eigvals, Z00):
     """
     A component of exact time pdf (Eq. 22, HJC92).
@@ -786,13 +1870,18 @@ def Zxx(Q, eigen, A, kopen, QFF, QAF, QFA, expQFF, open):
 
     Parameters
     ----------
-    t : float
-        Time.
     Q : array_like, shape (k, k)
+    eigen : array_like, shape (k,)
+        Eigenvalues of -Q matrix.
+    A : array_like, shape (k, k, k) or Spectral
+        Spectral matrices of -Q or their factored representation (see
+        eigs_factored).
     kopen : int
         Number of open states.
     QFF, QAF, QFA : array_like
         Submatrices of Q.
+    expQFF : array_like
+        exp(QFF * tres).
     open : bool
         True for open time pdf, False for shut time pdf.
 
@@ -808,9 +1897,11 @@ def Zxx(Q, eigen, A, kopen, QFF, QAF, QFA, expQFF, open):
     kA = k - QFF.shape[0]
 #    eigen, A = eigs(-Q)
     # Maybe needs check for equal eigenvalues.
+    if isinstance(A, Spectral):
+        Z00, Z10, Z11 = _Zxx_factored(A, kopen, QAF, QFA, expQFF, open)
+        return eigen, Z00, Z10, Z11
 
     # Calculate Dj (Eq. 3.16, HJC90) and Cimr (Eq. 3.18, HJC90).
-    D = np.empty((k))
     if open:
         C00 = A[:, :kopen, :kopen]
         A1 = A[:, :kopen, kopen:]
@@ -818,25 +1909,85 @@ def Zxx(Q, eigen, A, kopen, QFF, QAF, QFA, expQFF, open):
         C00 = A[:, kopen:, kopen:]
         A1 = A[:, kopen:, :kopen]
     D = np.dot(np.dot(A1, expQFF), QFA)
-
-    C11 = np.empty((k, kA, kA))
-    #TODO: try to remove 'for' cycles
-    for i in range(k):
-        C11[i] = np.dot(D[i], C00[i])
-
-    C10 = np.empty((k, kA, kA))
-    #TODO: try to remove 'for' cycles
-    for i in range(k):
-        S = np.zeros((kA, kA))
-        for j in range(k):
-            if j != i:
-                S += ((np.dot(D[i], C00[j]) + np.dot(D[j], C00[i])) /
-                    (eigen[j] - eigen[i]))
-        C10[i] = S
+    C11 = np.einsum('iab,ibc->iac', D, C00)
+
+    # C10[i] = sum_j (D[i] * C00[j] + D[j] * C00[i]) / (eigen[j] - eigen[i])
+    with np.errstate(divide='ignore'):
+        delta = 1 / (eigen[np.newaxis, :] - eigen[:, np.newaxis])
+    np.fill_diagonal(delta, 0)
+    if np.iscomplexobj(delta):
+        delta = delta.real
+    dC00 = np.tensordot(delta, C00, axes=(1, 0))
+    dD = np.tensordot(delta, D, axes=(1, 0))
+    C10 = (np.einsum('iab,ibc->iac', D, dC00) +
+        np.einsum('iab,ibc->iac', dD, C00))
 
     M = np.dot(QAF, expQFF)
-    Z00 = np.array([np.dot(C, M) for C in C00])
-    Z10 = np.array([np.dot(C, M) for C in C10])
-    Z11 = np.array([np.dot(C, M) for C in C11])
+    Z00 = np.dot(C00, M)
+    Z10 = np.dot(C10, M)
+    Z11 = np.dot(C11, M)
 
     return eigen, Z00, Z10, Z11
+
+def ZxxAF(Q, kA, QAA, QFF, QAF, QFA, expQAA, expQFF, spec=None):
+    """
+    Calculate Z constants for both the exact open and the exact shut time
+    pdf (Eq. 3.22, HJC90) from one decomposition of -Q.
+
+    Parameters
+    ----------
+    Q : array_like, shape (k, k)
+    kA : int
+        Number of open states.
+    QAA, QFF, QAF, QFA : array_like
+        Submatrices of Q.
+    expQAA, expQFF : array_like
+        exp(QAA * tres), exp(QFF * tres).
+    spec : Spectral, optional
+        Spectral representation of -Q (see eigs_factored).
+
+    Returns
+    -------
+    eigen : ndarray, shape (k,)
+        Eigenvalues of -Q matrix.
+    AZ00, AZ10, AZ11 : ndarrays, shape (k, kA, kF)
+        Z constants for the exact open time pdf.
+    FZ00, FZ10, FZ11 : ndarrays, shape (k, kF, kA)
+        Z constants for the exact shut time pdf.
+    """
+
+    if spec is None:
+        spec = eigs_factored(-Q)
+    eigen = spec.eigvals
+    AZ = _Zxx_factored(spec, kA, QAF, QFA, expQFF, True)
+    FZ = _Zxx_factored(spec, kA, QFA, QAF, expQAA, False)
+    return (eigen,) + AZ + FZ
+
+def _Zxx_factored(spec, kopen, QAF, QFA, expQFF, open):
+    """
+    Zxx for factored spectral representation. All Cimr (Eq. 3.18, HJC90)
+    are sums of outer products of columns of M (u) and rows of N (v), so
+    Z = C * QAF * expQFF needs only u, v * QAF * expQFF and the scalars
+    s[i, j] = N[i, F] * expQFF * QFA * M[A, j].
+    """
+
+    if open:
+        A, F = slice(None, kopen), slice(kopen, None)
+    else:
+        A, F = slice(kopen, None), slice(None, kopen)
+    u = spec.M[A]
+    w = np.dot(np.dot(spec.N[:, A], QAF), expQFF)
+    s = np.dot(np.dot(np.dot(spec.N[:, F], expQFF), QFA), u)
+    eigen = spec.eigvals
+    with np.errstate(divide='ignore'):
+        delta = 1 / (eigen[np.newaxis, :] - eigen[:, np.newaxis])
+    np.fill_diagonal(delta, 0)
+
+    Z00 = np.einsum('ai,ib->iab', u, w)
+    Z11 = Z00 * np.diag(s)[:, np.newaxis, np.newaxis]
+    # C10[i] = sum_j (D[i] * C00[j] + D[j] * C00[i]) / (eigen[j] - eigen[i])
+    Z10 = (np.einsum('ai,ib->iab', u, np.dot(delta * s, w)) +
+        np.einsum('ai,ib->iab', np.dot(u, (delta * s.T).T), w))
+    if np.iscomplexobj(Z10):
+        Z00, Z10, Z11 = Z00.real, Z10.real, Z11.real
+    return Z00, Z10, Z11
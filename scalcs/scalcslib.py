@@ -36,15 +36,18 @@ __author__="R.Lape, University College London"
 __date__ ="$07-Dec-2010 20:29:14$"
 
 import sys
+import functools
 from math import*
 from decimal import*
 import random
 
 import scipy.optimize as so
+import scipy.sparse as scsp
 import numpy as np
 from numpy import linalg as nplin
 
 from scalcs import qmatlib as qml
+from scalcs.bursts import Bursts
 #import bisectHJC
 from scalcs import pdfs
 #import optimize
@@ -57,22 +60,29 @@ def ideal_dwell_time_pdf(t, QAA, phiA):
 
     Parameters
     ----------
-    t : float
+    t : float or array_like, shape (n,)
         Time (sec).
-    QAA : array_like, shape (kA, kA)
-        Submatrix of Q.
+    QAA : array_like or sparse matrix, shape (kA, kA)
+        Submatrix of Q. For sparse QAA the pdf is calculated by Krylov
+        propagation of phiA (see qmatlib.propagate).
     phiA : array_like, shape (1, kA)
         Initial vector for openings
 
     Returns
     -------
-    f : float
+    f : float or ndarray, shape (n,)
     """
 
     kA = QAA.shape[0]
     uA = np.ones((kA, 1))
-    expQAA = qml.expQt(QAA, t)
-    f = np.dot(np.dot(np.dot(phiA, expQAA), -QAA), uA)
+    if qml.issparse(QAA):
+        f = np.dot(qml.propagate(phiA, QAA, t), -QAA.dot(uA))
+        return f[..., 0] if np.isscalar(t) else f[:, 0]
+    if np.isscalar(t):
+        expQAA = qml.expQt(QAA, t)
+        f = np.dot(np.dot(np.dot(phiA, expQAA), -QAA), uA)
+    else:
+        f = np.dot(np.dot(qml.phi_expQt(phiA, QAA, t), -QAA), uA)[:, 0]
     return f
 
 def ideal_dwell_time_pdf_components(QAA, phiA):
@@ -110,13 +120,17 @@ def ideal_dwell_time_pdf_components(QAA, phiA):
 
 def ideal_subset_time_pdf(Q, k1, k2, t):
     """
-    
+    Probability density function of dwell times in a subset of states
+    k1 to k2. t may be a float or an array of times.
     """
     
     u = np.ones((k2 - k1 + 1, 1))
     phi, QSub = qml.phiSub(Q, k1, k2)
-    expQSub = qml.expQt(QSub, t)
-    f = np.dot(np.dot(np.dot(phi, expQSub), -QSub), u)
+    if np.isscalar(t):
+        expQSub = qml.expQt(QSub, t)
+        f = np.dot(np.dot(np.dot(phi, expQSub), -QSub), u)
+    else:
+        f = np.dot(np.dot(qml.phi_expQt(phi, QSub, t), -QSub), u)[:, 0]
     return f
 
 def ideal_subset_mean_life_time(Q, state1, state2):
@@ -182,15 +196,16 @@ def ideal_mean_latency_given_start_state(mec, state):
         p = np.zeros((mec.kA))
         p[state-1] = 1
         u = np.ones((mec.kA, 1))
-        invQ = nplin.inv(-mec.QAA)
+        fQ = qml.factorize(mec.QAA)
     else:
         # for calculating mean latency to next opening
         p = np.zeros((mec.kI))
         p[state-mec.kA-1] = 1
         u = np.ones((mec.kI, 1))
-        invQ = nplin.inv(-mec.QII)
+        fQ = qml.factorize(mec.QII)
 
-    mean = np.dot(np.dot(p, invQ), u)[0]
+    # mean = p * inv(-Q) * u
+    mean = -np.dot(p, fQ.solve(u))[0]
 
     return mean
 
@@ -220,7 +235,62 @@ def asymptotic_pdf(t, tres, tau, area):
 
     return apdf
 
-def asymptotic_roots(tres, QAA, QFF, QAF, QFA, kA, kF):
+class RootTracker(object):
+    """
+    Keep asymptotic roots between calls to asymptotic_roots (e.g. successive
+    HJClik evaluations or points of a concentration or tres sweep) and use
+    them to bracket the new roots. Points between the previous roots
+    (geometric means of neighbours) are accepted as brackets only if the
+    numbers of eigenvalues of H(s) below them (see bisect_gFB) confirm that
+    each interval holds exactly one root; otherwise the full bisection
+    search is used. Counters warm and full record how often each was used.
+    """
+
+    def __init__(self):
+        self.roots = None
+        self.warm = 0
+        self.full = 0
+
+    def brackets(self, hev, k1):
+        """
+        Brackets for the roots from the previous solution.
+
+        Parameters
+        ----------
+        hev : qmatlib.HEvaluator
+        k1 : int
+            Number of roots.
+
+        Returns
+        -------
+        sr : ndarray, shape (k1, 2) or None
+            Limits of intervals containing exactly one root, in the order of
+            the previous roots, or None if previous roots cannot be used.
+        """
+
+        if self.roots is None or self.roots.shape[0] != k1:
+            return None
+        order = np.argsort(self.roots)
+        r = self.roots[order]
+        if not np.all(r < 0) or np.any(np.diff(r) == 0):
+            return None
+        points = np.concatenate(([r[0] * 4], -np.sqrt(r[:-1] * r[1:]),
+            [r[-1] / 4]))
+        if not np.array_equal(hev.count(points), np.arange(k1 + 1)):
+            return None
+        sr = np.empty((k1, 2))
+        sr[order] = np.column_stack((points[:-1], points[1:]))
+        return sr
+
+    def reset(self):
+        """
+        Forget roots and zero the counters.
+        """
+        self.roots = None
+        self.warm, self.full = 0, 0
+
+def asymptotic_roots(tres, QAA, QFF, QAF, QFA, kA, kF, method='brentq',
+    tracker=None, hev=None):
     """
     Find roots for the asymptotic probability density function (Eqs. 52-58,
     HJC92).
@@ -238,28 +308,138 @@ def asymptotic_roots(tres, QAA, QFF, QAF, QFA, kA, kF):
         A number of open states in kinetic scheme.
     kF : int
         A number of shut states in kinetic scheme.
+    method : {'brentq', 'newton'}
+        Solver used within each bracket found by bisection: Brent's method
+        on det W(s), or safeguarded Newton iteration using W'(s) (see
+        newton_detW). On CH82 Newton needs about 5 evaluations of W(s)
+        and W'(s) together per root, brentq about 9 of det W(s).
+    tracker : RootTracker, optional
+        Warm start from roots of the previous call; updated with the new
+        roots.
+    hev : qmatlib.HEvaluator, optional
+        Evaluator of H(s) for the same submatrices and tres.
 
     Returns
     -------
     roots : array_like, shape (1, kA)
     """
 
-    sas = -1000000
-    sbs = -0.0000001
-    sro = bisect_intervals(sas, sbs, tres,
-        QAA, QFF, QAF, QFA, kA, kF)
-
+    # One decomposition of QFF serves all evaluations of H(s) and det W(s).
+    if hev is None:
+        hev = qml.HEvaluator(tres, QAA, QFF, QAF, QFA)
+    sro = None
+    if tracker is not None:
+        sro = tracker.brackets(hev, kA)
+        if sro is None:
+            tracker.full += 1
+        else:
+            tracker.warm += 1
+    if sro is None:
+        sas = -1000000
+        sbs = -0.0000001
+        sro = bisect_intervals(sas, sbs, tres,
+            QAA, QFF, QAF, QFA, kA, kF, hev)
+
+    signs = [None] * kA
+    if method == 'newton' and sro.shape[0] == kA:
+        # Brackets are certified by counts of eigenvalues of H(s) not above
+        # s (bisect_gFB): the one with the i-th lowest limit has i of them
+        # at its lower limit, so det W(s) = prod(s - eigval) has the sign
+        # (-1)^(kA - i) there and need not be evaluated.
+        signs = np.empty(kA)
+        signs[np.argsort(sro[:, 0])] = (-1.0) ** (kA - np.arange(kA))
     roots = np.zeros(kA)
     for i in range(kA):
-        roots[i] = so.brentq(qml.detW, sro[i, 0], sro[i, 1],
-            args=(tres, QAA, QFF, QAF, QFA, kA, kF))
+        if method == 'newton':
+            roots[i] = newton_detW(hev, sro[i, 0], sro[i, 1],
+                signa=signs[i])
+        else:
+            roots[i] = so.brentq(hev.detW, sro[i, 0], sro[i, 1])
+    if tracker is not None:
+        tracker.roots = roots.copy()
 
 #        roots[i] = so.bisect(qml.detW, sro[i,0], sro[i,1],
 #            args=(tres, QAA, QFF, QAF, QFA, kA, kF))
 
     return roots
 
-def bisect_gFB(s, tres, Q11, Q22, Q12, Q21, k1, k2):
+def newton_detW(hev, sa, sb, xtol=2e-12, rtol=4 * np.finfo(float).eps,
+    maxiter=100, signa=None):
+    """
+    Find root of det W(s) in bracket [sa, sb] by Newton iteration safeguarded
+    by bisection. The Newton step needs no determinant derivative:
+    d(det W)/ds = det W * tr(inv(W) * W'), hence the step is
+    -1 / tr(inv(W) * W'). Steps leaving the current bracket, or not
+    halving it, are replaced by bisection, so convergence is guaranteed.
+    W(s) and W'(s) come from one pass (HEvaluator.W_dW). The first point
+    is the middle of the bracket; the next one is the eigenvalue of H(s)
+    there that lies in the bracket, as the root is where an eigenvalue of
+    H(s), which changes slowly with s, equals s.
+
+    Parameters
+    ----------
+    hev : qmatlib.HEvaluator
+        Evaluator of W(s) and W'(s).
+    sa, sb : floats
+        Limits of interval containing exactly one root.
+    xtol, rtol : floats
+        Absolute and relative tolerance in s (as in scipy.optimize.brentq).
+    maxiter : int
+        Maximum number of iterations.
+    signa : {1, -1}, optional
+        Sign of det W(sa), if known (see asymptotic_roots); otherwise
+        det W(s) is evaluated at both limits to check the bracket.
+
+    Returns
+    -------
+    root : float
+    """
+
+    if signa is None:
+        fa = hev.detW(sa)
+        if fa == 0: return sa
+        fb = hev.detW(sb)
+        if fb == 0: return sb
+        if np.sign(fa) == np.sign(fb):
+            raise ValueError('det W(s) must have different signs ' +
+                'at sa and sb.')
+        signa = np.sign(fa)
+
+    s = 0.5 * (sa + sb)
+    width = sb - sa
+    for i in range(maxiter):
+        W, dW = hev.W_dW(s)
+        fs = nplin.det(W)
+        if fs == 0: return s
+        if np.sign(fs) == signa:
+            sa = s
+        else:
+            sb = s
+        tol = xtol + rtol * abs(s)
+        if i == 0:
+            eigval = s - nplin.eigvals(W).real
+            eigval = eigval[(eigval > sa) & (eigval < sb)]
+            if eigval.size:
+                snew = eigval[np.argmin(np.abs(eigval - s))]
+                width = abs(snew - s)
+                s = snew
+                continue
+        tr = np.trace(nplin.solve(W, dW))
+        snew = s - 1 / tr if tr != 0 else sa
+        if abs(snew - s) < tol:
+            return snew if sa <= snew <= sb else s
+        if not (sa < snew < sb) or abs(snew - s) > 0.5 * width:
+            snew = 0.5 * (sa + sb)
+        width = abs(snew - s)
+        s = snew
+        if (sb - sa) < tol:
+            return s
+    sys.stderr.write(
+        "newton_detW: Warning: root not converged in {0:d} iterations.".
+        format(maxiter))
+    return s
+
+def bisect_gFB(s, tres, Q11, Q22, Q12, Q21, k1, k2, hev=None):
     """
     Find number of eigenvalues of H(s) that are equal to or less than s.
 
@@ -278,18 +458,22 @@ def bisect_gFB(s, tres, Q11, Q22, Q12, Q21, k1, k2):
         A number of open/shut states in kinetic scheme.
     k2 : int
         A number of shut/open states in kinetic scheme.
+    hev : qmatlib.HEvaluator, optional
+        Evaluator of H(s) for the same submatrices and tres.
 
     Returns
     -------
     ng : int
     """
 
+    if hev is not None:
+        return hev.count(s)
     h = qml.H(s, tres, Q11, Q22, Q12, Q21, k2)
     eigval = nplin.eigvals(h)
     ng = (eigval <= s).sum()
     return ng
 
-def bisect_intervals(sa, sb, tres, Q11, Q22, Q12, Q21, k1, k2):
+def bisect_intervals(sa, sb, tres, Q11, Q22, Q12, Q21, k1, k2, hev=None):
     """
     Find, according to Frank Ball's method, suitable starting guesses for
     each HJC root- the upper and lower limits for bisection. Exactly one root
@@ -308,6 +492,8 @@ def bisect_intervals(sa, sb, tres, Q11, Q22, Q12, Q21, k1, k2):
         Q11, Q12, Q22, Q21 - submatrices of Q.
     k1, k2 : int
         Numbers of open/shut states in kinetic scheme.
+    hev : qmatlib.HEvaluator, optional
+        Evaluator of H(s) for the same submatrices and tres.
 
     Returns
     -------
@@ -315,9 +501,9 @@ def bisect_intervals(sa, sb, tres, Q11, Q22, Q12, Q21, k1, k2):
         Limits of s value intervals containing exactly one root.
     """
 
-    nga = bisect_gFB(sa, tres, Q11, Q22, Q12, Q21, k1, k2)
+    nga = bisect_gFB(sa, tres, Q11, Q22, Q12, Q21, k1, k2, hev)
     if nga > 0: sa = sa * 4
-    ngb = bisect_gFB(sb, tres, Q11, Q22, Q12, Q21, k1, k2)
+    ngb = bisect_gFB(sb, tres, Q11, Q22, Q12, Q21, k1, k2, hev)
     if ngb < k2: sb = sb / 4
 
     done = []
@@ -328,7 +514,7 @@ def bisect_intervals(sa, sb, tres, Q11, Q22, Q12, Q21, k1, k2):
     while todo:
         svv = todo.pop()
         sa1, sc, sb2, nga1, ngc, ngb2 = bisect_split(svv[0], svv[1], svv[2], svv[3],
-            tres, Q11, Q22, Q12, Q21, k1, k2)
+            tres, Q11, Q22, Q12, Q21, k1, k2, hev)
 #        nsplit += 1
 
         # Check if either or both of the two subintervals output from
@@ -350,7 +536,8 @@ def bisect_intervals(sa, sb, tres, Q11, Q22, Q12, Q21, k1, k2):
             format(len(done), k1))
     return np.array(done)
 
-def bisect_split(sa, sb, nga, ngb, tres, Q11, Q22, Q12, Q21, k1, k2):
+def bisect_split(sa, sb, nga, ngb, tres, Q11, Q22, Q12, Q21, k1, k2,
+    hev=None):
     """
     Split interval [sa, sb] into two subintervals, each of which contains
     at least one root.
@@ -370,6 +557,8 @@ def bisect_split(sa, sb, nga, ngb, tres, Q11, Q22, Q12, Q21, k1, k2):
         Q11, Q12, Q22, Q21 - submatrices of Q.
     k1, k2 : int
         Numbers of open/shut states in kinetic scheme.
+    hev : qmatlib.HEvaluator, optional
+        Evaluator of H(s) for the same submatrices and tres.
 
     Returns
     -------
@@ -386,7 +575,7 @@ def bisect_split(sa, sb, nga, ngb, tres, Q11, Q22, Q12, Q21, k1, k2):
 
     while (not end) and (ntry < ntrymax):
         sc = (sa + sb) / 2.0
-        ngc = bisect_gFB(sc, tres, Q11, Q22, Q12, Q21, k1, k2)
+        ngc = bisect_gFB(sc, tres, Q11, Q22, Q12, Q21, k1, k2, hev)
         if ngc == nga: sa = sc
         elif ngc == ngb: sb = sc
         else:
@@ -398,6 +587,49 @@ def bisect_split(sa, sb, nga, ngb, tres, Q11, Q22, Q12, Q21, k1, k2):
 
     return sa, sc, sb, nga, ngc, ngb
 
+def asymptotic_R_areas(tres, roots, QAA, QFF, QAF, QFA, kA, kF, GAF, GFA,
+    factored=False):
+    """
+    Find the residue matrices (Eq. 55, HJC92) and the areas (Eq. 58, HJC92)
+    of the asymptotic pdf at all roots at once.
+
+    Parameters
+    ----------
+    tres : float
+        Time resolution (dead time).
+    roots : array_like, shape (1,kA)
+        Roots of the asymptotic pdf.
+    QAA, QFF, QAF, QFA : array_like
+        Submatrices of Q.
+    kA, kF : ints
+        Numbers of open and shut states in kinetic scheme.
+    GAF, GFA : array_like
+        Transition probabilities.
+    factored : bool
+        Return R as qmatlib.Spectral (see qmatlib.AR).
+
+    Returns
+    -------
+    R : ndarray, shape (kA, kA, kA) or qmatlib.Spectral
+    areas : ndarray, shape (1, kA)
+    """
+
+    expQFF = qml.expQt(QFF, tres)
+    expQAA = qml.expQt(QAA, tres)
+    eGAF = qml.eGs(GAF, GFA, kA, kF, expQFF)
+    eGFA = qml.eGs(GFA, GAF, kF, kA, expQAA)
+    phiA = qml.phiHJC(eGAF, eGFA, kA)
+    Rs = qml.AR(roots, tres, QAA, QFF, QAF, QFA, kA, kF, factored=True)
+    areas = _asymptotic_areas_R(roots, Rs, phiA, QAF, expQFF)
+    R = Rs if factored else Rs.A
+    return R, areas
+
+def _asymptotic_areas_R(roots, R, phiA, QAF, expQFF):
+    # areas[i] = -phiA * R[i] * QAF * expQFF * uF / roots[i], R factored.
+    col = np.sum(np.dot(QAF, expQFF), axis=1)
+    return (-1 / np.asarray(roots) *
+        np.dot(np.ravel(phiA), R.M) * np.dot(R.N, col))
+
 def asymptotic_areas(tres, roots, QAA, QFF, QAF, QFA, kA, kF, GAF, GFA):
     """
     Find the areas of the asymptotic pdf (Eq. 58, HJC92).
@@ -426,17 +658,8 @@ def asymptotic_areas(tres, roots, QAA, QFF, QAF, QFA, kA, kF, GAF, GFA):
     areas : ndarray, shape (1, kA)
     """
 
-    expQFF = qml.expQt(QFF, tres)
-    expQAA = qml.expQt(QAA, tres)
-    eGAF = qml.eGs(GAF, GFA, kA, kF, expQFF)
-    eGFA = qml.eGs(GFA, GAF, kF, kA, expQAA)
-    phiA = qml.phiHJC(eGAF, eGFA, kA)
-    R = qml.AR(roots, tres, QAA, QFF, QAF, QFA, kA, kF)
-    uF = np.ones((kF,1))
-    areas = np.zeros(kA)
-    for i in range(kA):
-        areas[i] = ((-1 / roots[i]) *
-            np.dot(phiA, np.dot(np.dot(R[i], np.dot(QAF, expQFF)), uF)))
+    R, areas = asymptotic_R_areas(tres, roots, QAA, QFF, QAF, QFA, kA, kF,
+        GAF, GFA, factored=True)
 
 #    rowA = np.zeros((kA,kA))
 #    colA = np.zeros((kA,kA))
@@ -457,7 +680,8 @@ def asymptotic_areas(tres, roots, QAA, QFF, QAF, QFA, kA, kF, GAF, GFA):
 
     return areas
 
-def exact_pdf(t, tres, roots, areas, eigvals, gamma00, gamma10, gamma11):
+def exact_pdf(t, tres, roots, areas, eigvals, gamma00, gamma10, gamma11,
+    chunk=65536, tswitch=None):
     r"""
     Calculate exponential probabolity density function with exact solution for
     missed events correction (Eq. 21, HJC92).
@@ -475,7 +699,7 @@ def exact_pdf(t, tres, roots, areas, eigvals, gamma00, gamma10, gamma11):
 
     Parameters
     ----------
-    t : float
+    t : float or array_like, shape (n,)
         Time.
     tres : float
         Time resolution (dead time).
@@ -485,14 +709,32 @@ def exact_pdf(t, tres, roots, areas, eigvals, gamma00, gamma10, gamma11):
         Eigenvalues of -Q matrix.
     gama00, gama10, gama11 : lists of floats
         Coeficients for the exact open/shut time pdf.
+    chunk : int
+        For arrays, number of times evaluated at once; bounds memory of the
+        (chunk, k) exponentials on very fine grids.
+    tswitch : float, optional
+        Times t >= tswitch use the asymptotic pdf (default 3 * tres; see
+        HJCContext.Atswitch).
 
     Returns
     -------
-    f : float
+    f : float or ndarray, shape (n,)
     """
 
+    if not np.isscalar(t):
+        t = np.asarray(t, dtype=float)
+        f = np.empty(t.shape)
+        tf, ff = t.ravel(), f.reshape(-1)
+        for start in range(0, tf.shape[0], chunk):
+            ff[start : start + chunk] = _exact_pdf_array(
+                tf[start : start + chunk], tres, roots, areas, eigvals,
+                gamma00, gamma10, gamma11, tswitch)
+        return f
+
     if t < tres:
         f = 0
+    elif tswitch is not None and t >= tswitch:
+        f = pdfs.expPDF(t - tres, -1 / roots, areas)
     elif ((tres < t) and (t < (2 * tres))):
         f = qml.f0((t - tres), eigvals, gamma00)
     elif ((tres * 2) < t) and (t < (3 * tres)):
@@ -502,50 +744,48 @@ def exact_pdf(t, tres, roots, areas, eigvals, gamma00, gamma10, gamma11):
         f = pdfs.expPDF(t - tres, -1 / roots, areas)
     return f
 
-def exact_mean_open_shut_time(mec, tres):
+def _exact_pdf_array(t, tres, roots, areas, eigvals, gamma00, gamma10,
+    gamma11, tswitch=None):
+    # Same regimes (and boundaries) as scalar exact_pdf, selected by masks.
+    f = np.zeros(t.shape)
+    tsw = 3 * tres if tswitch is None else tswitch
+    exact1 = (tres < t) & (t < 2 * tres) & (t < tsw)
+    exact2 = (2 * tres < t) & (t < 3 * tres) & (t < tsw)
+    asympt = ~(t < tres) & ~exact1 & ~exact2
+    if exact1.any():
+        f[exact1] = np.dot(np.exp(-np.outer(t[exact1] - tres, eigvals)),
+            gamma00).real
+    if exact2.any():
+        u = t[exact2] - 2 * tres
+        w1 = np.exp(-np.outer(u, eigvals))
+        f[exact2] = (np.dot(np.exp(-np.outer(t[exact2] - tres, eigvals)),
+            gamma00) - np.dot(w1, gamma10) - u * np.dot(w1, gamma11)).real
+    if asympt.any():
+        f[asympt] = pdfs.expPDF(t[asympt] - tres, -1 / roots, areas)
+    return f
+
+def exact_mean_open_shut_time(mec, tres, ctx=None):
     """
     Calculate exact mean open or shut time from HJC probability density
     function.
 
     Parameters
     ----------
+    mec : dcpyps.Mechanism
+        The mechanism to be analysed.
     tres : float
         Time resolution (dead time).
-    QAA : array_like, shape (kA, kA)
-    QFF : array_like, shape (kF, kF)
-    QAF : array_like, shape (kA, kF)
-        QAA, QFF, QAF - submatrices of Q.
-    kA : int
-        A number of open states in kinetic scheme.
-    kF : int
-        A number of shut states in kinetic scheme.
-    GAF : array_like, shape (kA, kB)
-    GFA : array_like, shape (kB, kA)
-        GAF, GFA- transition probabilities
+    ctx : HJCContext, optional
+        Context of mec.Q and tres to take intermediates from.
 
     Returns
     -------
-    mean : float
-        Apparent mean open/shut time.
+    meanA, meanF : floats
+        Apparent mean open and shut times.
     """
-    GAF, GFA = qml.iGs(mec.Q, mec.kA, mec.kF)
-    expQFF = qml.expQt(mec.QFF, tres)
-    expQAA = qml.expQt(mec.QAA, tres)
-    eGAF = qml.eGs(GAF, GFA, mec.kA, mec.kF, expQFF)
-    eGFA = qml.eGs(GFA, GAF, mec.kF, mec.kA, expQAA)
-
-    phiA = qml.phiHJC(eGAF, eGFA, mec.kA)
-    phiF = qml.phiHJC(eGFA, eGAF, mec.kF)
-    QexpQF = np.dot(mec.QAF, expQFF)
-    QexpQA = np.dot(mec.QFA, expQAA)
-    DARS = qml.dARSdS(tres, mec.QAA, mec.QFF, GAF, GFA, expQFF, mec.kA, mec.kF)
-    DFRS = qml.dARSdS(tres, mec.QFF, mec.QAA, GFA, GAF, expQAA, mec.kF, mec.kA)
-    uF, uA = np.ones((mec.kF, 1)), np.ones((mec.kA, 1))
-    # meanOpenTime = tres + phiA * DARS * QexpQF * uF
-    meanA = tres + np.dot(phiA, np.dot(np.dot(DARS, QexpQF), uF))[0]
-    meanF = tres + np.dot(phiF, np.dot(np.dot(DFRS, QexpQA), uA))[0]
-
-    return meanA, meanF
+    if ctx is None:
+        ctx = HJCContext(mec.Q, mec.kA, tres, kF=mec.kF)
+    return ctx.meanA, ctx.meanF
 
 
 def exact_mean_time(tres, QAA, QFF, QAF, kA, kF, GAF, GFA):
@@ -590,7 +830,7 @@ def exact_mean_time(tres, QAA, QFF, QAF, kA, kF, GAF, GFA):
 
     return mean
 
-def exact_GAMAxx(mec, tres, open):
+def exact_GAMAxx(mec, tres, open, ctx=None):
     """
     Calculate gama coeficients for the exact open time pdf (Eq. 3.22, HJC90).
 
@@ -601,6 +841,8 @@ def exact_GAMAxx(mec, tres, open):
         The mechanism to be analysed.
     open : bool
         True for open time pdf and False for shut time pdf.
+    ctx : HJCContext, optional
+        Context of mec.Q and tres to take intermediates from.
 
     Returns
     -------
@@ -610,39 +852,388 @@ def exact_GAMAxx(mec, tres, open):
         Constants for the exact open/shut time pdf.
     """
 
-    expQFF = qml.expQt(mec.QII, tres)
-    expQAA = qml.expQt(mec.QAA, tres)
-    GAF, GFA = qml.iGs(mec.Q, mec.kA, mec.kI)
-    eGAF = qml.eGs(GAF, GFA, mec.kA, mec.kI, expQFF)
-    eGFA = qml.eGs(GFA, GAF, mec.kI, mec.kA, expQAA)
-    eigs, A = qml.eigs_sorted(-mec.Q)
+    if ctx is None:
+        ctx = HJCContext(mec.Q, mec.kA, tres, kF=mec.kF)
+    gama00, gama10, gama11 = ctx.Agamma if open else ctx.Fgamma
+    return ctx.eigvals, gama00, gama10, gama11
 
-    if open:
-        phi = qml.phiHJC(eGAF, eGFA, mec.kA)
-        eigen, Z00, Z10, Z11 = qml.Zxx(mec.Q, eigs, A, mec.kA,
-            mec.QII, mec.QAI, mec.QIA, expQFF, open)
-        u = np.ones((mec.kI,1))
-    else:
-        phi = qml.phiHJC(eGFA, eGAF, mec.kI)
-        eigen, Z00, Z10, Z11 = qml.Zxx(mec.Q, eigs, A, mec.kA,
-            mec.QAA, mec.QIA, mec.QAI, expQAA, open)
-        u = np.ones((mec.kA, 1))
+def _cached(func):
+    # Lazy HJCContext attribute: computed on first access, then kept.
+    name = func.__name__
+    @functools.wraps(func)
+    def wrapper(self):
+        cache = self._shared if name in self.SHARED else self._cache
+        try:
+            return cache[name]
+        except KeyError:
+            value = cache[name] = func(self)
+            return value
+    return property(wrapper)
+
+class HJCContext(object):
+    """
+    Missed events (HJC) intermediates for a Q matrix and resolution: G
+    matrices, exponentials of QAA and QFF, eGAF(s=0), HJC initial vectors,
+    asymptotic roots and residues, exact pdf constants and mean times. Each
+    is calculated on first use and kept, so functions sharing one context
+    (e.g. printout_occupancies and printout_distributions) do every root
+    search and decomposition once. Parts that do not depend on tres (Q
+    submatrices, GAF, GFA and the decomposition of -Q) are shared with
+    contexts made by with_tres.
 
-    gama00 = (np.dot(np.dot(phi, Z00), u)).T[0]
-    gama10 = (np.dot(np.dot(phi, Z10), u)).T[0]
-    gama11 = (np.dot(np.dot(phi, Z11), u)).T[0]
+    Parameters
+    ----------
+    Q : array_like, shape (k, k)
+        Copied, so later changes of the caller's Q (e.g. mec.set_eff) do
+        not affect the context.
+    kA : int
+        Number of open states.
+    tres : float
+        Time resolution (dead time).
+    root_method : {'brentq', 'newton'}
+        See asymptotic_roots.
+    switch_tol : float, optional
+        If given, the switch from exact to asymptotic eGAF(t) is moved from
+        3 * tres to the earliest time where the two agree within this
+        relative tolerance (see qmatlib.eGAF_tswitch, Atswitch, Ftswitch).
+    shared : dict, optional
+        Cache of tres independent attributes of another context of the
+        same Q (see with_tres).
+    kF : int, optional
+        Number of shut states (F), states kA to kA + kF - 1. States after
+        them (kD states of a mechanism) are left out, as in mec.QGG. By
+        default all states that are not open are shut.
+    """
+
+    # Attributes independent of tres, kept in _shared.
+    SHARED = ('QAA', 'QFF', 'QAF', 'QFA', 'GAF', 'GFA', 'spec', 'specAA',
+        'specFF', 'hevA0', 'hevF0')
+
+    def __init__(self, Q, kA, tres, root_method='brentq', switch_tol=None,
+        shared=None, kF=None):
+        # Own copy: cached results must not change with the caller's Q.
+        k = np.shape(Q)[0] if kF is None else kA + kF
+        self.Q = np.array(np.asarray(Q)[:k, :k], copy=True)
+        self.k = k
+        self.kA = kA
+        self.kF = k - kA
+        self.tres = tres
+        self.root_method = root_method
+        self.switch_tol = switch_tol
+        self.Atracker = None
+        self.Ftracker = None
+        # Numbers of intervals evaluated by exact and asymptotic eGAF(t).
+        self.paths = {'exact': 0, 'asymptotic': 0}
+        self._cache = {}
+        self._shared = {} if shared is None else shared
+
+    def with_tres(self, tres):
+        """
+        New context for another resolution sharing all tres independent
+        parts and root trackers with this one.
+        """
+        ctx = HJCContext(self.Q, self.kA, tres, self.root_method,
+            self.switch_tol, self._shared, self.kF)
+        ctx.Atracker, ctx.Ftracker = self.Atracker, self.Ftracker
+        return ctx
+
+    @_cached
+    def QAA(self):
+        return self.Q[:self.kA, :self.kA]
+
+    @_cached
+    def QFF(self):
+        return self.Q[self.kA:, self.kA:]
+
+    @_cached
+    def QAF(self):
+        return self.Q[:self.kA, self.kA:]
+
+    @_cached
+    def QFA(self):
+        return self.Q[self.kA:, :self.kA]
+
+    @_cached
+    def GAF(self):
+        GAF, self._shared['GFA'] = qml.iGs(self.Q, self.kA, self.kF)
+        return GAF
+
+    @_cached
+    def GFA(self):
+        self.GAF
+        return self._shared['GFA']
+
+    @_cached
+    def spec(self):
+        """Spectral representation of -Q, eigenvalues ascending."""
+        return qml.eigs_factored(-self.Q).sorted()
+
+    @_cached
+    def eigvals(self):
+        return self.spec.eigvals
+
+    @_cached
+    def specAA(self):
+        """Spectral representation of QAA or None if ill-conditioned."""
+        factors = qml._spectral_factors(self.QAA)
+        return None if factors is None else qml.Spectral(*factors)
+
+    @_cached
+    def specFF(self):
+        """Spectral representation of QFF or None if ill-conditioned."""
+        factors = qml._spectral_factors(self.QFF)
+        return None if factors is None else qml.Spectral(*factors)
+
+    @_cached
+    def expQFF(self):
+        if self.specFF is None:
+            return qml.expQt(self.QFF, self.tres)
+        return qml.expQt(self.specFF, self.tres)
+
+    @_cached
+    def expQAA(self):
+        if self.specAA is None:
+            return qml.expQt(self.QAA, self.tres)
+        return qml.expQt(self.specAA, self.tres)
+
+    @_cached
+    def eGAF(self):
+        return qml.eGs(self.GAF, self.GFA, self.kA, self.kF, self.expQFF)
+
+    @_cached
+    def eGFA(self):
+        return qml.eGs(self.GFA, self.GAF, self.kF, self.kA, self.expQAA)
+
+    @_cached
+    def phiA(self):
+        return qml.phiHJC(self.eGAF, self.eGFA, self.kA)
+
+    @_cached
+    def phiF(self):
+        return qml.phiHJC(self.eGFA, self.eGAF, self.kF)
+
+    @_cached
+    def hevA0(self):
+        return qml.HEvaluator(self.tres, self.QAA, self.QFF, self.QAF,
+            self.QFA, self.specFF)
+
+    @_cached
+    def hevF0(self):
+        return qml.HEvaluator(self.tres, self.QFF, self.QAA, self.QFA,
+            self.QAF, self.specAA)
+
+    @_cached
+    def hevA(self):
+        return self.hevA0.with_tres(self.tres)
+
+    @_cached
+    def hevF(self):
+        return self.hevF0.with_tres(self.tres)
+
+    @_cached
+    def Aroots(self):
+        return asymptotic_roots(self.tres, self.QAA, self.QFF, self.QAF,
+            self.QFA, self.kA, self.kF, self.root_method, self.Atracker,
+            self.hevA)
+
+    @_cached
+    def Froots(self):
+        return asymptotic_roots(self.tres, self.QFF, self.QAA, self.QFA,
+            self.QAF, self.kF, self.kA, self.root_method, self.Ftracker,
+            self.hevF)
+
+    @_cached
+    def AR(self):
+        return qml.AR(self.Aroots, self.tres, self.QAA, self.QFF, self.QAF,
+            self.QFA, self.kA, self.kF, self.hevA, factored=True)
+
+    @_cached
+    def FR(self):
+        return qml.AR(self.Froots, self.tres, self.QFF, self.QAA, self.QFA,
+            self.QAF, self.kF, self.kA, self.hevF, factored=True)
+
+    @_cached
+    def Aareas(self):
+        return _asymptotic_areas_R(self.Aroots, self.AR, self.phiA,
+            self.QAF, self.expQFF)
+
+    @_cached
+    def Fareas(self):
+        return _asymptotic_areas_R(self.Froots, self.FR, self.phiF,
+            self.QFA, self.expQAA)
+
+    @_cached
+    def AZ(self):
+        """Z00, Z10, Z11 for the exact open time pdf."""
+        Z = qml.ZxxAF(self.Q, self.kA, self.QAA, self.QFF, self.QAF,
+            self.QFA, self.expQAA, self.expQFF, self.spec)
+        self._cache['FZ'] = Z[4:]
+        return Z[1:4]
+
+    @_cached
+    def FZ(self):
+        """Z00, Z10, Z11 for the exact shut time pdf."""
+        self.AZ
+        return self._cache['FZ']
+
+    @_cached
+    def Atswitch(self):
+        """Start of asymptotic regime of open time eGAF(t)."""
+        if self.switch_tol is None:
+            return 3 * self.tres
+        Z00, Z10, Z11 = self.AZ
+        return qml.eGAF_tswitch(self.tres, self.eigvals, Z00, Z10, Z11,
+            self.Aroots, self.AR, self.QAF, self.expQFF, self.switch_tol)[0]
+
+    @_cached
+    def Ftswitch(self):
+        """Start of asymptotic regime of shut time eGFA(t)."""
+        if self.switch_tol is None:
+            return 3 * self.tres
+        Z00, Z10, Z11 = self.FZ
+        return qml.eGAF_tswitch(self.tres, self.eigvals, Z00, Z10, Z11,
+            self.Froots, self.FR, self.QFA, self.expQAA, self.switch_tol)[0]
+
+    def count_paths(self, t, open=True):
+        """
+        Add the intervals t to counts of exact and asymptotic evaluations
+        (attribute paths).
+        """
+        tswitch = self.Atswitch if open else self.Ftswitch
+        nasympt = np.count_nonzero(np.asarray(t) >= tswitch)
+        self.paths['asymptotic'] += nasympt
+        self.paths['exact'] += np.size(t) - nasympt
+
+    def eGAF_times(self, t, open=True):
+        """
+        eGAF(t) (open) or eGFA(t) (shut) for an array of times, see
+        qmatlib.eGAF_times. Evaluations are counted in attribute paths.
+        """
+        self.count_paths(t, open)
+        if open:
+            Z00, Z10, Z11 = self.AZ
+            return qml.eGAF_times(t, self.tres, self.eigvals, Z00, Z10, Z11,
+                self.Aroots, self.AR, self.QAF, self.expQFF, self.Atswitch)
+        Z00, Z10, Z11 = self.FZ
+        return qml.eGAF_times(t, self.tres, self.eigvals, Z00, Z10, Z11,
+            self.Froots, self.FR, self.QFA, self.expQAA, self.Ftswitch)
+
+    @_cached
+    def Agamma(self):
+        """gamma00, gamma10, gamma11 for the exact open time pdf."""
+        u = np.ones((self.kF, 1))
+        return tuple(np.dot(np.dot(self.phiA, Z), u).T[0] for Z in self.AZ)
+
+    @_cached
+    def Fgamma(self):
+        """gamma00, gamma10, gamma11 for the exact shut time pdf."""
+        u = np.ones((self.kA, 1))
+        return tuple(np.dot(np.dot(self.phiF, Z), u).T[0] for Z in self.FZ)
+
+    @_cached
+    def DARS(self):
+        return qml.dARSdS(self.tres, self.QAA, self.QFF, self.GAF, self.GFA,
+            self.expQFF, self.kA, self.kF)
+
+    @_cached
+    def DFRS(self):
+        return qml.dARSdS(self.tres, self.QFF, self.QAA, self.GFA, self.GAF,
+            self.expQAA, self.kF, self.kA)
+
+    @_cached
+    def meanA(self):
+        """Apparent mean open time."""
+        # meanOpenTime = tres + phiA * DARS * QexpQF * uF
+        return self.tres + np.dot(self.phiA, np.dot(np.dot(self.DARS,
+            np.dot(self.QAF, self.expQFF)), np.ones((self.kF, 1))))[0]
+
+    @_cached
+    def meanF(self):
+        """Apparent mean shut time."""
+        return self.tres + np.dot(self.phiF, np.dot(np.dot(self.DFRS,
+            np.dot(self.QFA, self.expQAA)), np.ones((self.kA, 1))))[0]
+
+def tres_sweep(mec, tres, conc=None, eff='c', root_method='brentq'):
+    """
+    Calculate apparent (HJC) open and shut time distributions, mean open and
+    shut times and Popen for a series of time resolutions. Q, its
+    eigendecomposition, GAF, GFA and the decompositions of QAA and QFF are
+    calculated once (see HJCContext.with_tres) and the asymptotic roots
+    found for one resolution bracket those for the next (see RootTracker),
+    so tres values are best given in ascending or descending order.
 
-    return eigen, gama00, gama10, gama11
+    Parameters
+    ----------
+    mec : dcpyps.Mechanism
+        The mechanism to be analysed.
+    tres : array_like, shape (n,)
+        Time resolutions (dead times).
+    conc : float, optional
+        Concentration. If not given, the current rates of mec are used;
+        it is required if mec.fastblock is set, since Popen is then
+        corrected for fast block at conc (see popen.Popen).
+    eff : str
+        Effector (see popen.Popen).
+    root_method : {'brentq', 'newton'}
+        See asymptotic_roots.
+
+    Returns
+    -------
+    Ataus, Aareas : ndarrays, shape (n, kA)
+        Time constants and areas of asymptotic open time pdf.
+    Ftaus, Fareas : ndarrays, shape (n, kF)
+        Time constants and areas of asymptotic shut time pdf.
+    meanA, meanF : ndarrays, shape (n,)
+        Apparent mean open and shut times.
+    popen : ndarray, shape (n,)
+        Open probability corrected for missed events.
+    """
+
+    if conc is not None:
+        mec.set_eff(eff, conc)
+    elif mec.fastblock:
+        raise ValueError('tres_sweep: conc is needed for fast block ' +
+            'correction of Popen')
+    tres = np.asarray(tres, dtype=float).ravel()
+    n = tres.shape[0]
+    ctx = HJCContext(mec.Q, mec.kA, tres[0], root_method, kF=mec.kF)
+    Ataus, Aareas = np.empty((n, ctx.kA)), np.empty((n, ctx.kA))
+    Ftaus, Fareas = np.empty((n, ctx.kF)), np.empty((n, ctx.kF))
+    meanA, meanF = np.empty(n), np.empty(n)
+
+    ctx.Atracker, ctx.Ftracker = RootTracker(), RootTracker()
+    for i in range(n):
+        if i > 0:
+            ctx = ctx.with_tres(tres[i])
+        Ataus[i], Aareas[i] = -1 / ctx.Aroots, ctx.Aareas
+        Ftaus[i], Fareas[i] = -1 / ctx.Froots, ctx.Fareas
+        meanA[i], meanF[i] = ctx.meanA, ctx.meanF
+
+    popen = meanA / (meanA + meanF)
+    if mec.fastblock:
+        popen = popen / (1 + conc / mec.fastKB)
+    return Ataus, Aareas, Ftaus, Fareas, meanA, meanF, popen
 
 def likelihood(theta, opts):
     """
     Calculate likelihood for a series of open and shut times using ideal
-    probability density functions.
-    """
-
+    probability density functions. With opts['sparse'] True submatrices of
+    Q are treated as sparse and intervals are propagated by Krylov methods.
+    opts['data'] is a dictionary of lists of intervals or Bursts (see
+    HJClik on how a dictionary is converted); bursts with their own
+    concentration are evaluated group by group. Ideal likelihood has no
+    resolution or CHS vectors, so Bursts with per-burst tres or CHS flags
+    raise ValueError.
+    """
+
+    bursts = _opts_bursts(opts)
+    if bursts.tres is not None or bursts.chs is not None:
+        raise ValueError('likelihood: per-burst tres and CHS flags ' +
+            'are used only by HJClik')
+    if bursts.has_metadata:
+        return _grouped_lik(likelihood, theta, opts, bursts)
     mec = opts['mec']
     conc = opts['conc']
-    bursts = opts['data']
 
     #mec.set_rateconstants(np.exp(theta))
     mec.theta_unsqueeze(np.exp(theta))
@@ -650,17 +1241,27 @@ def likelihood(theta, opts):
 
     startB = qml.phiA(mec)
     endB = np.ones((mec.kF, 1))
+    if opts.get('sparse', False):
+        return (_likelihood_sparse(mec, bursts, startB, endB),
+            np.log(mec.theta()))
+
+    # All open (shut) times share one decomposition of QAA (QFF).
+    isopen = bursts.isopen
+    GAFts = qml.iGt(bursts.intervals[isopen], mec.QAA, mec.QAF)
+    GFAts = qml.iGt(bursts.intervals[~isopen], mec.QFF, mec.QFA)
 
     loglik = 0
+    iopen, ishut = 0, 0
     for ind in bursts:
         burst = bursts[ind]
         grouplik = startB
         for i in range(len(burst)):
-            t = burst[i]
             if i % 2 == 0: # open time
-                GAFt = qml.iGt(t, mec.QAA, mec.QAF)
+                GAFt = GAFts[iopen]
+                iopen += 1
             else: # shut
-                GAFt = qml.iGt(t, mec.QFF, mec.QFA)
+                GAFt = GFAts[ishut]
+                ishut += 1
             grouplik = np.dot(grouplik, GAFt)
             if grouplik.max() > 1e50:
                 grouplik = grouplik * 1e-100
@@ -671,6 +1272,84 @@ def likelihood(theta, opts):
     newrates = np.log(mec.theta())
     return -loglik, newrates
 
+def _opts_bursts(opts):
+    """
+    Bursts of opts['data']. A dictionary is converted once and kept with
+    it in opts['_bursts']; opts['data'] itself is not changed. The kept
+    Bursts is reused while opts['data'] is the same object, so the
+    dictionary must not be changed in place afterwards: assign new data
+    or delete opts['_bursts'] to have it converted again.
+    """
+
+    data = opts['data']
+    if isinstance(data, Bursts):
+        return data
+    kept = opts.get('_bursts')
+    if kept is None or kept[0] is not data:
+        kept = data, Bursts.from_dict(data)
+        opts['_bursts'] = kept
+    return kept[1]
+
+def _grouped_lik(func, theta, opts, bursts):
+    """
+    Sum of likelihoods func(theta, opts) of groups of bursts differing in
+    per-burst concentration, resolution or CHS flag (see Bursts.groups).
+    The mechanism is left at opts['conc'], as after an ungrouped call. As
+    in HJClik, if the likelihood of any group cannot be calculated (func
+    returns 0) the total is set to 0. Bursts with no bursts give 0 as an
+    ungrouped call does.
+    """
+
+    mec = opts['mec']
+    mec.theta_unsqueeze(np.exp(theta))
+    newrates = np.log(mec.theta())
+    loglik = 0
+    for values, sub in bursts.groups():
+        gopts = dict(opts)
+        gopts.update(values)
+        gopts['data'] = sub
+        lik, newrates = func(theta, gopts)
+        if lik == 0:
+            loglik = 0
+            break
+        loglik += lik
+    if 'conc' in opts:
+        mec.set_eff('c', opts['conc'])
+    return loglik, newrates
+
+def _likelihood_sparse(mec, bursts, startB, endB):
+    """
+    Log likelihood of ideal intervals for sparse submatrices: the row vector
+    is propagated through each interval (qmatlib.propagate) instead of
+    forming exp(QAA * t) * QAF. A sparse mec.Q is used as it is; a dense
+    one is converted once per call. Submatrices are sliced and transposed
+    for propagation once, not per interval; shut states F are the same
+    kA:kA+kF block as mec.QFF.
+    """
+
+    Q = mec.Q if scsp.issparse(mec.Q) else scsp.csr_matrix(mec.Q)
+    Q = Q.tocsr()
+    kA, kG = mec.kA, mec.kA + mec.kF
+    QAAT = Q[:kA, :kA].T.tocsr()
+    QFFT = Q[kA:kG, kA:kG].T.tocsr()
+    QAF, QFA = Q[:kA, kA:kG], Q[kA:kG, :kA]
+    loglik = 0
+    for ind in bursts:
+        burst = bursts[ind]
+        grouplik = np.ravel(startB)
+        for i in range(len(burst)):
+            if i % 2 == 0: # open time
+                grouplik = qml.vecmat(qml.propagate(grouplik, QAAT, burst[i],
+                    transposed=True), QAF)
+            else: # shut
+                grouplik = qml.vecmat(qml.propagate(grouplik, QFFT, burst[i],
+                    transposed=True), QFA)
+            if grouplik.max() > 1e50:
+                grouplik = grouplik * 1e-100
+                print ('grouplik was scaled down')
+        loglik += log(np.dot(grouplik, endB)[0])
+    return -loglik
+
 def HJClik(theta, opts):
     """
     Calculate likelihood for a series of open and shut times using HJC missed
@@ -679,6 +1358,9 @@ def HJClik(theta, opts):
 
     Lik = phi * eGAF(t1) * eGFA(t2) * eGAF(t3) * ... * eGAF(tn) * uF
     where t1, t3,..., tn are open times; t2, t4,..., t(n-1) are shut times.
+    Shut states (F) are those of mec.QFF; kD states are left out, as in
+    likelihood and popen.Popen. Blocks of Q and their sizes are taken from
+    one HJCContext.
 
     Gaps > tcrit are treated as unusable (e.g. contain double or bad bit of
     record, or desens gaps that are not in the model, or gaps so long that
@@ -693,9 +1375,16 @@ def HJClik(theta, opts):
     ----------
     theta : array_like
         Guesses.
-    bursts : dictionary
-        A dictionary containing lists of open and shut intervals.
     opts : dictionary
+        opts['data'] : dictionary or Bursts
+            A dictionary containing lists of open and shut intervals or
+            Bursts. A dictionary is converted to Bursts on the first call
+            and kept in opts['_bursts'], so that distinct times
+            (opts['dedup']) are found once per fit. The dictionary must
+            not be changed in place afterwards; to change the data assign
+            a new dictionary (or Bursts) or delete opts['_bursts'].
+            Bursts with their own concentration, resolution or CHS
+            flag are evaluated group by group.
         opts['mec'] : instance of type Mechanism
         opts['tres'] : float
             Time resolution (dead time).
@@ -703,6 +1392,34 @@ def HJClik(theta, opts):
             Ctritical time interval.
         opts['isCHS'] : bool
             True if CHS vectors should be used (Eq. 5.7, CHS96).
+        opts['root_method'] : {'brentq', 'newton'}, optional
+            Solver for asymptotic roots (see asymptotic_roots).
+        opts['Atracker'], opts['Ftracker'] : RootTracker, optional
+            Warm start of open and shut time asymptotic roots from the
+            previous call.
+        opts['switch_tol'] : float, optional
+            Tolerance for moving the switch between exact and asymptotic
+            eGAF(t) below 3 * tres (see HJCContext).
+        opts['paths'] : dict, optional
+            If given, counts of intervals evaluated by exact and asymptotic
+            eGAF(t) are added to its 'exact' and 'asymptotic' entries.
+        opts['batch'] : bool, optional
+            If True, eGAF is evaluated for all open and all shut times in two
+            calls and all bursts are multiplied out together (see
+            _HJClik_batch).
+        opts['dedup'] : bool, optional
+            With opts['batch'], evaluate eGAF once per distinct open or shut
+            time (see Bursts.unique and Bursts.compression_ratio).
+        opts['quantum'] : float, optional
+            With opts['batch'], round intervals to multiples of quantum
+            before finding distinct times (implies opts['dedup']); no
+            interval is rounded below tres.
+        opts['compression'] : dict, optional
+            If given, with opts['dedup'] or opts['quantum'] the numbers of
+            intervals and of distinct times for which eGAF(t) was evaluated
+            are added to its 'intervals' and 'distinct' entries; their
+            ratio is the compression ratio achieved (see
+            Bursts.compression_ratio).
 
     Returns
     -------
@@ -713,60 +1430,76 @@ def HJClik(theta, opts):
     """
     # TODO: Errors.
 
+    bursts = _opts_bursts(opts)
+    if bursts.has_metadata:
+        return _grouped_lik(HJClik, theta, opts, bursts)
     mec = opts['mec']
     conc = opts['conc']
     tres = opts['tres']
     tcrit = opts['tcrit']
     is_chsvec = opts['isCHS']
-    bursts = opts['data']
+    root_method = opts.get('root_method', 'brentq')
 
     mec.theta_unsqueeze(np.exp(theta))
     mec.set_eff('c', conc)
 
-    GAF, GFA = qml.iGs(mec.Q, mec.kA, mec.kF)
-    expQFF = qml.expQt(mec.QFF, tres)
-    expQAA = qml.expQt(mec.QAA, tres)
-    eGAF = qml.eGs(GAF, GFA, mec.kA, mec.kF, expQFF)
-    eGFA = qml.eGs(GFA, GAF, mec.kF, mec.kA, expQAA)
-    phiF = qml.phiHJC(eGFA, eGAF, mec.kF)
-    startB = qml.phiHJC(eGAF, eGFA, mec.kA)
-    endB = np.ones((mec.kF, 1))
+    ctx = HJCContext(mec.Q, mec.kA, tres, root_method,
+        opts.get('switch_tol'), kF=mec.kF)
+    ctx.Atracker, ctx.Ftracker = opts.get('Atracker'), opts.get('Ftracker')
+    expQFF, expQAA = ctx.expQFF, ctx.expQAA
+    phiF = ctx.phiF
+    startB = ctx.phiA
+    endB = np.ones((ctx.kF, 1))
 
-    eigen, A = qml.eigs(-mec.Q)
-    Aeigvals, AZ00, AZ10, AZ11 = qml.Zxx(mec.Q, eigen, A, mec.kA, mec.QFF,
-        mec.QAF, mec.QFA, expQFF, True)
-    Aroots = asymptotic_roots(tres,
-        mec.QAA, mec.QFF, mec.QAF, mec.QFA, mec.kA, mec.kF)
-    AR = qml.AR(Aroots, tres, mec.QAA, mec.QFF, mec.QAF, mec.QFA, mec.kA, mec.kF)
-    Feigvals, FZ00, FZ10, FZ11 = qml.Zxx(mec.Q, eigen, A, mec.kA, mec.QAA,
-        mec.QFA, mec.QAF, expQAA, False)
-    Froots = asymptotic_roots(tres,
-        mec.QFF, mec.QAA, mec.QFA, mec.QAF, mec.kF, mec.kA)
-    FR = qml.AR(Froots, tres, mec.QFF, mec.QAA, mec.QFA, mec.QAF, mec.kF, mec.kA)
+    (AZ00, AZ10, AZ11), (FZ00, FZ10, FZ11) = ctx.AZ, ctx.FZ
+    Aeigvals = Feigvals = ctx.eigvals
+    Aroots, AR = ctx.Aroots, ctx.AR
+    Froots, FR = ctx.Froots, ctx.FR
+    Atswitch, Ftswitch = ctx.Atswitch, ctx.Ftswitch
 
     if is_chsvec:
         startB, endB = qml.CHSvec(Froots, tres, tcrit,
-            mec.QFA, mec.kA, expQAA, phiF, FR)
-
+            ctx.QFA, ctx.kA, expQAA, phiF, FR)
+
+    if opts.get('batch', False):
+        quantum = opts.get('quantum')
+        dedup = opts.get('dedup', False) or bool(quantum)
+        loglik = _HJClik_batch(ctx, bursts, startB, endB, dedup, quantum)
+        if dedup and 'compression' in opts:
+            topen, tshut, index = bursts.unique(quantum, tres)
+            opts['compression']['intervals'] += index.shape[0]
+            opts['compression']['distinct'] += (topen.shape[0] +
+                tshut.shape[0])
+        if 'paths' in opts:
+            for key in ctx.paths:
+                opts['paths'][key] += ctx.paths[key]
+        return -loglik, np.log(mec.theta())
+
+    if 'paths' in opts:
+        isopen = bursts.isopen
+        ctx.count_paths(bursts.intervals[isopen], True)
+        ctx.count_paths(bursts.intervals[~isopen], False)
     loglik = 0
     for ind in range(len(bursts)):
         burst = bursts[ind]
         grouplik = startB
+        # Log of the factors removed by rescaling, as in _HJClik_batch.
+        logscale = 0
         for i in range(len(burst)):
             t = burst[i]
             if i % 2 == 0: # open time
                 eGAFt = qml.eGAF(t, tres, Aeigvals, AZ00, AZ10, AZ11, Aroots,
-                AR, mec.QAF, expQFF)
+                AR, ctx.QAF, expQFF, Atswitch)
             else: # shut
                 eGAFt = qml.eGAF(t, tres, Feigvals, FZ00, FZ10, FZ11, Froots,
-                FR, mec.QFA, expQAA)
+                FR, ctx.QFA, expQAA, Ftswitch)
             grouplik = np.dot(grouplik, eGAFt)
             if grouplik.max() > 1e50:
                 grouplik = grouplik * 1e-100
-                #print 'grouplik was scaled down'
+                logscale += 100 * log(10)
         grouplik = np.dot(grouplik, endB)
         try:
-            loglik += log(grouplik[0])
+            loglik += log(grouplik[0]) + logscale
         except:
             print ('HJClik: Warning: likelihood has been set to 0')
             print ('likelihood=', grouplik[0])
@@ -774,9 +1507,53 @@ def HJClik(theta, opts):
             loglik = 0
             break
 
+    if 'paths' in opts:
+        for key in ctx.paths:
+            opts['paths'][key] += ctx.paths[key]
     newrates = np.log(mec.theta())
     return -loglik, newrates
 
+def _HJClik_batch(ctx, bursts, startB, endB, dedup=False, quantum=None):
+    """
+    Log likelihood of bursts of HJC intervals (see HJClik). eGAF(t) for all
+    open times and eGFA(t) for all shut times are calculated in two calls
+    (HJCContext.eGAF_times); with dedup only for distinct (after rounding
+    to quantum) times, see Bursts.unique. Bursts are grouped by length;
+    within a group each burst is a chain of (kA, kA) products
+    eGAF(open) * eGFA(shut), multiplied out for the whole group by
+    qmatlib.chain_product with per-node scaling, then ended by the last
+    opening. Every burst must therefore start and end with an opening.
+    """
+
+    offsets, lengths = bursts.offsets, bursts.lengths
+    if np.any(lengths % 2 == 0):
+        raise ValueError('HJClik: each burst must contain an odd number ' +
+            'of intervals (start and end with an opening)')
+    # rank: index of each interval in its eGAF (eGFA) stack.
+    if dedup:
+        topen, tshut, rank = bursts.unique(quantum, ctx.tres)
+    else:
+        t, isopen = bursts.intervals, bursts.isopen
+        topen, tshut = t[isopen], t[~isopen]
+        rank = np.where(isopen, np.cumsum(isopen), np.cumsum(~isopen)) - 1
+    EA = ctx.eGAF_times(topen, True)
+    EF = ctx.eGAF_times(tshut, False)
+
+    phi, u = np.ravel(startB), np.ravel(endB)
+    loglik = 0
+    for L in np.unique(lengths):
+        ind = offsets[:-1][lengths == L][:, np.newaxis] + np.arange(L)
+        pairs = np.matmul(EA[rank[ind[:, 0:L-1:2]]], EF[rank[ind[:, 1:L:2]]])
+        P, logscale = qml.chain_product(pairs)
+        lik = np.einsum('a,nab,nbc,c->n', phi, P, EA[rank[ind[:, -1]]], u)
+        # Imaginary part, if any, is rounding from complex eigenvalues.
+        lik = np.real(lik)
+        if not np.all(lik > 0):
+            print ('HJClik: Warning: likelihood has been set to 0')
+            return 0
+        loglik += np.sum(np.log(lik) + logscale)
+    return loglik
+
 def corr_variance_A(phiA, QAA, kA):
     """
     Calculate variance of open (shut) time according Eq. 2.6 (CH87).
@@ -800,10 +1577,11 @@ def corr_variance_A(phiA, QAA, kA):
 
     uA = np.ones((kA))[:,np.newaxis]
     I = np.eye(kA)
-    invQAA = -nplin.inv(QAA)
+    fQAA = qml.factorize(QAA)
     M = 2 * I - np.dot(uA, phiA)
-    row = np.dot(phiA, invQAA)
-    col = np.dot(invQAA, uA)
+    # row = phiA * inv(-QAA), col = inv(-QAA) * uA
+    row = -fQAA.rsolve(phiA)
+    col = -fQAA.solve(uA)
     var = np.dot(np.dot(row, M), col)[0,0]
     return var
 
@@ -815,8 +1593,8 @@ def corr_covariance_A(lag, phiA, QAA, XAA, kA):
 
     Parameters
     ----------
-    lag : int
-        Lag.
+    lag : int or array_like of ints, shape (n,)
+        Lag(s). All lags are calculated from one decomposition of XAA.
     phiA : array_like, shape (1, kA)
         Initial vector for openings (shuttings).
     QAA : array_like, shape (kA, kA)
@@ -828,17 +1606,17 @@ def corr_covariance_A(lag, phiA, QAA, XAA, kA):
 
     Returns
     -------
-    covar : float
+    covar : float or ndarray, shape (n,)
         Covariance.
     """
     
-    Xn = qml.Qpow(XAA, lag)
     uA = np.ones((kA))[:,np.newaxis]
-    invQAA = -nplin.inv(QAA)
-    M2 = Xn - np.dot(uA, phiA)
-    row = np.dot(phiA, invQAA)
-    col = np.dot(invQAA, uA)
-    covar = np.dot(np.dot(row, M2), col)[0,0]
+    fQAA = qml.factorize(QAA)
+    row = -fQAA.rsolve(phiA)
+    col = -fQAA.solve(uA)
+    # row * (XAA^lag - uA * phiA) * col
+    covar = (qml.Qpow_products(XAA, lag, row, col) -
+        np.dot(row, uA)[0,0] * np.dot(phiA, col)[0,0])
     return covar
 
 def corr_covariance_AF(lag, phiA, QAA, QFF, XAA, GAF, kA, kF):
@@ -847,8 +1625,8 @@ def corr_covariance_AF(lag, phiA, QAA, QFF, XAA, GAF, kA, kF):
     
     Parameters
     ----------
-    lag : int
-        Lag.
+    lag : int or array_like of ints, shape (n,)
+        Lag(s).
     phiA : array_like, shape (1, kA)
         Initial vector for openings.
     QAA : array_like, shape (kA, kA)
@@ -866,17 +1644,17 @@ def corr_covariance_AF(lag, phiA, QAA, QFF, XAA, GAF, kA, kF):
 
     Returns
     -------
-    covar : float
+    covar : float or ndarray, shape (n,)
         Covariance.
     """
 
-    Xn = qml.Qpow(XAA, lag-1)
     uA, uF = np.ones((kA))[:,np.newaxis], np.ones((kF))[:,np.newaxis]
-    invQAA, invQFF = -nplin.inv(QAA), -nplin.inv(QFF)
-    MAF = Xn - np.dot(uA, phiA)
-    row = np.dot(phiA, invQAA)
-    col = np.dot(np.dot(GAF, invQFF),uF)
-    covar = np.dot(np.dot(row, MAF), col)[0,0]
+    fQAA, fQFF = qml.factorize(QAA), qml.factorize(QFF)
+    row = -fQAA.rsolve(phiA)
+    col = -np.dot(GAF, fQFF.solve(uF))
+    # row * (XAA^(lag-1) - uA * phiA) * col
+    covar = (qml.Qpow_products(XAA, np.asarray(lag) - 1, row, col) -
+        np.dot(row, uA)[0,0] * np.dot(phiA, col)[0,0])
     return covar
 
 def corr_decay_amplitude_A(phiA, QAA, XAA, kA):
@@ -897,9 +1675,9 @@ def corr_decay_amplitude_A(phiA, QAA, XAA, kA):
     eigs, A = qml.eigs(XAA)
 
     uA = np.ones((kA))[:,np.newaxis]
-    invQAA = -nplin.inv(QAA)
-    row = np.dot(phiA, invQAA)
-    col = np.dot(invQAA, uA)
+    fQAA = qml.factorize(QAA)
+    row = -fQAA.rsolve(phiA)
+    col = -fQAA.solve(uA)
 
     ncA = np.rank(XAA) - 1
     w = np.zeros((ncA))
@@ -913,9 +1691,9 @@ def corr_decay_amplitude_A(phiA, QAA, XAA, kA):
 def corr_limit_A(phiA, QAA, AXAA, eigXAA, kA):
 
     uA = np.ones((kA))[:,np.newaxis]
-    invQAA = -nplin.inv(QAA)
-    row = np.dot(phiA, invQAA)
-    col = np.dot(invQAA, uA)
+    fQAA = qml.factorize(QAA)
+    row = -fQAA.rsolve(phiA)
+    col = -fQAA.solve(uA)
     M = np.zeros((kA, kA))
     for i in range(kA - 1):
         M += AXAA[i,:,:] * eigXAA[i] / (1 - eigXAA[i])
@@ -944,15 +1722,17 @@ def adjacent_open_to_shut_range_mean(u1, u2, QAA, QAF, QFF, QFA, phiA):
     
     kA = QAA.shape[0]
     uA = np.ones((kA))[:,np.newaxis]
-    invQAA, invQFF = -nplin.inv(QAA), nplin.inv(QFF)
+    fQAA, fQFF = qml.factorize(QAA), qml.factorize(QFF)
     expQFFr = qml.expQt(QFF, u2) - qml.expQt(QFF, u1)
-    col = np.dot(np.dot(np.dot(np.dot(QAF, invQFF), expQFFr), QFA), uA)
-    row1 = np.dot(phiA, qml.Qpow(invQAA, 2))
-    row2 = np.dot(phiA, invQAA)
+    # col = QAF * inv(QFF) * expQFFr * QFA * uA
+    col = np.dot(QAF, fQFF.solve(np.dot(expQFFr, np.dot(QFA, uA))))
+    # row1 = phiA * inv(-QAA)^2, row2 = phiA * inv(-QAA)
+    row2 = -fQAA.rsolve(phiA)
+    row1 = -fQAA.rsolve(row2)
     m = np.dot(row1, col)[0, 0] / np.dot(row2, col)[0, 0]
     return m
 
-def HJC_dependency(top, tsh, tres, Q, QAA, QAF, QFF, QFA):
+def HJC_dependency(top, tsh, tres, Q, QAA, QAF, QFF, QFA, ctx=None):
     """
     Calculate normalised joint distribution (CHS96, Eq. 3.22) of an open time
     and the following shut time as proposed by Magleby & Song 1992. 
@@ -967,6 +1747,8 @@ def HJC_dependency(top, tsh, tres, Q, QAA, QAF, QFF, QFA):
         Q matrix. 
     QAA, QAF, QFF, QFA : array_like
         Submatrices of Q.
+    ctx : HJCContext, optional
+        Context of Q and tres to take intermediates from.
 
     Returns
     -------
@@ -974,39 +1756,28 @@ def HJC_dependency(top, tsh, tres, Q, QAA, QAF, QFF, QFA):
     """
     
     kA, kF = QAA.shape[0], QFF.shape[0]
+    if ctx is None:
+        ctx = HJCContext(Q, kA, tres)
     uA = np.ones((kA))[:,np.newaxis]
     uF = np.ones((kF))[:,np.newaxis]
-    expQFF = qml.expQt(QFF, tres)
-    expQAA = qml.expQt(QAA, tres)
-    GAF, GFA = qml.iGs(Q, kA, kF)
-    eGAF = qml.eGs(GAF, GFA, kA, kF, expQFF)
-    eGFA = qml.eGs(GFA, GAF, kF, kA, expQAA)
-    phiA = qml.phiHJC(eGAF, eGFA, kA)
-    phiF = qml.phiHJC(eGFA, eGAF, kF)
-    eigs, A = qml.eigs(-Q)
-    Feigvals, FZ00, FZ10, FZ11 = qml.Zxx(Q, eigs, A, kA, QAA, QFA, QAF, expQAA, False)
-    Froots = asymptotic_roots(tres, QFF, QAA, QFA, QAF, kF, kA)
-    FR = qml.AR(Froots, tres, QFF, QAA, QFA, QAF, kF, kA)
-    Aeigvals, AZ00, AZ10, AZ11 = qml.Zxx(Q, eigs, A, kA, QFF, QAF, QFA, expQFF, True)
-    Aroots = asymptotic_roots(tres, QAA, QFF, QAF, QFA, kA, kF)
-    AR = qml.AR(Aroots, tres, QAA, QFF, QAF, QFA, kA, kF)
-
-    dependency = np.zeros((top.shape[0], tsh.shape[0]))
-    
-    for i in range(top.shape[0]):
-        eGAFt = qml.eGAF(top[i], tres, Aeigvals, AZ00, AZ10, AZ11, Aroots,
-                AR, QAF, expQFF)
-        fo = np.dot(np.dot(phiA, eGAFt), uF)[0]
-        
-        for j in range(tsh.shape[0]):
-            eGFAt = qml.eGAF(tsh[j], tres, Feigvals, FZ00, FZ10, FZ11, Froots,
-                FR, QFA, expQAA)
-            fs = np.dot(np.dot(phiF, eGFAt), uA)[0]
-            fos = np.dot(np.dot(np.dot(phiA, eGAFt), eGFAt), uA)[0]
-            dependency[i, j] = (fos - (fo * fs)) / (fo * fs)
+    (AZ00, AZ10, AZ11), (FZ00, FZ10, FZ11) = ctx.AZ, ctx.FZ
+
+    eGAFt = qml.eGAF_times(top, tres, ctx.eigvals, AZ00, AZ10, AZ11,
+        ctx.Aroots, ctx.AR, QAF, ctx.expQFF)
+    eGFAt = qml.eGAF_times(tsh, tres, ctx.eigvals, FZ00, FZ10, FZ11,
+        ctx.Froots, ctx.FR, QFA, ctx.expQAA)
+    phiF = ctx.phiF
+    # fos[i, j] = phiA * eGAF(top[i]) * eGFA(tsh[j]) * uA
+    rowA = np.dot(np.ravel(ctx.phiA), eGAFt)
+    colF = np.dot(eGFAt, uA)[:, :, 0]
+    fo = np.dot(rowA, uF)[:, 0]
+    fs = np.dot(np.dot(np.ravel(phiF), eGFAt), uA)[:, 0]
+    fos = np.dot(rowA, colF.T)
+    dependency = (fos - np.outer(fo, fs)) / np.outer(fo, fs)
     return dependency
 
-def HJC_adjacent_mean_open_to_shut_time_pdf(sht, tres, Q, QAA, QAF, QFF, QFA):
+def HJC_adjacent_mean_open_to_shut_time_pdf(sht, tres, Q, QAA, QAF, QFF, QFA,
+    ctx=None):
     """
     Calculate theoretical HJC (with missed events correction) mean open time
     given previous/next gap length (continuous function; CHS96 Eq.3.5). 
@@ -1021,6 +1792,8 @@ def HJC_adjacent_mean_open_to_shut_time_pdf(sht, tres, Q, QAA, QAF, QFF, QFA):
         Q matrix.
     QAA, QAF, QFF, QFA : array_like
         Submatrices of Q.
+    ctx : HJCContext, optional
+        Context of Q and tres to take intermediates from.
 
     Returns
     -------
@@ -1031,36 +1804,23 @@ def HJC_adjacent_mean_open_to_shut_time_pdf(sht, tres, Q, QAA, QAF, QFF, QFA):
     """
     
     kA, kF = QAA.shape[0], QFF.shape[0]
+    if ctx is None:
+        ctx = HJCContext(Q, kA, tres)
     uA = np.ones((kA))[:,np.newaxis]
     uF = np.ones((kF))[:,np.newaxis]
-    expQFF = qml.expQt(QFF, tres)
-    expQAA = qml.expQt(QAA, tres)
-    GAF, GFA = qml.iGs(Q, kA, kF)
-    eGAF = qml.eGs(GAF, GFA, kA, kF, expQFF)
-    eGFA = qml.eGs(GFA, GAF, kF, kA, expQAA)
-    phiA = qml.phiHJC(eGAF, eGFA, kA)
-    phiF = qml.phiHJC(eGFA, eGAF, kF)
-    DARS = qml.dARSdS(tres, QAA, QFF, GAF, GFA, expQFF, kA, kF)
-    eigs, A = qml.eigs(-Q)
-    Feigvals, FZ00, FZ10, FZ11 = qml.Zxx(Q, eigs, A, kA, QAA, QFA, QAF, expQAA, False)
-    Froots = asymptotic_roots(tres, QFF, QAA, QFA, QAF, kF, kA)
-    FR = qml.AR(Froots, tres, QFF, QAA, QFA, QAF, kF, kA)
-    Q1 = np.dot(np.dot(DARS, QAF), expQFF)
+    phiF = ctx.phiF
+    FZ00, FZ10, FZ11 = ctx.FZ
+    Q1 = np.dot(np.dot(ctx.DARS, QAF), ctx.expQFF)
     col1 = np.dot(Q1, uF)
-    row1 = np.dot(phiA, Q1)
+    row1 = np.dot(ctx.phiA, Q1)
     
-    mp = []
-    mn = []
-    for t in sht:
-        eGFAt = qml.eGAF(t, tres, Feigvals, FZ00, FZ10, FZ11, Froots,
-                    FR, QFA, expQAA)
-        denom = np.dot(np.dot(phiF, eGFAt), uA)[0]
-        nom1 = np.dot(np.dot(phiF, eGFAt), col1)[0]
-        nom2 = np.dot(np.dot(row1, eGFAt), uA)[0]
-        mp.append(nom1 / denom)
-        mn.append(nom2 / denom)
+    eGFAt = qml.eGAF_times(sht, tres, ctx.eigvals, FZ00, FZ10, FZ11,
+        ctx.Froots, ctx.FR, QFA, ctx.expQAA)
+    denom = np.dot(np.dot(np.ravel(phiF), eGFAt), uA)[:, 0]
+    mp = np.dot(np.dot(np.ravel(phiF), eGFAt), col1)[:, 0] / denom
+    mn = np.dot(np.dot(np.ravel(row1), eGFAt), uA)[:, 0] / denom
     
-    return np.array(mp), np.array(mn)
+    return mp, mn
 
 def adjacent_open_to_shut_range_pdf_components(u1, u2, QAA, QAF, QFF, QFA, phiA):
     """
@@ -1087,12 +1847,12 @@ def adjacent_open_to_shut_range_pdf_components(u1, u2, QAA, QAF, QFF, QFA, phiA)
 
     kA = QAA.shape[0]
     uA = np.ones((kA))[:,np.newaxis]
-    invQAA, invQFF = -nplin.inv(QAA), nplin.inv(QFF)
+    fQAA, fQFF = qml.factorize(QAA), qml.factorize(QFF)
     expQFFr = qml.expQt(QFF, u2) - qml.expQt(QFF, u1)
-    col = np.dot(np.dot(np.dot(np.dot(QAF, invQFF), expQFFr), QFA), uA)
+    col = np.dot(QAF, fQFF.solve(np.dot(expQFFr, np.dot(QFA, uA))))
     w = np.zeros(kA)
     eigs, A = qml.eigs(-QAA)
-    row = np.dot(phiA, invQAA)
+    row = -fQAA.rsolve(phiA)
     den = np.dot(row, col)[0, 0]
     #TODO: remove 'for'
     for i in range(kA):
@@ -1126,7 +1886,7 @@ def next_state(present, picum, tmean, kA, opamp):
     a = opamp if next < kA else 0
     return next, t, a
 
-def printout_occupancies(mec, tres):
+def printout_occupancies(mec, tres, ctx=None):
     """
     """
 
@@ -1168,13 +1928,9 @@ def printout_occupancies(mec, tres):
             '\t{0:.5g}'.format(-1 / mec.Q[i,i] * 1000) +
             '\t{0:.5g}\n'.format(mean * 1000))
 
-    expQFF = qml.expQt(mec.QFF, tres)
-    expQAA = qml.expQt(mec.QAA, tres)
-    GAF, GFA = qml.iGs(mec.Q, mec.kA, mec.kF)
-    eGAF = qml.eGs(GAF, GFA, mec.kA, mec.kF, expQFF)
-    eGFA = qml.eGs(GFA, GAF, mec.kF, mec.kA, expQAA)
-    phiA = qml.phiHJC(eGAF, eGFA, mec.kA)
-    phiF = qml.phiHJC(eGFA, eGAF, mec.kF)
+    if ctx is None:
+        ctx = HJCContext(mec.Q, mec.kA, tres, kF=mec.kF)
+    phiA, phiF = ctx.phiA, ctx.phiF
 
     str += ('\n\nInitial vector for HJC openings phiOp =\n')
     for i in range(phiA.shape[0]):
@@ -1194,13 +1950,14 @@ def printout_occupancies(mec, tres):
     
     return str
 
-def printout_distributions(mec, tres, eff='c'):
+def printout_distributions(mec, tres, eff='c', ctx=None):
     """
 
     """
 
+    if ctx is None:
+        ctx = HJCContext(mec.Q, mec.kA, tres, kF=mec.kF)
     str = '\n*******************************************\n'
-    GAI, GIA = qml.iGs(mec.Q, mec.kA, mec.kI)
     # OPEN TIME DISTRIBUTIONS
     open = True
     # Ideal pdf
@@ -1210,12 +1967,7 @@ def printout_distributions(mec, tres, eff='c'):
     str += pdfs.expPDF_printout(eigs, w)
 
     # Asymptotic pdf
-    #roots = asymptotic_roots(mec, tres, open)
-    roots = asymptotic_roots(tres,
-        mec.QAA, mec.QII, mec.QAI, mec.QIA, mec.kA, mec.kI)
-    #areas = asymptotic_areas(mec, tres, roots, open)
-    areas = asymptotic_areas(tres, roots,
-        mec.QAA, mec.QII, mec.QAI, mec.QIA, mec.kA, mec.kI, GAI, GIA)
+    roots, areas = ctx.Aroots, ctx.Aareas
     str += '\nASYMPTOTIC OPEN TIME DISTRIBUTION\n'
     str += 'term\ttau (ms)\tarea (%)\trate const (1/sec)\n'
     for i in range(mec.kA):
@@ -1232,12 +1984,11 @@ def printout_distributions(mec, tres, eff='c'):
     for i in range(mec.kA):
         str += ('{0:d}'.format(i+1) +
         '\t{0:.5g}\n'.format(areast0[i] * 100))
-    mean = exact_mean_time(tres,
-            mec.QAA, mec.QII, mec.QAI, mec.kA, mec.kI, GAI, GIA)
+    mean = ctx.meanA
     str += ('Mean open time (ms) = {0:.5g}\n'.format(mean * 1000))
 
     # Exact pdf
-    eigvals, gamma00, gamma10, gamma11 = exact_GAMAxx(mec, tres, open)
+    eigvals, gamma00, gamma10, gamma11 = exact_GAMAxx(mec, tres, open, ctx)
     str += ('\nEXACT OPEN TIME DISTRIBUTION\n')
     str += ('eigen\tg00(m)\tg10(m)\tg11(m)\n')
     for i in range(mec.k):
@@ -1255,12 +2006,7 @@ def printout_distributions(mec, tres, eff='c'):
     str += pdfs.expPDF_printout(eigs, w)
 
     # Asymptotic pdf
-    #roots = asymptotic_roots(mec, tres, open)
-    roots = asymptotic_roots(tres,
-        mec.QII, mec.QAA, mec.QIA, mec.QAI, mec.kI, mec.kA)
-    #areas = asymptotic_areas(mec, tres, roots, open)
-    areas = asymptotic_areas(tres, roots,
-        mec.QII, mec.QAA, mec.QIA, mec.QAI, mec.kI, mec.kA, GIA, GAI)
+    roots, areas = ctx.Froots, ctx.Fareas
     str += ('\nASYMPTOTIC SHUT TIME DISTRIBUTION\n')
     str += ('term\ttau (ms)\tarea (%)\trate const (1/sec)\n')
     for i in range(mec.kI):
@@ -1277,12 +2023,11 @@ def printout_distributions(mec, tres, eff='c'):
     for i in range(mec.kI):
         str += ('{0:d}'.format(i+1) +
         '\t{0:.5g}\n'.format(areast0[i] * 100))
-    mean = exact_mean_time(tres,
-            mec.QII, mec.QAA, mec.QIA, mec.kI, mec.kA, GIA, GAI)
+    mean = ctx.meanF
     str += ('Mean shut time (ms) = {0:.6f}\n'.format(mean * 1000))
 
     # Exact pdf
-    eigvals, gamma00, gamma10, gamma11 = exact_GAMAxx(mec, tres, open)
+    eigvals, gamma00, gamma10, gamma11 = exact_GAMAxx(mec, tres, open, ctx)
     str += ('\nEXACT SHUT TIME DISTRIBUTION\n' + 
         'eigen\tg00(m)\tg10(m)\tg11(m)\n')
     for i in range(mec.k):
@@ -1492,11 +2237,10 @@ def printout_correlations(mec, output=sys.stdout, eff='c'):
     SDA_mean_n = SDA / sqrt(float(n))
     str += ('SD of means of {0:d} open times if'.format(n) + 
         'uncorrelated = {0:.5g} ms\n'.format(SDA_mean_n * 1000))
-    covAtot = 0
-    for i in range(1, n):
-        covA = corr_covariance_A(i+1, phiA, mec.QAA, XAA, kA)
-        ro = correlation_coefficient(covA, varA, varA)
-        covAtot += (n - i) * ro * varA
+    lags = np.arange(1, n + 1)
+    roA = correlation_coefficient(
+        corr_covariance_A(lags, phiA, mec.QAA, XAA, kA), varA, varA)
+    covAtot = np.sum((n - lags[:-1]) * roA[1:] * varA)
     vtot = n * varA + 2. * covAtot
     actSDA = sqrt(vtot / (n * n))
     str += ('Actual SD of mean = {0:.5g} ms\n'.format(actSDA * 1000))
@@ -1509,9 +2253,7 @@ def printout_correlations(mec, output=sys.stdout, eff='c'):
         format(pmaxA))
     str += ('Correlation coefficients, r(k), for up to lag k = 5:\n')
     for i in range(5):
-        covA = corr_covariance_A(i+1, phiA, mec.QAA, XAA, kA)
-        ro = correlation_coefficient(covA, varA, varA)
-        str += ('r({0:d}) = {1:.5g}\n'.format(i+1, ro))
+        str += ('r({0:d}) = {1:.5g}\n'.format(i+1, roA[i]))
 
     # shut - shut time correlations
     str += ('\n SHUT - SHUT TIME CORRELATIONS\n')
@@ -1522,11 +2264,9 @@ def printout_correlations(mec, output=sys.stdout, eff='c'):
     SDF_mean_n = SDF / sqrt(float(n))
     str += ('SD of means of {0:d} shut times if'.format(n) +
         'uncorrelated = {0:.5g} ms\n'.format(SDF_mean_n * 1000))
-    covFtot = 0
-    for i in range(1, n):
-        covF = corr_covariance_A(i+1, phiF, mec.QII, XFF, kI)
-        ro = correlation_coefficient(covF, varF, varF)
-        covFtot += (n - i) * ro * varF
+    roF = correlation_coefficient(
+        corr_covariance_A(lags, phiF, mec.QII, XFF, kI), varF, varF)
+    covFtot = np.sum((n - lags[:-1]) * roF[1:] * varF)
     vtotF = 50 * varF + 2. * covFtot
     actSDF = sqrt(vtotF / (50. * 50.))
     str += ('Actual SD of mean = {0:.5g} ms\n'.format(actSDF * 1000))
@@ -1539,17 +2279,15 @@ def printout_correlations(mec, output=sys.stdout, eff='c'):
         format(pmaxF))
     str += ('Correlation coefficients, r(k), for up to k = 5 lags:\n')
     for i in range(5):
-        covF = corr_covariance_A(i+1, phiF, mec.QII, XFF, kI)
-        ro = correlation_coefficient(covF, varF, varF)
-        str += ('r({0:d}) = {1:.5g}\n'.format(i+1, ro))
+        str += ('r({0:d}) = {1:.5g}\n'.format(i+1, roF[i]))
 
     # open - shut time correlations 
     str += ('\n OPEN - SHUT TIME CORRELATIONS\n')
     str += ('Correlation coefficients, r(k), for up to k= 5 lags:\n')
+    roAF = correlation_coefficient(corr_covariance_AF(lags[:5], phiA,
+        mec.QAA, mec.QII, XAA, GAF, kA, kI), varA, varF)
     for i in range(5):
-        covAF = corr_covariance_AF(i+1, phiA, mec.QAA, mec.QII, XAA, GAF, kA, kI)
-        ro = correlation_coefficient(covAF, varA, varF)
-        str += ('r({0:d}) = {1:.5g}\n'.format(i+1, ro))
+        str += ('r({0:d}) = {1:.5g}\n'.format(i+1, roAF[i]))
     return str
         
 def printout_adjacent(mec, t1, t2):
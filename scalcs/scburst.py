@@ -68,15 +68,23 @@ def length_pdf(mec, t):
     ----------
     mec : dcpyps.Mechanism
         The mechanism to be analysed.
+    t : float or array_like, shape (n,)
+        Length.
 
     Returns
     -------
-    f : float
+    f : float or ndarray, shape (n,)
     """
 
-    expQEEA = qml.expQt(mec.QEE, t)[:mec.kA, :mec.kA]
-    f = np.dot(np.dot(np.dot(phiBurst(mec), expQEEA), -mec.QAA),
-        endBurst(mec))
+    if np.isscalar(t):
+        expQEEA = qml.expQt(mec.QEE, t)[:mec.kA, :mec.kA]
+        f = np.dot(np.dot(np.dot(phiBurst(mec), expQEEA), -mec.QAA),
+            endBurst(mec))
+    else:
+        # phiB is zero outside A, so only the AA block of exp(QEE t) is used.
+        phiE = np.append(phiBurst(mec), np.zeros(mec.kB))
+        pA = qml.phi_expQt(phiE, mec.QEE, t)[:, :mec.kA]
+        f = np.dot(np.dot(pA, -mec.QAA), endBurst(mec))[:, 0]
     return f
 
 def length_pdf_components(mec):
@@ -140,18 +148,22 @@ def length_cond_pdf(mec, t):
     ----------
     mec : dcpyps.Mechanism
         The mechanism to be analysed.
-    t : float
+    t : float or array_like, shape (n,)
         Length.
 
     Returns
     -------
-    vec : array_like, shape (kA, 1)
+    vec : array_like, shape (1, kA) or (n, kA)
         Probability of seeing burst length t depending on starting state.
     """
 
-    expQEEA = qml.expQt(mec.QEE, t)[:mec.kA, :mec.kA]
-    vec = np.dot(np.dot(expQEEA, -mec.QAA), endBurst(mec))
-    vec = vec.transpose()
+    if np.isscalar(t):
+        expQEEA = qml.expQt(mec.QEE, t)[:mec.kA, :mec.kA]
+        vec = np.dot(np.dot(expQEEA, -mec.QAA), endBurst(mec))
+        vec = vec.transpose()
+    else:
+        expQEEA = qml.expQt_times(mec.QEE, t)[:, :mec.kA, :mec.kA]
+        vec = np.dot(np.dot(expQEEA, -mec.QAA), endBurst(mec))[:, :, 0]
     return vec
 
 def length_no_single_openings_pdf_components(mec):
@@ -50,13 +50,9 @@ def Popen(mec, tres):
     points = 512
 
     c = np.logspace(log_start, log_end, points)
-    pe = np.zeros(points)
-    pi = np.zeros(points)
-    H = np.zeros(points)
-    for i in range(points):
-        pe[i] = popen.Popen(mec, tres, c[i])
-        pi[i] = popen.Popen(mec, 0, c[i])
-        H[i] = pmax / (math.pow((iEC50 / c[i]), nH) + 1) # Hill equation
+    pe = popen.Popen_curve(mec, tres, c)
+    pi = popen.Popen_curve(mec, 0, c)
+    H = pmax / (np.power((iEC50 / c), nH) + 1) # Hill equation
 
     c = c * 1000000 # x axis in microM
 
@@ -99,9 +95,7 @@ def burst_length_pdf(mec, multicomp=False, conditional=False,
         return t * 1000, fbst, mfbst
 
     if conditional:
-        cfbst = np.zeros((points, mec.kA))
-        for i in range(points):
-            cfbst[i] = t[i] * scburst.length_cond_pdf(mec, t[i])
+        cfbst = t[:, np.newaxis] * scburst.length_cond_pdf(mec, t)
         cfbrst = cfbst.transpose()
         return t * 1000, fbst, cfbrst
 
@@ -175,15 +169,13 @@ def corr_open_shut(mec, lag):
     varF = scl.corr_variance_A(phiF, mec.QII, kF)
     
     r = np.arange(1, lag + 1)
-    roA, roF, roAF = np.zeros(lag), np.zeros(lag), np.zeros(lag)
-    for i in range(lag):
-        covA = scl.corr_covariance_A(i+1, phiA, mec.QAA, XAA, kA)
-        roA[i] = scl.correlation_coefficient(covA, varA, varA)
-        covF = scl.corr_covariance_A(i+1, phiF, mec.QII, XFF, kF)
-        roF[i] = scl.correlation_coefficient(covF, varF, varF)
-        covAF = scl.corr_covariance_AF(i+1, phiA, mec.QAA, mec.QII,
-            XAA, GAF, kA, kF)
-        roAF[i] = scl.correlation_coefficient(covAF, varA, varF)
+    covA = scl.corr_covariance_A(r, phiA, mec.QAA, XAA, kA)
+    roA = scl.correlation_coefficient(covA, varA, varA)
+    covF = scl.corr_covariance_A(r, phiF, mec.QII, XFF, kF)
+    roF = scl.correlation_coefficient(covF, varF, varF)
+    covAF = scl.corr_covariance_AF(r, phiA, mec.QAA, mec.QII,
+        XAA, GAF, kA, kF)
+    roAF = scl.correlation_coefficient(covAF, varA, varF)
             
     return r, roA, roF, roAF
 
@@ -325,7 +317,8 @@ def conc_jump_on_off_taus_versus_conc_plot(mec, cmin, cmax, width):
 
     return c * 1000, wton * 1000, ton * 1000, wtoff * 1000, toff * 1000
 
-def open_time_pdf(mec, tres, tmin=0.00001, tmax=1000, points=512, unit='ms'):
+def open_time_pdf(mec, tres, tmin=0.00001, tmax=1000, points=512, unit='ms',
+    ctx=None):
     """
     Calculate ideal asymptotic and exact open time distributions.
 
@@ -340,6 +333,8 @@ def open_time_pdf(mec, tres, tmin=0.00001, tmax=1000, points=512, unit='ms'):
         Number of points per plot.
     unit : str
         'ms'- milliseconds.
+    ctx : HJCContext, optional
+        Missed events intermediates for mec.Q and tres.
 
     Returns
     -------
@@ -350,10 +345,11 @@ def open_time_pdf(mec, tres, tmin=0.00001, tmax=1000, points=512, unit='ms'):
     """
 
     open = True
+    if ctx is None:
+        ctx = scl.HJCContext(mec.Q, mec.kA, tres, kF=mec.kF)
 
     # Asymptotic pdf
-    roots = scl.asymptotic_roots(tres,
-        mec.QAA, mec.QII, mec.QAI, mec.QIA, mec.kA, mec.kI)
+    roots = ctx.Aroots
 
     tmax = (-1 / roots.max()) * 20
     t = np.logspace(math.log10(tmin), math.log10(tmax), points)
@@ -364,19 +360,14 @@ def open_time_pdf(mec, tres, tmin=0.00001, tmax=1000, points=512, unit='ms'):
     ipdf = t * pdfs.expPDF(t, 1 / eigs, w / eigs) * fac
 
     # Asymptotic pdf
-    GAF, GFA = qml.iGs(mec.Q, mec.kA, mec.kI)
-    areas = scl.asymptotic_areas(tres, roots,
-        mec.QAA, mec.QII, mec.QAI, mec.QIA,
-        mec.kA, mec.kI, GAF, GFA)
+    areas = ctx.Aareas
     apdf = scl.asymptotic_pdf(t, tres, -1 / roots, areas)
 
     # Exact pdf
     eigvals, gamma00, gamma10, gamma11 = scl.exact_GAMAxx(mec,
-        tres, open)
-    epdf = np.zeros(points)
-    for i in range(points):
-        epdf[i] = (t[i] * scl.exact_pdf(t[i], tres,
-            roots, areas, eigvals, gamma00, gamma10, gamma11))
+        tres, open, ctx)
+    epdf = t * scl.exact_pdf(t, tres,
+        roots, areas, eigvals, gamma00, gamma10, gamma11)
             
     if unit == 'ms':
         t = t * 1000 # x scale in millisec
@@ -453,7 +444,8 @@ def scaled_pdf(t, pdf, dt, n):
     #spdf = n * dt * pdf
     return spdf
 
-def shut_time_pdf(mec, tres, tmin=0.00001, tmax=1000, points=512, unit='ms'):
+def shut_time_pdf(mec, tres, tmin=0.00001, tmax=1000, points=512, unit='ms',
+    ctx=None):
     """
     Calculate ideal asymptotic and exact shut time distributions.
 
@@ -468,6 +460,8 @@ def shut_time_pdf(mec, tres, tmin=0.00001, tmax=1000, points=512, unit='ms'):
         Number of points per plot.
     unit : str
         'ms'- milliseconds.
+    ctx : HJCContext, optional
+        Missed events intermediates for mec.Q and tres.
 
     Returns
     -------
@@ -478,10 +472,11 @@ def shut_time_pdf(mec, tres, tmin=0.00001, tmax=1000, points=512, unit='ms'):
     """
 
     open = False
+    if ctx is None:
+        ctx = scl.HJCContext(mec.Q, mec.kA, tres, kF=mec.kF)
 
     # Asymptotic pdf
-    roots = scl.asymptotic_roots(tres, mec.QII, mec.QAA, mec.QIA, mec.QAI,
-        mec.kI, mec.kA)
+    roots = ctx.Froots
 
     tmax = (-1 / roots.max()) * 20
     t = np.logspace(math.log10(tmin), math.log10(tmax), points)
@@ -492,18 +487,13 @@ def shut_time_pdf(mec, tres, tmin=0.00001, tmax=1000, points=512, unit='ms'):
     ipdf = t * pdfs.expPDF(t, 1 / eigs, w / eigs) * fac
 
     # Asymptotic pdf
-    GAF, GFA = qml.iGs(mec.Q, mec.kA, mec.kI)
-    areas = scl.asymptotic_areas(tres, roots,
-        mec.QII, mec.QAA, mec.QIA, mec.QAI,
-        mec.kI, mec.kA, GFA, GAF)
+    areas = ctx.Fareas
     apdf = scl.asymptotic_pdf(t, tres, -1 / roots, areas)
 
     # Exact pdf
-    eigvals, gamma00, gamma10, gamma11 = scl.exact_GAMAxx(mec, tres, open)
-    epdf = np.zeros(points)
-    for i in range(points):
-        epdf[i] = (t[i] * scl.exact_pdf(t[i], tres,
-            roots, areas, eigvals, gamma00, gamma10, gamma11))
+    eigvals, gamma00, gamma10, gamma11 = scl.exact_GAMAxx(mec, tres, open, ctx)
+    epdf = t * scl.exact_pdf(t, tres,
+        roots, areas, eigvals, gamma00, gamma10, gamma11)
 
     if unit == 'ms':
         t = t * 1000 # x scale in millisec
@@ -549,10 +539,7 @@ def subset_time_pdf(mec, tres, state1, state2,
     fac = 1 / np.sum((w / eigs) * np.exp(-tres * eigs)) # Scale factor
     ipdf = t * pdfs.expPDF(t, 1 / eigs, w / eigs) * fac
 
-    spdf = np.zeros(points)
-    for i in range(points):
-        spdf[i] = t[i] * scl.ideal_subset_time_pdf(mec.Q,
-            state1, state2, t[i]) * fac
+    spdf = t * scl.ideal_subset_time_pdf(mec.Q, state1, state2, t) * fac
 
     if unit == 'ms':
         t = t * 1000 # x scale in millisec
@@ -7,6 +7,7 @@ from scalcs import cjumps
 from scalcs import scalcslib as scl
 from scalcs import scplotlib as scpl
 from scalcs import qmatlib as qml
+from scalcs.bursts import Bursts
 from dcpyps import dcio
 from dcpyps import dataset
 
@@ -15,6 +16,29 @@ import time
 import unittest
 import numpy as np
 
+class MechanismD(object):
+    """
+    View of a mechanism with its last shut state taken as a kD state, so
+    that kF < k - kA; submatrices are sliced as in dcpyps.Mechanism.
+    """
+
+    def __init__(self, mec):
+        self.mec = mec
+        self.k, self.kA, self.kD = mec.k, mec.kA, 1
+        self.kF = mec.k - mec.kA - 1
+        self.fastblock = False
+
+    Q = property(lambda self: self.mec.Q)
+    QAA = property(lambda self: self.Q[:self.kA, :self.kA])
+    QAF = property(lambda self: self.Q[:self.kA, self.kA:-1])
+    QFA = property(lambda self: self.Q[self.kA:-1, :self.kA])
+    QFF = property(lambda self: self.Q[self.kA:-1, self.kA:-1])
+    QIA = property(lambda self: self.Q[self.kA:, :self.kA])
+
+    def __getattr__(self, name):
+        # theta, theta_unsqueeze, set_eff, unit_rates.
+        return getattr(self.mec, name)
+
 class TestDC_PyPs(unittest.TestCase):
 
     def setUp(self):
@@ -248,3 +272,647 @@ class TestDC_PyPs(unittest.TestCase):
         # POPEN CURVE CALCULATIONS
         c, pe, pi = scpl.Popen(self.mec, self.tres)
         self.assertTrue(pi[-1]>0.967 and pi[-1]<0.969)
+
+    def test_batch(self):
+
+        # Stack of Q matrices, one per concentration.
+        Qs = []
+        for conc in [1e-9, 1e-7, 1e-5]:
+            self.mec.set_eff('c', conc)
+            Qs.append(self.mec.Q.copy())
+        Qs = np.array(Qs)
+
+        eigvals, A = qml.eigs_sorted_batch(-Qs)
+        expQ = qml.expQt_batch(Qs, self.tres)
+        pinf = qml.pinf_batch(Qs)
+        for i in range(Qs.shape[0]):
+            eigs1, A1 = qml.eigs_sorted(-Qs[i])
+            self.assertTrue(np.allclose(eigvals[i], eigs1))
+            self.assertTrue(np.allclose(A[i], A1))
+            self.assertTrue(np.allclose(expQ[i], qml.expQt(Qs[i], self.tres)))
+            self.assertTrue(np.allclose(pinf[i], qml.pinf(Qs[i])))
+
+    def test_expQt_times(self):
+
+        t = np.array([0.00005, 0.0001, 0.001, 0.01])
+        expQ = qml.expQt_times(self.mec.QAA, t)
+        phiA = qml.phiA(self.mec)
+        p = qml.phi_expQt(phiA, self.mec.QAA, t)
+        for i in range(t.shape[0]):
+            expQ1 = qml.expQt(self.mec.QAA, t[i])
+            self.assertTrue(np.allclose(expQ[i], expQ1))
+            self.assertTrue(np.allclose(p[i], np.dot(phiA, expQ1)))
+
+    def test_cache(self):
+
+        qml.cache_enable(maxsize=4)
+        try:
+            expQ1 = qml.expQt(self.mec.QAA, self.tres)
+            expQ2 = qml.expQt(self.mec.QAA.copy(), self.tres)
+            info = qml.cache_info()
+            self.assertEqual(info.hits, 1)
+            self.assertTrue(np.allclose(expQ1, expQ2))
+            for i in range(10):
+                qml.eigs(self.mec.QAA * (i + 1))
+            self.assertEqual(qml.cache_info().currsize, 4)
+            qml.cache_clear()
+            self.assertEqual(qml.cache_info().hits, 0)
+        finally:
+            qml.cache_disable()
+        self.assertTrue(qml.cache_info() is None)
+
+    def test_eigs_reversible(self):
+
+        # CH82 obeys microscopic reversibility.
+        self.assertTrue(qml.symmetrizer(self.mec.Q) is not None)
+        eigs1, A1 = qml.eigs_sorted(-self.mec.Q, reversible=False)
+        eigs2, A2 = qml.eigs_sorted(-self.mec.Q, reversible=True)
+        self.assertTrue(np.allclose(eigs1, eigs2))
+        self.assertTrue(np.allclose(A1, A2))
+
+        # Birth-death chain with 100 states.
+        k = 100
+        Q = np.zeros((k, k))
+        for i in range(k - 1):
+            Q[i, i+1] = 1000.0 + 10.0 * i
+            Q[i+1, i] = 1500.0 - 5.0 * i
+        Q = Q - np.diag(np.sum(Q, axis=1))
+        eigs1, A1 = qml.eigs_sorted(Q, reversible=False)
+        eigs2, A2 = qml.eigs_sorted(Q, reversible=True)
+        self.assertTrue(np.allclose(eigs1, eigs2))
+        self.assertTrue(np.allclose(A1, A2))
+        self.assertTrue(qml.symmetrizer(Q + np.triu(Q, 2) + 1.0) is None)
+
+    def test_expm_fallback(self):
+
+        qml.expm_info_clear()
+        qml.expQt(self.mec.QAA, self.tres)
+        self.assertEqual(qml.expm_info().spectral, 1)
+        qml.expQt_times(self.mec.QAA, [self.tres, 2 * self.tres])
+        self.assertEqual(qml.expm_info().spectral, 3)
+        # Decompositions that form no exponential are not counted.
+        m = self.mec
+        qml.HEvaluator(self.tres, m.QAA, m.QFF, m.QAF, m.QFA)
+        self.assertEqual(qml.expm_info().spectral, 3)
+        self.assertEqual(qml.expm_info().pade, 0)
+
+        # Strongly drifting birth-death chain: eigenvectors of Q are
+        # ill-conditioned and exponential is calculated by Pade approximation.
+        k = 50
+        Q = np.zeros((k, k))
+        for i in range(k - 1):
+            Q[i, i+1] = 1000.0 * (i + 1)
+            Q[i+1, i] = 500.0
+        Q = Q - np.diag(np.sum(Q, axis=1))
+        expQ = qml.expQt(Q, self.tres)
+        self.assertEqual(qml.expm_info().pade, 1)
+        self.assertTrue(np.allclose(np.sum(expQ, axis=1), 1))
+        self.assertTrue(expQ.min() > -1e-12)
+
+        # Calls served from the cache are counted apart.
+        qml.cache_enable()
+        try:
+            qml.expm_info_clear()
+            qml.expQt(self.mec.QAA, 2 * self.tres)
+            qml.expQt(self.mec.QAA, 2 * self.tres)
+            self.assertEqual(qml.expm_info().cached, 1)
+            self.assertEqual(qml.expm_info().spectral +
+                qml.expm_info().pade, 1)
+        finally:
+            qml.cache_disable()
+
+    def test_factorize(self):
+
+        F = qml.factorize(self.mec.QAA)
+        self.assertFalse(qml.factorize(self.mec.QAA) is F)
+        qml.cache_enable()
+        try:
+            F = qml.factorize(self.mec.QAA)
+            self.assertTrue(qml.factorize(self.mec.QAA.copy()) is F)
+            qml.cache_clear()
+            self.assertFalse(qml.factorize(self.mec.QAA) is F)
+            # Default arguments share an entry with omitted ones.
+            qml.eigs(self.mec.QFF)
+            qml.eigs(self.mec.QFF, None)
+            qml.eigs(self.mec.QFF, reversible=None)
+            self.assertEqual(qml.cache_info().hits, 2)
+        finally:
+            qml.cache_disable()
+        invQAA = np.linalg.inv(self.mec.QAA)
+        B = self.mec.QAF
+        self.assertTrue(np.allclose(F.solve(B), np.dot(invQAA, B)))
+        self.assertTrue(np.allclose(F.rsolve(B.T), np.dot(B.T, invQAA)))
+        self.assertTrue(np.allclose(F.inv(), invQAA))
+
+    def test_spectral(self):
+
+        Q = self.mec.Q
+        eigvals, A = qml.eigs(-Q)
+        spec = qml.eigs_factored(-Q)
+        self.assertTrue(np.allclose(spec.A, A))
+        self.assertTrue(np.allclose(qml.expQt(qml.eigs_factored(Q), 0.001),
+            qml.expQt(Q, 0.001)))
+        self.assertTrue(np.allclose(qml.Qpow(spec, 3), qml.Qpow(-Q, 3)))
+        p0 = qml.pinf(Q)
+        self.assertTrue(np.allclose(cjumps.coefficient_calc(self.mec.k, spec, p0),
+            cjumps.coefficient_calc(self.mec.k, A, p0)))
+        expQFF = qml.expQt(self.mec.QFF, self.tres)
+        Zd = qml.Zxx(Q, eigvals, A, self.mec.kA, self.mec.QFF,
+            self.mec.QAF, self.mec.QFA, expQFF, True)
+        Zs = qml.Zxx(Q, eigvals, spec, self.mec.kA, self.mec.QFF,
+            self.mec.QAF, self.mec.QFA, expQFF, True)
+        for Z1, Z2 in zip(Zd[1:], Zs[1:]):
+            self.assertTrue(np.allclose(Z1, Z2))
+
+    def test_sparse(self):
+
+        import scipy.sparse as scsp
+        QAA = self.mec.QAA
+        phiA = qml.phiA(self.mec)
+        t = np.array([0.002, 0.0001, 0.001])
+        f = scl.ideal_dwell_time_pdf(t, QAA, phiA)
+        fs = scl.ideal_dwell_time_pdf(t, scsp.csr_matrix(QAA), phiA)
+        self.assertTrue(np.allclose(f, fs))
+        self.assertAlmostEqual(scl.ideal_dwell_time_pdf(0.001,
+            scsp.csr_matrix(QAA), phiA), f[2])
+        p0 = qml.pinf(self.mec.Q)
+        self.assertTrue(np.allclose(qml.propagate(p0,
+            scsp.csr_matrix(self.mec.Q), t), qml.propagate(p0, self.mec.Q, t)))
+
+        # Concentration jump propagated on sparse Q.
+        args = (0.00001, 0.0, 0.002, 0.0025)
+        t, c, Popen, P = cjumps.calc_jump(self.mec, 0.005, 0.00005,
+            cjumps.pulse_instexp, args)
+        ts, cs, Popens, Ps = cjumps.calc_jump(self.mec, 0.005, 0.00005,
+            cjumps.pulse_instexp, args, sparse=True)
+        self.assertTrue(np.allclose(P, Ps, atol=1e-10))
+        self.assertTrue(np.allclose(Popen, Popens, atol=1e-10))
+
+        # Ideal likelihood: sparse and dense paths agree on F when kD > 0.
+        opts = {'mec': MechanismD(self.mec), 'conc': self.conc,
+            'data': {0: [0.001, 0.0005, 0.002], 1: [0.0003]}}
+        theta = np.log(self.mec.theta())
+        self.assertAlmostEqual(scl.likelihood(theta, dict(opts,
+            sparse=True))[0], scl.likelihood(theta, opts)[0], 8)
+
+    def test_pinf(self):
+
+        Q = self.mec.Q
+        p = qml.pinf(Q)
+        self.assertTrue(np.allclose(np.dot(p, Q), 0))
+        self.assertTrue(np.allclose(qml.pinf1(Q), p))
+        import scipy.sparse as scsp
+        self.assertTrue(np.allclose(qml.pinf(scsp.csr_matrix(Q)), p))
+        conc = np.array([1e-8, 1e-6, 1e-4])
+        Qs = []
+        for c in conc:
+            self.mec.set_eff('c', c)
+            Qs.append(self.mec.Q.copy())
+        P = qml.pinf(np.array(Qs))
+        for i in range(conc.shape[0]):
+            self.assertTrue(np.allclose(P[i], qml.pinf(Qs[i])))
+        pc = popen.Popen_curve(self.mec, 0, conc)
+        for i in range(conc.shape[0]):
+            self.assertAlmostEqual(pc[i], popen.Popen(self.mec, 0, conc[i]), 12)
+
+    def test_Qpow(self):
+
+        GAF, GFA = qml.iGs(self.mec.Q, self.mec.kA, self.mec.kI)
+        XAA = np.dot(GAF, GFA)
+        lags = np.arange(1, 6)
+        Xn = qml.Qpow(XAA, lags)
+        for i, n in enumerate(lags):
+            self.assertTrue(np.allclose(Xn[i], np.linalg.matrix_power(XAA, n)))
+        phiA = qml.phiA(self.mec).reshape((1, self.mec.kA))
+        cov = scl.corr_covariance_A(lags, phiA, self.mec.QAA, XAA,
+            self.mec.kA)
+        for i, n in enumerate(lags):
+            self.assertAlmostEqual(cov[i], scl.corr_covariance_A(n, phiA,
+                self.mec.QAA, XAA, self.mec.kA), 15)
+
+    def test_HEvaluator(self):
+
+        m = self.mec
+        hev = qml.HEvaluator(self.tres, m.QAA, m.QFF, m.QAF, m.QFA)
+        s = np.array([-10., -1000., -2e4])
+        H = hev.H(s)
+        detW = hev.detW(s)
+        dW = hev.dW(s)
+        for i in range(s.shape[0]):
+            self.assertTrue(np.allclose(H[i], qml.H(s[i], self.tres,
+                m.QAA, m.QFF, m.QAF, m.QFA, m.kF)))
+            self.assertAlmostEqual(detW[i] / qml.detW(s[i], self.tres,
+                m.QAA, m.QFF, m.QAF, m.QFA, m.kA, m.kF), 1, 12)
+            self.assertTrue(np.allclose(dW[i], qml.dW(s[i], self.tres,
+                m.QAF, m.QFF, m.QFA, m.kA, m.kF)))
+            self.assertEqual(hev.count(s[i]), scl.bisect_gFB(s[i],
+                self.tres, m.QAA, m.QFF, m.QAF, m.QFA, m.kA, m.kF))
+        # Removable singularity at eigenvalues of QFF.
+        l = np.linalg.eigvals(m.QFF)[0].real
+        self.assertTrue(np.allclose(hev.H(l), hev.H(l * (1 + 1e-9))))
+
+    def test_roots_newton(self):
+
+        m = self.mec
+        for args in [(m.QAA, m.QFF, m.QAF, m.QFA, m.kA, m.kF),
+            (m.QFF, m.QAA, m.QFA, m.QAF, m.kF, m.kA)]:
+            r1 = scl.asymptotic_roots(self.tres, *args)
+            r2 = scl.asymptotic_roots(self.tres, *args, method='newton')
+            self.assertTrue(np.allclose(r1, r2, rtol=1e-12))
+
+        # Evaluations of W'(s) are counted with those of H(s).
+        hev = qml.HEvaluator(self.tres, m.QAA, m.QFF, m.QAF, m.QFA)
+        hev.H(np.array([-10., -100.]))
+        hev.dW(-10.)
+        self.assertEqual(hev.nevals, 3)
+        W, dW = hev.W_dW(np.array([-10., -100.]))
+        self.assertEqual(hev.nevals, 5)
+        self.assertTrue(np.allclose(W, hev.W(np.array([-10., -100.]))))
+        self.assertTrue(np.allclose(dW, hev.dW(np.array([-10., -100.]))))
+
+        # Newton needs clearly fewer evaluations per root than brentq.
+        args = (m.QAA, m.QFF, m.QAF, m.QFA, m.kA, m.kF)
+        hev = qml.HEvaluator(self.tres, *args[:4])
+        scl.bisect_intervals(-1000000, -0.0000001, self.tres, *args, hev=hev)
+        nevals = {}
+        for method in ('brentq', 'newton'):
+            hev.nevals = 0
+            scl.asymptotic_roots(self.tres, *args, method=method, hev=hev)
+            nevals[method] = hev.nevals
+        hev.nevals = 0
+        scl.bisect_intervals(-1000000, -0.0000001, self.tres, *args, hev=hev)
+        self.assertTrue(nevals['newton'] - hev.nevals <
+            0.6 * (nevals['brentq'] - hev.nevals))
+
+    def test_root_tracker(self):
+
+        m = self.mec
+        tracker = scl.RootTracker()
+        for conc in (100e-9, 110e-9, 120e-9):
+            m.set_eff('c', conc)
+            args = (m.QAA, m.QFF, m.QAF, m.QFA, m.kA, m.kF)
+            roots = scl.asymptotic_roots(self.tres, *args, tracker=tracker)
+            self.assertTrue(np.allclose(roots,
+                scl.asymptotic_roots(self.tres, *args), rtol=1e-12))
+        self.assertEqual(tracker.full, 1)
+        self.assertEqual(tracker.warm, 2)
+
+    def test_Zxx(self):
+
+        m = self.mec
+        expQFF = qml.expQt(m.QFF, self.tres)
+        expQAA = qml.expQt(m.QAA, self.tres)
+        eigen, A = qml.eigs(-m.Q)
+        Z = qml.ZxxAF(m.Q, m.kA, m.QAA, m.QFF, m.QAF, m.QFA, expQAA, expQFF)
+        AZ = qml.Zxx(m.Q, eigen, A, m.kA, m.QFF, m.QAF, m.QFA, expQFF, True)
+        FZ = qml.Zxx(m.Q, eigen, A, m.kA, m.QAA, m.QFA, m.QAF, expQAA, False)
+        # Explicit loop of Eq. 3.18 (HJC90) for C10 of the open time pdf.
+        C00, A1 = A[:, :m.kA, :m.kA], A[:, :m.kA, m.kA:]
+        D = np.dot(np.dot(A1, expQFF), m.QFA)
+        C10 = np.zeros((m.k, m.kA, m.kA))
+        for i in range(m.k):
+            for j in range(m.k):
+                if j != i:
+                    C10[i] += ((np.dot(D[i], C00[j]) + np.dot(D[j], C00[i]))
+                        / (eigen[j] - eigen[i]))
+        self.assertTrue(np.allclose(AZ[2], np.dot(C10,
+            np.dot(m.QAF, expQFF))))
+        for Z1, Z2 in zip(Z[1:], AZ[1:] + FZ[1:]):
+            self.assertTrue(np.allclose(Z1, Z2))
+
+    def test_AR(self):
+
+        m = self.mec
+        roots = scl.asymptotic_roots(self.tres,
+            m.QAA, m.QFF, m.QAF, m.QFA, m.kA, m.kF)
+        R = qml.AR(roots, self.tres, m.QAA, m.QFF, m.QAF, m.QFA, m.kA, m.kF)
+        for i in range(m.kA):
+            WA = qml.W(roots[i], self.tres, m.QAA, m.QFF, m.QAF, m.QFA,
+                m.kA, m.kF)
+            row, col = qml.pinf(WA), qml.pinf(WA.T)
+            W1A = qml.dW(roots[i], self.tres, m.QAF, m.QFF, m.QFA, m.kA, m.kF)
+            Ri = np.outer(col, row) / np.dot(np.dot(row, W1A), col)
+            self.assertTrue(np.allclose(R[i], Ri))
+        GAF, GFA = qml.iGs(m.Q, m.kA, m.kF)
+        Rs, areas = scl.asymptotic_R_areas(self.tres, roots, m.QAA, m.QFF,
+            m.QAF, m.QFA, m.kA, m.kF, GAF, GFA, factored=True)
+        self.assertTrue(np.allclose(Rs.A, R))
+        self.assertTrue(np.allclose(areas, scl.asymptotic_areas(self.tres,
+            roots, m.QAA, m.QFF, m.QAF, m.QFA, m.kA, m.kF, GAF, GFA)))
+
+    def test_eGAF_times(self):
+
+        m = self.mec
+        tres = self.tres
+        expQFF = qml.expQt(m.QFF, tres)
+        expQAA = qml.expQt(m.QAA, tres)
+        Z = qml.ZxxAF(m.Q, m.kA, m.QAA, m.QFF, m.QAF, m.QFA, expQAA, expQFF)
+        roots = scl.asymptotic_roots(tres,
+            m.QAA, m.QFF, m.QAF, m.QFA, m.kA, m.kF)
+        R = qml.AR(roots, tres, m.QAA, m.QFF, m.QAF, m.QFA, m.kA, m.kF)
+        t = np.array([1.5, 2, 2.5, 3, 4, 50]) * tres
+        eGAFt = qml.eGAF_times(t, tres, Z[0], Z[1], Z[2], Z[3], roots, R,
+            m.QAF, expQFF)
+        for i in range(t.shape[0]):
+            self.assertTrue(np.allclose(eGAFt[i], qml.eGAF(t[i], tres, Z[0],
+                Z[1], Z[2], Z[3], roots, R, m.QAF, expQFF)))
+
+    def test_exact_pdf_array(self):
+
+        m = self.mec
+        tres = self.tres
+        roots = scl.asymptotic_roots(tres,
+            m.QAA, m.QFF, m.QAF, m.QFA, m.kA, m.kF)
+        GAF, GFA = qml.iGs(m.Q, m.kA, m.kF)
+        areas = scl.asymptotic_areas(tres, roots,
+            m.QAA, m.QFF, m.QAF, m.QFA, m.kA, m.kF, GAF, GFA)
+        eigvals, g00, g10, g11 = scl.exact_GAMAxx(m, tres, True)
+        t = np.concatenate((np.array([0.5, 1, 1.5, 2, 2.5, 3]) * tres,
+            np.logspace(-5, -1, 50)))
+        f = scl.exact_pdf(t, tres, roots, areas, eigvals, g00, g10, g11,
+            chunk=7)
+        for i in range(t.shape[0]):
+            self.assertAlmostEqual(f[i], scl.exact_pdf(t[i], tres,
+                roots, areas, eigvals, g00, g10, g11), 8)
+
+    def test_hjc_context(self):
+
+        m = self.mec
+        tres = self.tres
+        ctx = scl.HJCContext(m.Q, m.kA, tres)
+        roots = scl.asymptotic_roots(tres,
+            m.QAA, m.QFF, m.QAF, m.QFA, m.kA, m.kF)
+        GAF, GFA = qml.iGs(m.Q, m.kA, m.kF)
+        areas = scl.asymptotic_areas(tres, roots,
+            m.QAA, m.QFF, m.QAF, m.QFA, m.kA, m.kF, GAF, GFA)
+        self.assertTrue(np.allclose(ctx.Aroots, roots))
+        self.assertTrue(np.allclose(ctx.Aareas, areas))
+        self.assertAlmostEqual(ctx.meanF, scl.exact_mean_time(tres,
+            m.QFF, m.QAA, m.QFA, m.kF, m.kA, GFA, GAF), 12)
+        self.assertTrue(ctx.Froots is ctx.Froots)
+        Q = m.Q.copy()
+        ctx3 = scl.HJCContext(Q, m.kA, tres)
+        Q[0, 0] = 0
+        self.assertTrue(np.allclose(ctx3.Aroots, roots))
+        ctx2 = ctx.with_tres(2 * tres)
+        self.assertTrue(ctx2.spec is ctx.spec)
+        # Evaluators of H(s) reuse the decompositions of QFF and QAA.
+        self.assertTrue(ctx2.hevA.eigvals is ctx.specFF.eigvals)
+        self.assertTrue(ctx2.hevF.eigvals is ctx.specAA.eigvals)
+        self.assertTrue(np.allclose(ctx2.Fareas, scl.HJCContext(m.Q, m.kA,
+            2 * tres).Fareas))
+
+    def test_hjc_context_kD(self):
+
+        # Shut states are those of mec.QFF; the kD state is left out.
+        m, mD, tres = self.mec, MechanismD(self.mec), self.tres
+        ctx = scl.HJCContext(mD.Q, mD.kA, tres, kF=mD.kF)
+        self.assertTrue(np.array_equal(ctx.QFF, mD.QFF))
+        GAF, GFA = qml.iGs(mD.Q, mD.kA, mD.kF)
+        meanA = scl.exact_mean_time(tres, mD.QAA, mD.QFF, mD.QAF,
+            mD.kA, mD.kF, GAF, GFA)
+        meanF = scl.exact_mean_time(tres, mD.QFF, mD.QAA, mD.QFA,
+            mD.kF, mD.kA, GFA, GAF)
+        self.assertAlmostEqual(popen.Popen(mD, tres, self.conc) /
+            (meanA / (meanA + meanF)), 1, 12)
+        self.assertNotAlmostEqual(popen.Popen(mD, tres, self.conc),
+            popen.Popen(m, tres, self.conc), 6)
+
+        # HJC likelihood: both engines agree on the same F block.
+        bursts = {0: [0.001, 0.0005, 0.002], 1: [0.0003]}
+        opts = {'mec': mD, 'conc': self.conc, 'tres': tres,
+            'tcrit': self.tcrit, 'isCHS': True, 'data': bursts}
+        theta = np.log(m.theta())
+        lik = scl.HJClik(theta, opts)[0]
+        self.assertAlmostEqual(scl.HJClik(theta, dict(opts,
+            batch=True))[0], lik, 10)
+        self.assertNotAlmostEqual(scl.HJClik(theta, dict(opts,
+            mec=m))[0], lik, 6)
+
+    def test_tres_sweep(self):
+
+        m = self.mec
+        tres = np.array([20e-6, 50e-6, 100e-6, 200e-6])
+        Ataus, Aareas, Ftaus, Fareas, meanA, meanF, po = scl.tres_sweep(m,
+            tres, self.conc)
+        for i in range(tres.shape[0]):
+            ctx = scl.HJCContext(m.Q, m.kA, tres[i])
+            self.assertTrue(np.allclose(Ataus[i], -1 / ctx.Aroots))
+            self.assertTrue(np.allclose(Fareas[i], ctx.Fareas))
+            self.assertAlmostEqual(po[i], popen.Popen(m, tres[i], self.conc),
+                10)
+
+        # Fast block correction needs the concentration.
+        m.fastblock, m.fastKB = True, 1e-6
+        self.assertRaises(ValueError, scl.tres_sweep, m, tres)
+        po = scl.tres_sweep(m, tres, self.conc)[-1]
+        for i in range(tres.shape[0]):
+            self.assertAlmostEqual(po[i], popen.Popen(m, tres[i], self.conc),
+                10)
+
+    def test_eGAF_tswitch(self):
+
+        m = self.mec
+        tres = self.tres
+        ctx = scl.HJCContext(m.Q, m.kA, tres, switch_tol=1e-6)
+        self.assertTrue(tres <= ctx.Atswitch <= 3 * tres)
+        t = np.linspace(tres, 5 * tres, 41)
+        eGAFt = ctx.eGAF_times(t)
+        Z00, Z10, Z11 = ctx.AZ
+        exact = qml.eGAF_times(t, tres, ctx.eigvals, Z00, Z10, Z11,
+            ctx.Aroots, ctx.AR, m.QAF, ctx.expQFF)
+        self.assertTrue(np.abs(eGAFt - exact).max() <
+            1e-5 * np.abs(exact).max())
+        self.assertEqual(ctx.paths['exact'] + ctx.paths['asymptotic'], 41)
+        self.assertEqual(ctx.paths['exact'],
+            np.count_nonzero(t < ctx.Atswitch))
+
+    def test_HJClik_batch(self):
+
+        np.random.seed(0)
+        bursts = {}
+        for i in range(20):
+            n = 2 * np.random.randint(0, 6) + 1
+            bursts[i] = list(self.tres + np.random.exponential(0.001, n))
+        opts = {'mec': self.mec, 'conc': self.conc, 'tres': self.tres,
+            'tcrit': self.tcrit, 'isCHS': True, 'data': bursts}
+        theta = np.log(self.mec.theta())
+        opts['paths'] = {'exact': 0, 'asymptotic': 0}
+        lik, th = scl.HJClik(theta, opts)
+        paths = opts.pop('paths')
+        self.assertEqual(paths['exact'] + paths['asymptotic'],
+            sum(len(b) for b in bursts.values()))
+        opts['batch'], opts['paths'] = True, {'exact': 0, 'asymptotic': 0}
+        likb, th = scl.HJClik(theta, opts)
+        self.assertAlmostEqual(lik, likb, 8)
+        self.assertEqual(opts.pop('paths'), paths)
+
+        # Rescaling of long bursts is undone by both engines alike.
+        opts['data'] = {0: list(self.tres + np.random.exponential(0.001,
+            2001))}
+        opts['batch'] = False
+        lik = scl.HJClik(theta, opts)[0]
+        opts['batch'] = True
+        self.assertAlmostEqual(scl.HJClik(theta, opts)[0] / lik, 1, 10)
+
+        # Bursts must start and end with an opening.
+        for bad in ([], [0.001, 0.002]):
+            opts['data'] = {0: bursts[0], 1: bad}
+            self.assertRaises(ValueError, scl.HJClik, theta, opts)
+
+    def test_chain_product(self):
+
+        np.random.seed(1)
+        M = np.random.rand(4, 7, 3, 3)
+        P, logscale = qml.chain_product(M)
+        for i in range(4):
+            Pi = np.eye(3)
+            for j in range(7):
+                Pi = np.dot(Pi, M[i, j])
+            self.assertTrue(np.allclose(P[i] * np.exp(logscale[i]), Pi))
+        P, logscale = qml.chain_product(np.tile(100 * np.eye(2),
+            (1, 400, 1, 1)))
+        self.assertAlmostEqual(logscale[0], 400 * np.log(100), 8)
+        Mc = M * np.exp(1j * np.random.rand(4, 7, 3, 3))
+        P, logscale = qml.chain_product(Mc)
+        Pc = Mc[0, 0]
+        for j in range(1, 7):
+            Pc = np.dot(Pc, Mc[0, j])
+        self.assertTrue(np.allclose(P[0] * np.exp(logscale[0]), Pc))
+
+    def test_hjcpool(self):
+
+        from scalcs import hjcpool
+        np.random.seed(0)
+        bursts = {}
+        for i in range(12):
+            n = 2 * np.random.randint(0, 6) + 1
+            bursts[i] = list(self.tres + np.random.exponential(0.001, n))
+        opts = {'mec': self.mec, 'conc': self.conc, 'tres': self.tres,
+            'tcrit': self.tcrit, 'isCHS': True, 'data': bursts}
+        theta = np.log(self.mec.theta())
+        lik, th = scl.HJClik(theta, opts)
+        with hjcpool.HJCPool(opts, processes=3) as pool:
+            likp, thp = pool(theta, opts)
+            self.assertRaises(ValueError, pool, theta,
+                dict(opts, conc=2 * self.conc))
+        self.assertAlmostEqual(lik, likp, 8)
+        self.assertTrue(np.allclose(th, thp))
+
+        # Shared memory is released when an unclosed pool is collected.
+        pool = hjcpool.HJCPool(opts, processes=2)
+        name = pool._shm[0].name
+        del pool
+        from multiprocessing import shared_memory
+        self.assertRaises(FileNotFoundError, shared_memory.SharedMemory,
+            name=name)
+
+        # One long burst leaves shards empty; they get no worker.
+        bursts[0] = bursts[0] * 101
+        opts['data'] = dict(bursts)
+        with hjcpool.HJCPool(opts, processes=6) as pool:
+            self.assertTrue(np.all(np.diff(pool.bounds) > 0))
+            self.assertEqual(pool.processes, len(pool.bounds) - 1)
+            self.assertAlmostEqual(scl.HJClik(theta,
+                dict(opts, batch=True))[0], pool(theta)[0], 8)
+
+        # Likelihood of the second shard underflows: total fails as well.
+        opts['data'] = {0: [0.001], 1: [1e4, 0.001, 0.002]}
+        with hjcpool.HJCPool(opts, processes=2) as pool:
+            self.assertEqual(pool(theta)[0], 0)
+
+    def test_bursts(self):
+
+        np.random.seed(2)
+        data = {}
+        for i in range(10):
+            n = 2 * np.random.randint(0, 4) + 1
+            data[i] = list(self.tres + np.random.exponential(0.001, n))
+        bursts = Bursts.from_dict(data)
+        self.assertEqual(bursts.to_dict(), data)
+        self.assertEqual(len(bursts), 10)
+        self.assertTrue(np.array_equal(bursts[3], data[3]))
+        opts = {'mec': self.mec, 'conc': self.conc, 'tres': self.tres,
+            'tcrit': self.tcrit, 'isCHS': True, 'data': data}
+        theta = np.log(self.mec.theta())
+        lik1 = scl.HJClik(theta, opts)[0]
+        self.assertTrue(opts['data'] is data)
+        self.assertTrue(scl.HJClik(theta, opts)[0] == lik1)
+        self.assertTrue(opts['_bursts'][0] is data)
+        # In-place changes are seen only after opts['_bursts'] is dropped.
+        data[0][0] *= 2
+        self.assertTrue(scl.HJClik(theta, opts)[0] == lik1)
+        del opts['_bursts']
+        self.assertNotAlmostEqual(scl.HJClik(theta, opts)[0], lik1, 8)
+        data[0][0] /= 2
+        opts['data'] = dict(data)
+        self.assertTrue(scl.HJClik(theta, opts)[0] == lik1)
+        opts['data'] = bursts
+        self.assertAlmostEqual(scl.HJClik(theta, opts)[0], lik1, 10)
+        sub = Bursts.from_dict({5: data[5], 2: data[2]})
+        self.assertTrue(np.array_equal(sub.intervals,
+            bursts.subset([2, 5]).intervals))
+
+        # Per-burst concentration; the mechanism is left at opts['conc'].
+        Q = self.mec.Q.copy()
+        conc = np.where(np.arange(10) < 4, self.conc, 2 * self.conc)
+        opts['data'] = Bursts.from_dict(data, conc=conc)
+        lik = scl.HJClik(theta, opts)[0]
+        self.assertTrue(np.array_equal(self.mec.Q, Q))
+        self.assertRaises(ValueError, scl.likelihood, theta,
+            dict(opts, data=Bursts.from_dict(data, tres=self.tres)))
+        # Likelihood of the second group underflows: total fails as well.
+        opts['data'] = Bursts.from_dict({0: [0.001], 1: [1e4, 0.001, 0.002]},
+            conc=[self.conc, 2 * self.conc])
+        self.assertEqual(scl.HJClik(theta, opts)[0], 0)
+        self.assertTrue(np.array_equal(self.mec.Q, Q))
+        # No bursts at all.
+        opts['data'] = Bursts.from_dict({}, conc=[])
+        lik0, th = scl.HJClik(theta, opts)
+        self.assertEqual(lik0, 0)
+        self.assertTrue(np.allclose(th, theta))
+        opts['data'] = dict((i, data[i]) for i in range(4))
+        lik2 = scl.HJClik(theta, opts)[0]
+        opts['data'] = dict((i - 4, data[i]) for i in range(4, 10))
+        opts['conc'] = 2 * self.conc
+        lik2 += scl.HJClik(theta, opts)[0]
+        self.assertAlmostEqual(lik, lik2, 10)
+
+    def test_bursts_unique(self):
+
+        np.random.seed(3)
+        data = {}
+        for i in range(30):
+            n = 2 * np.random.randint(0, 5) + 1
+            # Intervals on a 10 microsec sampling clock.
+            data[i] = list(np.round(self.tres + np.random.exponential(0.0005,
+                n), 5))
+        bursts = Bursts.from_dict(data)
+        topen, tshut, index = bursts.unique()
+        isopen = bursts.isopen
+        self.assertTrue(np.array_equal(topen[index[isopen]],
+            bursts.intervals[isopen]))
+        self.assertTrue(bursts.compression_ratio() > 1)
+        opts = {'mec': self.mec, 'conc': self.conc, 'tres': self.tres,
+            'tcrit': self.tcrit, 'isCHS': True, 'data': bursts, 'batch': True}
+        theta = np.log(self.mec.theta())
+        lik = scl.HJClik(theta, opts)[0]
+        opts['dedup'] = True
+        self.assertAlmostEqual(scl.HJClik(theta, opts)[0], lik, 8)
+
+        # Sub-clock jitter is removed by rounding to the clock.
+        jitter = Bursts(bursts.intervals + np.random.uniform(-4e-6, 4e-6,
+            bursts.intervals.shape[0]), bursts.offsets)
+        opts['data'], opts['quantum'] = jitter, 1e-5
+        opts['compression'] = {'intervals': 0, 'distinct': 0}
+        self.assertAlmostEqual(scl.HJClik(theta, opts)[0], lik, 8)
+        self.assertEqual(jitter.compression_ratio(1e-5, self.tres),
+            bursts.compression_ratio())
+        self.assertEqual(opts['compression']['intervals'] /
+            float(opts['compression']['distinct']),
+            bursts.compression_ratio())
+        # Rounding does not take intervals below tres.
+        short = Bursts(self.tres + np.array([1e-6, 2e-6, 5e-6]), [0, 3])
+        topen, tshut, index = short.unique(3e-5, self.tres)
+        self.assertTrue(topen.min() >= self.tres)
+        self.assertTrue(tshut.min() >= self.tres)